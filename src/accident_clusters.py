@@ -0,0 +1,367 @@
+import os
+import time
+import json
+import argparse
+import threading
+from datetime import datetime
+import numpy as np
+import pandas as pd
+import accident_store
+from accident_spatial_index import _part1by1   # 32-bit 位元展開 (MAX_ZOOM 每軸 2^18 格)
+
+# ==========================================
+# 事故點位 階層式聚合索引 (Hierarchical Cluster Index, supercluster 風格)
+# 原本點位圖層只取 LIMIT 2000 筆任意資料 (瀏覽器端 MarkerCluster 撐不住 150 萬點),
+# 改成在伺服器端預先算好每個縮放層級的聚合點, 查詢時只回傳「可視範圍內、該層級」的聚合點
+# - 以 Web Mercator 像素座標切格子: zoom z 的格子邊長固定 CELL_PX (64 px), 每放大一級格子一分為四
+# - 格子編號用 Morton (Z-order): 上一層的格子 = key >> 2, 子孫格子在排序後是連續區段
+#   -> 由最細層往上 reduceat 合併即可建出整個階層, 任一聚合點都能切出它包含的所有事故
+# - 每個聚合點記錄 expansion_zoom (放大到第幾級才會分開), 點擊後直接跳到該層級
+# - MAX_ZOOM 以上回傳個別事故; 每次查詢的資料量約等於畫面上的格子數 (1000x850 px 約 250 個)
+# 建立: python accident_clusters.py            (由欄式儲存建立, 不存在時先匯出)
+#       python accident_clusters.py --selftest (合成資料, 驗證每個事故都找得到並量測查詢時間)
+# ==========================================
+
+CLUSTER_PATH = os.path.join(accident_store.DATA_CACHE_DIR, "accident_clusters.npz")
+MIN_ZOOM = 0
+MAX_ZOOM = 16                  # 16 級 (含) 以下回傳聚合點, 17 級以上回傳個別事故
+CELL_PX = 64                   # 聚合格子的邊長 (螢幕 px)
+CELL_SHIFT = 2                 # 256 px 圖磚 / 64 px 格子 = 2^2 -> zoom z 每軸有 2^(z+2) 格
+MAX_POINTS = 5000              # 個別事故層級單次最多回傳的點數, 超過時改回傳最細層的聚合點
+MAX_LAT = 85.05112878          # Web Mercator 的緯度上限
+
+_cache = {"mtime": None, "index": None}
+_lock = threading.Lock()
+
+# ==========================================
+# 1. 座標與格子編號
+# ==========================================
+def mercator(lat, lon):
+    """經緯度 -> Web Mercator 正規化座標 (0~1); y 由北往南增加, 與 Leaflet 像素座標方向相同"""
+    lat = np.clip(np.asarray(lat, dtype=np.float64), -MAX_LAT, MAX_LAT)
+    x = (np.asarray(lon, dtype=np.float64) + 180.0) / 360.0
+    s = np.sin(np.radians(lat))
+    y = 0.5 - np.log((1 + s) / (1 - s)) / (4 * np.pi)
+    return x, y
+
+def cells_per_axis(zoom):
+    return 1 << (zoom + CELL_SHIFT)
+
+def cell_xy(x, y, zoom):
+    """正規化座標 -> zoom 層級的格子 (欄, 列)"""
+    n = cells_per_axis(zoom)
+    cx = np.clip(np.floor(np.asarray(x) * n), 0, n - 1).astype(np.int64)
+    cy = np.clip(np.floor(np.asarray(y) * n), 0, n - 1).astype(np.int64)
+    return cx, cy
+
+def cell_key(cx, cy):
+    """(欄, 列) -> Morton key; 上一層的格子為 key >> 2"""
+    return (_part1by1(np.asarray(cy)) << np.uint64(1)) | _part1by1(np.asarray(cx))
+
+def cluster_id(zoom, key):
+    """(層級, 格子 key) -> 聚合點 ID (低 5 bit 放層級)"""
+    return (np.asarray(key).astype(np.int64) << 5) | zoom
+
+def split_cluster_id(cid):
+    return int(cid) & 31, np.uint64(int(cid) >> 5)
+
+# ==========================================
+# 2. 建立索引
+# ==========================================
+def build_levels(lat, lon):
+    """
+    點位座標 -> {"order", "leaf_start", "z{層級}_{欄位}"...}
+    order: 依最細層格子排序後的原始列索引; leaf_start: 最細層每個格子在 order 的起點
+    每個層級: key (uint64) / count / lat / lon (聚合點重心) / point (只有 1 筆時的列索引, 否則 -1) / expand
+    """
+    lat = np.asarray(lat, dtype=np.float64)
+    lon = np.asarray(lon, dtype=np.float64)
+    rows = np.flatnonzero(np.isfinite(lat) & np.isfinite(lon))
+    cx, cy = cell_xy(*mercator(lat[rows], lon[rows]), MAX_ZOOM)
+    keys = cell_key(cx, cy)
+    sort = np.argsort(keys, kind="stable")
+    order = rows[sort]
+    keys = keys[sort]
+
+    level_keys, starts, counts = np.unique(keys, return_index=True, return_counts=True)
+    index = {"order": order.astype(np.int32),
+             "leaf_start": np.append(starts, len(order)).astype(np.int32)}
+    key = level_keys
+    count = counts.astype(np.int64)
+    lat_sum = np.add.reduceat(lat[order], starts) if len(order) else np.zeros(0)
+    lon_sum = np.add.reduceat(lon[order], starts) if len(order) else np.zeros(0)
+    point = np.where(count == 1, order[starts], -1)
+    expand = np.full(len(key), MAX_ZOOM + 1, dtype=np.uint8)
+
+    for zoom in range(MAX_ZOOM, MIN_ZOOM - 1, -1):
+        index.update({
+            f"z{zoom}_key": key, f"z{zoom}_count": count.astype(np.int32),
+            f"z{zoom}_lat": (lat_sum / np.maximum(count, 1)).astype(np.float32),
+            f"z{zoom}_lon": (lon_sum / np.maximum(count, 1)).astype(np.float32),
+            f"z{zoom}_point": point.astype(np.int32), f"z{zoom}_expand": expand,
+        })
+        if zoom == MIN_ZOOM or not len(key):
+            continue
+        # Morton key 排序後, 上一層的 key (>> 2) 也是排序好的: 直接 reduceat 合併子格子
+        parent, starts = np.unique(key >> np.uint64(2), return_index=True)
+        children = np.diff(np.append(starts, len(key)))
+        count = np.add.reduceat(count, starts)
+        lat_sum = np.add.reduceat(lat_sum, starts)
+        lon_sum = np.add.reduceat(lon_sum, starts)
+        point = np.where(count == 1, point[starts], -1)
+        # 有 2 個以上子格子 -> 放大一級就會分開; 只有 1 個 -> 沿用子格子的展開層級
+        expand = np.where(children > 1, zoom, expand[starts]).astype(np.uint8)
+        key = parent
+    return index
+
+def build_clusters(path=CLUSTER_PATH):
+    """由欄式儲存建立聚合索引並寫入 path (欄式儲存不存在時先匯出), 回傳 meta"""
+    started = time.perf_counter()
+    store = accident_store.load_store()
+    if store is None:
+        print("--- [系統] 欄式儲存不存在, 先匯出 accident_main ---")
+        if not accident_store.export_store():
+            return None
+        store = accident_store.load_store()
+
+    print(f"--- [系統] 建立事故聚合索引 ({store['meta']['rows']:,} 筆) ---")
+    index = build_levels(store["lat"], store["lon"])
+    meta = {
+        "rows": int(len(index["order"])),
+        "min_zoom": MIN_ZOOM, "max_zoom": MAX_ZOOM, "cell_px": CELL_PX,
+        "clusters": {z: int(len(index[f"z{z}_key"])) for z in range(MIN_ZOOM, MAX_ZOOM + 1)},
+        "source_version": store["meta"]["built_at"],
+        "built_at": datetime.now().isoformat(timespec="seconds"),
+    }
+    save_clusters(index, meta, path)
+    size_mb = os.path.getsize(path) / 2**20
+    print(f"--- [系統] 事故聚合索引已寫入 {path}: {meta['rows']:,} 筆, "
+          f"{sum(meta['clusters'].values()):,} 個聚合點 ({size_mb:.1f} MB, {time.perf_counter() - started:.1f}s) ---")
+    return meta
+
+def save_clusters(index, meta, path=CLUSTER_PATH):
+    """先寫暫存檔再 os.replace, 讀取端不會讀到寫一半的檔案"""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    with open(tmp_path, "wb") as f:
+        np.savez(f, meta=np.array(json.dumps(meta, ensure_ascii=False)), **index)
+    os.replace(tmp_path, path)
+
+# ==========================================
+# 3. 讀取
+# ==========================================
+def load_clusters(path=CLUSTER_PATH):
+    """回傳 {欄位: 陣列, "meta": dict} (檔案有更新才重新讀取); 不存在時回傳 None"""
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return None
+    if _cache["mtime"] != mtime:
+        with _lock:
+            if _cache["mtime"] != mtime:
+                with np.load(path) as npz:
+                    index = {k: npz[k] for k in npz.files if k != "meta"}
+                    index["meta"] = json.loads(str(npz["meta"]))
+                _cache["index"], _cache["mtime"] = index, mtime
+    return _cache["index"]
+
+def is_available():
+    """聚合索引存在, 且與目前的欄式儲存是同一個版本 (列索引才對得上)"""
+    index, store = load_clusters(), accident_store.load_store()
+    return (index is not None and store is not None
+            and index["meta"]["source_version"] == store["meta"]["built_at"])
+
+def data_version():
+    """聚合索引的版本 (建立時間), 可當快取 key"""
+    index = load_clusters()
+    return index["meta"]["built_at"] if index else None
+
+# ==========================================
+# 4. 查詢
+# bounds 是 (south, west, north, east); zoom 為 Leaflet 的縮放層級
+# 回傳 DataFrame: lat, lon, count, expansion_zoom, cluster_id, point_id (個別事故的列索引, 聚合點為 -1),
+#                 accident_datetime, weather_condition (只有個別事故有值)
+# ==========================================
+def _visible_cells(index, zoom, bounds):
+    """可視範圍內的格子在該層級陣列中的位置 (列舉畫面上的格子再二分搜尋, 不掃描整層)"""
+    south, west, north, east = bounds
+    keys = index[f"z{zoom}_key"]
+    (x0, x1), (y0, y1) = mercator([north, south], [west, east])
+    cx, cy = cell_xy(np.array([x0, x1]), np.array([y0, y1]), zoom)
+    width, height = cx[1] - cx[0] + 1, cy[1] - cy[0] + 1
+    if width <= 0 or height <= 0:
+        return np.array([], dtype=np.int64)
+    if width * height > len(keys):
+        # 範圍比整層還大 (例如低縮放層級看全世界): 直接用重心篩選
+        lat, lon = index[f"z{zoom}_lat"], index[f"z{zoom}_lon"]
+        return np.flatnonzero((lat >= south) & (lat <= north) & (lon >= west) & (lon <= east))
+    gx, gy = np.meshgrid(np.arange(cx[0], cx[1] + 1), np.arange(cy[0], cy[1] + 1))
+    wanted = cell_key(gx.ravel(), gy.ravel())
+    pos = np.searchsorted(keys, wanted)
+    hit = pos < len(keys)
+    hit[hit] = keys[pos[hit]] == wanted[hit]
+    return np.sort(pos[hit])
+
+def _point_rows(index, cells):
+    """最細層格子 -> 包含的原始列索引"""
+    leaf_start = index["leaf_start"]
+    if not len(cells):
+        return np.array([], dtype=np.int64)
+    ranges = [index["order"][leaf_start[c]:leaf_start[c + 1]] for c in cells]
+    return np.concatenate(ranges).astype(np.int64)
+
+def _details(store, rows):
+    """個別事故的 Popup 欄位 (與 get_traffic_layers 原本的欄位相同)"""
+    categories = np.array(store["meta"]["weather_categories"], dtype=object)
+    return {
+        "accident_datetime": pd.to_datetime(store["datetime"][rows]),
+        "weather_condition": categories[store["weather"][rows]] if len(categories) else np.full(len(rows), "", dtype=object),
+    }
+
+def _frame(store, lat, lon, count, expand, cid, point):
+    df = pd.DataFrame({
+        "lat": np.asarray(lat, dtype=np.float64), "lon": np.asarray(lon, dtype=np.float64),
+        "count": np.asarray(count, dtype=np.int64), "expansion_zoom": np.asarray(expand, dtype=np.int64),
+        "cluster_id": np.asarray(cid, dtype=np.int64), "point_id": np.asarray(point, dtype=np.int64),
+    })
+    df["accident_datetime"] = pd.NaT
+    df["weather_condition"] = None
+    single = np.flatnonzero(df["point_id"].to_numpy() >= 0)
+    if len(single):
+        details = _details(store, df["point_id"].to_numpy()[single])
+        df.loc[df.index[single], "accident_datetime"] = details["accident_datetime"]
+        df.loc[df.index[single], "weather_condition"] = details["weather_condition"]
+    return df
+
+def get_clusters(bounds, zoom, max_points=MAX_POINTS, index=None, store=None):
+    """
+    可視範圍內該縮放層級的聚合點 / 個別事故
+    zoom > MAX_ZOOM 時回傳個別事故; 點數超過 max_points 時改回傳最細層的聚合點 (expansion_zoom = zoom + 1)
+    索引不存在或與欄式儲存版本不符時回傳 None
+    """
+    if index is None:
+        if not is_available(): return None
+        index = load_clusters()
+    store = store if store is not None else accident_store.load_store()
+    zoom = int(round(zoom))
+    level = min(max(zoom, MIN_ZOOM), MAX_ZOOM)
+    cells = _visible_cells(index, level, bounds)
+
+    if zoom > MAX_ZOOM:
+        rows = _point_rows(index, cells)
+        south, west, north, east = bounds
+        lat, lon = store["lat"][rows], store["lon"][rows]
+        rows = rows[(lat >= south) & (lat <= north) & (lon >= west) & (lon <= east)]
+        if len(rows) <= max_points:
+            rows = np.sort(rows)
+            return _frame(store, store["lat"][rows], store["lon"][rows], np.ones(len(rows)),
+                          np.full(len(rows), zoom), np.full(len(rows), -1), rows)
+
+    expand = index[f"z{level}_expand"][cells].astype(np.int64)
+    if zoom > MAX_ZOOM:
+        expand = np.full(len(cells), zoom + 1)
+    return _frame(store, index[f"z{level}_lat"][cells], index[f"z{level}_lon"][cells],
+                  index[f"z{level}_count"][cells], expand,
+                  cluster_id(level, index[f"z{level}_key"][cells]), index[f"z{level}_point"][cells])
+
+def leaf_rows(cid, index=None):
+    """聚合點包含的所有原始列索引 (由小到大)"""
+    index = index if index is not None else load_clusters()
+    if index is None: return np.array([], dtype=np.int64)
+    zoom, key = split_cluster_id(cid)
+    depth = np.uint64(2 * (MAX_ZOOM - zoom))
+    finest = index[f"z{MAX_ZOOM}_key"]
+    lo = np.searchsorted(finest, key << depth, side="left")
+    hi = np.searchsorted(finest, (key + np.uint64(1)) << depth, side="left")
+    return np.sort(_point_rows(index, np.arange(lo, hi)))
+
+def get_leaves(cid, limit=100, offset=0, index=None, store=None):
+    """聚合點包含的個別事故 (分頁), 欄位同 get_clusters; 重疊在同一座標的事故也能逐筆取出"""
+    store = store if store is not None else accident_store.load_store()
+    if store is None: return pd.DataFrame()
+    rows = leaf_rows(cid, index)[offset:offset + limit]
+    return _frame(store, store["lat"][rows], store["lon"][rows], np.ones(len(rows)),
+                  np.full(len(rows), MAX_ZOOM + 1), np.full(len(rows), -1), rows)
+
+# ==========================================
+# 5. 自我測試 (合成資料, 不需要資料庫)
+# ==========================================
+def _viewport(center_lat, center_lon, zoom, width_px=1000, height_px=850):
+    """與 import_view_manager.estimate_bounds 相同的可視範圍估算"""
+    deg_per_px = 360.0 / (256 * 2 ** zoom)
+    half_w = width_px / 2 * deg_per_px
+    half_h = height_px / 2 * deg_per_px * np.cos(np.radians(center_lat))
+    return (center_lat - half_h, center_lon - half_w, center_lat + half_h, center_lon + half_w)
+
+def selftest(n=1_500_000, views=200):
+    from bench_spatial_radius import synthetic_latlon
+    rng = np.random.default_rng(7)
+    lat, lon = synthetic_latlon(n, rng)
+    lat, lon = lat.astype(np.float32), lon.astype(np.float32)
+    # 同一座標重複出現的事故 (路口) -> 任何層級都分不開, 只能用 get_leaves 取出
+    lat[:500], lon[:500] = lat[0], lon[0]
+    store = {"lat": lat, "lon": lon,
+             "datetime": (np.datetime64("2022-01-01T00:00:00") + rng.integers(0, 365 * 86400, n)).astype("datetime64[s]"),
+             "weather": rng.integers(0, 3, n).astype(np.uint8), "meta": {"weather_categories": ["晴", "雨", "陰"]}}
+
+    started = time.perf_counter()
+    index = build_levels(lat, lon)
+    size_mb = sum(v.nbytes for v in index.values()) / 2**20
+    print(f"--- [系統] {n:,} 筆 -> {sum(len(index[f'z{z}_key']) for z in range(MIN_ZOOM, MAX_ZOOM + 1)):,} 個聚合點 "
+          f"({size_mb:.1f} MB, {time.perf_counter() - started:.1f}s) ---")
+
+    # 1. 每一層的事故總數都等於全部筆數; 由最上層往下切, 每筆事故剛好出現一次
+    for z in range(MIN_ZOOM, MAX_ZOOM + 1):
+        assert int(index[f"z{z}_count"].sum()) == n, f"zoom {z} 總數不符"
+    top = [leaf_rows(c, index) for c in cluster_id(MIN_ZOOM, index[f"z{MIN_ZOOM}_key"])]
+    assert np.array_equal(np.sort(np.concatenate(top)), np.arange(n)), "最上層聚合點沒有涵蓋全部事故"
+
+    # 2. 展開層級: 聚合點在 expansion_zoom 那一層一定會分成 2 個以上 (或已經是個別事故層級)
+    z = 8
+    keys, expand = index[f"z{z}_key"], index[f"z{z}_expand"]
+    for i in rng.choice(len(keys), 50, replace=False):
+        e = int(expand[i])
+        if e <= MAX_ZOOM:
+            finest = index[f"z{e}_key"]
+            depth = np.uint64(2 * (e - z))
+            lo = np.searchsorted(finest, keys[i] << depth)
+            hi = np.searchsorted(finest, (keys[i] + np.uint64(1)) << depth)
+            assert hi - lo >= 2, "展開層級沒有分開"
+    stacked_key = cell_key(*cell_xy(*mercator(lat[:1], lon[:1]), MAX_ZOOM))[0]
+    stacked = get_leaves(cluster_id(MAX_ZOOM, stacked_key), limit=1000, index=index, store=store)
+    assert len(stacked) >= 500, "重疊座標的事故沒有全部取出"
+
+    # 3. 隨機視角: 每次回傳的筆數有上限, 個別事故層級與逐筆篩選結果相同
+    centers = np.column_stack([lat, lon])[rng.choice(n, views)]
+    zooms = rng.integers(7, 20, views)
+    timings, sizes = [], []
+    for (c_lat, c_lon), zoom in zip(centers.astype(np.float64), zooms):
+        bounds = _viewport(c_lat, c_lon, int(zoom))
+        t0 = time.perf_counter()
+        df = get_clusters(bounds, int(zoom), index=index, store=store)
+        timings.append((time.perf_counter() - t0) * 1000)
+        sizes.append(len(df))
+        if zoom <= MAX_ZOOM:
+            assert len(df) <= (1000 // CELL_PX + 2) * (850 // CELL_PX + 2), f"zoom {zoom}: {len(df)} 個聚合點"
+        elif (df["point_id"] >= 0).all() and df["count"].eq(1).all():
+            south, west, north, east = bounds
+            expected = np.flatnonzero((lat >= south) & (lat <= north) & (lon >= west) & (lon <= east))
+            assert np.array_equal(np.sort(df["point_id"].to_numpy()), expected), "個別事故與逐筆篩選不符"
+        else:
+            assert len(df) <= (1000 // CELL_PX + 2) * (850 // CELL_PX + 2)
+    print(f"[測試] {views} 個隨機視角 (zoom 7~19): 每次最多 {max(sizes)} 筆 / 平均 {np.mean(sizes):.0f} 筆, "
+          f"p50 {np.percentile(timings, 50):.2f} ms, p95 {np.percentile(timings, 95):.2f} ms")
+    print("--- [系統] 自我測試全部通過 ---")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="事故點位 階層式聚合索引")
+    parser.add_argument("--selftest", action="store_true", help="以合成資料驗證聚合結果並量測查詢時間")
+    args = parser.parse_args()
+    if args.selftest:
+        selftest()
+    else:
+        if build_clusters():
+            t0 = time.perf_counter()
+            df = get_clusters(_viewport(25.088, 121.524, 14), 14)
+            print(f"士林夜市周邊 zoom 14: {len(df)} 個聚合點 / {int(df['count'].sum()):,} 筆事故 "
+                  f"({(time.perf_counter() - t0) * 1000:.1f} ms)")
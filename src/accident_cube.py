@@ -0,0 +1,407 @@
+import os
+import time
+import json
+import argparse
+import threading
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+from db_utils import get_db_engine
+from heatmap_pyramid import FINEST, KEY_STRIDE, TAIWAN_BOUNDS, tile_bounds
+import accident_store
+
+# ==========================================
+# 事故 時間維度聚合 Cube (格子 × 年 × 月 × 星期 × 時 × 天候)
+# 每個「有事故的組合」存一列 (稀疏 COO): 事故數 / 死亡數 / 受傷數 都是 int32
+# - 依 (格子列, 格子欄) 排序: 範圍查詢用二分搜尋切出緯度帶, 再用遮罩篩選其餘維度
+# - 「台北市 下雨的星期五晚上 18~23 時」這類切片只掃描該緯度帶的聚合列 (uint8 查表遮罩), 不碰原始資料表
+# 建立: python accident_cube.py            (優先從本機欄式儲存建立, 沒有時改用資料庫 GROUP BY)
+#       python accident_cube.py --selftest (合成資料, 與逐筆計算比對並量測查詢時間)
+# ==========================================
+
+CUBE_PATH = os.path.join(accident_store.DATA_CACHE_DIR, "accident_cube.npz")
+CELL_DEG = FINEST                  # 與熱力圖金字塔最細層級相同, 可以直接合併成各層級
+DIMENSIONS = ("year", "month", "weekday", "hour", "weather")
+UNKNOWN_MONTH = 0                  # 發生時間缺漏時的月份
+UNKNOWN_WEEKDAY = 7                # 發生時間缺漏時的星期 (0 = 星期一 ... 6 = 星期日)
+
+# 各縣市的約略範圍 (south, west, north, east), 查詢時可以直接用名稱
+REGIONS = {
+    "台北市": (24.96, 121.45, 25.21, 121.67),
+    "新北市": (24.67, 121.28, 25.30, 122.01),
+    "桃園市": (24.58, 120.98, 25.13, 121.47),
+    "台中市": (24.00, 120.46, 24.45, 121.45),
+    "台南市": (22.88, 120.03, 23.41, 120.66),
+    "高雄市": (22.47, 120.17, 23.47, 121.05),
+}
+
+_cache = {"mtime": None, "cube": None}
+_lock = threading.Lock()
+
+# ==========================================
+# 1. 建立 Cube
+# ==========================================
+def calendar_parts(dt):
+    """datetime64 陣列 -> (月份 1~12, 星期 0~6); 缺漏 (NaT) 時為 UNKNOWN_MONTH / UNKNOWN_WEEKDAY"""
+    dt = np.asarray(dt, dtype="datetime64[s]")
+    missing = np.isnat(dt)
+    month = (dt.astype("datetime64[M]").astype(np.int64) % 12 + 1).astype(np.uint8)
+    # 1970-01-01 是星期四: (天數 + 3) % 7 -> 星期一 = 0
+    weekday = ((dt.astype("datetime64[D]").astype(np.int64) + 3) % 7).astype(np.uint8)
+    month[missing] = UNKNOWN_MONTH
+    weekday[missing] = UNKNOWN_WEEKDAY
+    return month, weekday
+
+def aggregate_rows(lat, lon, year, month, weekday, hour, weather, death, injury, count=None, cell_deg=CELL_DEG):
+    """
+    逐筆 (或已部分聚合的) 資料 -> 稀疏 Cube 陣列
+    count 未指定時每列算 1 筆; 相同 (格子, 年, 月, 星期, 時, 天候) 的列會合併
+    """
+    n = len(lat)
+    columns = {
+        "gy": np.floor(np.asarray(lat, dtype=np.float64) / cell_deg).astype(np.int32),
+        "gx": np.floor(np.asarray(lon, dtype=np.float64) / cell_deg).astype(np.int32),
+        "year": np.asarray(year, dtype=np.int16),
+        "month": np.asarray(month, dtype=np.uint8),
+        "weekday": np.asarray(weekday, dtype=np.uint8),
+        "hour": np.asarray(hour, dtype=np.uint8),
+        "weather": np.asarray(weather, dtype=np.uint8),
+    }
+    values = {
+        "count": np.ones(n, dtype=np.int64) if count is None else np.asarray(count, dtype=np.int64),
+        "death": np.asarray(death, dtype=np.int64),
+        "injury": np.asarray(injury, dtype=np.int64),
+    }
+    if n == 0:
+        return {**columns, **{k: v.astype(np.int32) for k, v in values.items()}}
+
+    # lexsort 以最後一個 key 為主: 先排格子列, 再排格子欄, 其餘維度依序
+    keys = [columns[name] for name in ("gy", "gx", *DIMENSIONS)]
+    order = np.lexsort(keys[::-1])
+    sorted_keys = [k[order] for k in keys]
+    boundary = np.zeros(n, dtype=bool)
+    boundary[0] = True
+    for k in sorted_keys:
+        boundary[1:] |= k[1:] != k[:-1]
+    starts = np.flatnonzero(boundary)
+
+    cube = {name: k[starts] for name, k in zip(("gy", "gx", *DIMENSIONS), sorted_keys)}
+    for name, v in values.items():
+        cube[name] = np.add.reduceat(v[order], starts).astype(np.int32)
+    return cube
+
+def _cube_from_store(store):
+    month, weekday = calendar_parts(store["datetime"])
+    cube = aggregate_rows(store["lat"], store["lon"], store["year"], month, weekday,
+                          store["hour"], store["weather"], store["death"], store["injury"])
+    return cube, list(store["meta"]["weather_categories"]), store["meta"]["built_at"]
+
+def _cube_from_db(engine):
+    """資料庫端先 GROUP BY 一次 (結果已經是稀疏列), 再整理成與欄式儲存相同的格式"""
+    sql = text(f"""
+    SELECT
+        FLOOR(latitude / {CELL_DEG}) AS gy,
+        FLOOR(longitude / {CELL_DEG}) AS gx,
+        accident_year AS year,
+        MONTH(accident_datetime) AS month,
+        WEEKDAY(accident_datetime) AS weekday,
+        accident_hour AS hour,
+        weather_condition AS weather,
+        COUNT(*) AS count,
+        SUM(death_count) AS death,
+        SUM(injury_count) AS injury
+    FROM test_db.accident_main
+    WHERE latitude BETWEEN :min_lat AND :max_lat
+      AND longitude BETWEEN :min_lon AND :max_lon
+    GROUP BY gy, gx, year, month, weekday, hour, weather
+    """)
+    with engine.connect() as conn:
+        df = pd.read_sql(sql, conn, params=TAIWAN_BOUNDS)
+    codes, categories = pd.factorize(df['weather'].fillna("").astype(str), sort=True)
+    # 格子中心點換回經緯度, aggregate_rows 會再 floor 回同一格
+    cube = aggregate_rows(
+        (df['gy'].to_numpy(np.float64) + 0.5) * CELL_DEG, (df['gx'].to_numpy(np.float64) + 0.5) * CELL_DEG,
+        df['year'].fillna(0), df['month'].fillna(UNKNOWN_MONTH), df['weekday'].fillna(UNKNOWN_WEEKDAY),
+        df['hour'].fillna(0), codes, df['death'].fillna(0), df['injury'].fillna(0), count=df['count'])
+    return cube, [str(c) for c in categories], datetime.now().isoformat(timespec="seconds")
+
+def build_cube(engine=None, path=CUBE_PATH):
+    """建立 Cube 並寫入 path; 有本機欄式儲存時直接用 (不連資料庫), 回傳 meta"""
+    started = time.perf_counter()
+    store = accident_store.load_store()
+    if store is not None:
+        print(f"--- [系統] 由欄式儲存建立事故 Cube ({store['meta']['rows']:,} 筆) ---")
+        cube, categories, source_version = _cube_from_store(store)
+    else:
+        engine = engine or get_db_engine()
+        if not engine:
+            print("Connection failed. Please check .env and db_utils.py")
+            return None
+        print("--- [系統] 欄式儲存不存在, 改由資料庫聚合建立事故 Cube ---")
+        cube, categories, source_version = _cube_from_db(engine)
+
+    meta = {
+        "entries": int(len(cube["count"])),
+        "rows": int(cube["count"].sum()),
+        "cell_deg": CELL_DEG,
+        "weather_categories": categories,
+        "source_version": source_version,
+        "built_at": datetime.now().isoformat(timespec="seconds"),
+    }
+    save_cube(cube, meta, path)
+    size_mb = os.path.getsize(path) / 2**20
+    print(f"--- [系統] 事故 Cube 已寫入 {path}: {meta['rows']:,} 筆 -> {meta['entries']:,} 列 "
+          f"({size_mb:.1f} MB, {time.perf_counter() - started:.1f}s) ---")
+    return meta
+
+def save_cube(cube, meta, path=CUBE_PATH):
+    """先寫暫存檔再 os.replace, 讀取端不會讀到寫一半的檔案"""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    with open(tmp_path, "wb") as f:
+        np.savez(f, meta=np.array(json.dumps(meta, ensure_ascii=False)), **cube)
+    os.replace(tmp_path, path)
+
+# ==========================================
+# 2. 讀取
+# ==========================================
+def load_cube(path=CUBE_PATH):
+    """回傳 {欄位: 陣列, "meta": dict} (檔案有更新才重新讀取); 不存在時回傳 None"""
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return None
+    if _cache["mtime"] != mtime:
+        with _lock:
+            if _cache["mtime"] != mtime:
+                with np.load(path) as npz:
+                    cube = {k: npz[k] for k in npz.files if k != "meta"}
+                    cube["meta"] = json.loads(str(npz["meta"]))
+                _cache["cube"], _cache["mtime"] = cube, mtime
+    return _cache["cube"]
+
+def is_available():
+    return load_cube() is not None
+
+def year_range():
+    """Cube 內的年度範圍 (最早, 最晚); 不存在時回傳 None"""
+    cube = load_cube()
+    if cube is None: return None
+    years = cube["year"][cube["year"] > 0]
+    return (int(years.min()), int(years.max())) if len(years) else None
+
+def data_version():
+    """Cube 的版本 (建立時間), 可當快取 key"""
+    cube = load_cube()
+    return cube["meta"]["built_at"] if cube else None
+
+# ==========================================
+# 3. 切片查詢
+# 每個維度的條件可以是:
+#   None -> 不篩選;  整數 -> 等於;  (起, 迄) -> 含頭含尾的範圍;  list / set -> 其中之一
+# 時 / 星期 / 月 的範圍可以跨越週期, 例如 hours=(22, 2) 代表 22 時 ~ 隔天 2 時
+# weather 用名稱比對 (包含即可): "雨" 會同時符合「雨」與「暴雨」
+# bounds 是 (south, west, north, east) 或 REGIONS 的名稱, 以格子 (CELL_DEG) 為單位篩選
+# ==========================================
+def _match(values, spec):
+    if spec is None:
+        return None
+    if values.dtype == np.uint8:
+        # 小維度 (月 / 星期 / 時 / 天候): 先做 256 格的查表, 每列只要一次索引
+        return _lookup_table(spec)[values]
+    if isinstance(spec, tuple) and len(spec) == 2:
+        return accident_store.range_mask(values, spec)
+    if isinstance(spec, (list, set, frozenset, np.ndarray)):
+        return np.isin(values, np.fromiter(spec, dtype=np.int64))
+    return values == spec
+
+def _lookup_table(spec):
+    table = np.zeros(256, dtype=bool)
+    if isinstance(spec, tuple) and len(spec) == 2:
+        start, end = spec
+        if start <= end:
+            table[start:end + 1] = True
+        else:
+            table[start:] = True
+            table[:end + 1] = True
+    elif isinstance(spec, (list, set, frozenset, np.ndarray)):
+        table[np.fromiter(spec, dtype=np.int64)] = True
+    else:
+        table[spec] = True
+    return table
+
+def weather_codes(cube, weather):
+    """天候名稱 (或名稱片段) -> 代碼 list"""
+    terms = [weather] if isinstance(weather, str) else list(weather)
+    return [code for code, name in enumerate(cube["meta"]["weather_categories"])
+            if any(term in name for term in terms)]
+
+def _resolve_bounds(bounds):
+    return REGIONS[bounds] if isinstance(bounds, str) else bounds
+
+def select(cube, bounds=None, years=None, months=None, weekdays=None, hours=None, weather=None):
+    """回傳符合條件的 Cube 列索引"""
+    lo, hi = 0, len(cube["count"])
+    gx_range = None
+    if bounds is not None:
+        south, west, north, east = _resolve_bounds(bounds)
+        cell = cube["meta"]["cell_deg"]
+        # 依格子列排序: 緯度帶直接二分搜尋
+        lo = np.searchsorted(cube["gy"], int(np.floor(south / cell)), side="left")
+        hi = np.searchsorted(cube["gy"], int(np.floor(north / cell)), side="right")
+        gx_range = (int(np.floor(west / cell)), int(np.floor(east / cell)))
+
+    mask = np.ones(hi - lo, dtype=bool)
+    if gx_range is not None:
+        gx = cube["gx"][lo:hi]
+        mask &= (gx >= gx_range[0]) & (gx <= gx_range[1])
+    if weather is not None:
+        weather = weather_codes(cube, weather)
+    for name, spec in (("year", years), ("month", months), ("weekday", weekdays),
+                       ("hour", hours), ("weather", weather)):
+        matched = _match(cube[name][lo:hi], spec)
+        if matched is not None:
+            mask &= matched
+    return lo + np.flatnonzero(mask)
+
+def query(bounds=None, years=None, months=None, weekdays=None, hours=None, weather=None, cube=None):
+    """切片總計 {"count", "death", "injury"}; Cube 不存在時回傳 None"""
+    cube = cube if cube is not None else load_cube()
+    if cube is None: return None
+    idx = select(cube, bounds, years, months, weekdays, hours, weather)
+    return {name: int(cube[name][idx].sum(dtype=np.int64)) for name in ("count", "death", "injury")}
+
+def query_grouped(by, bounds=None, years=None, months=None, weekdays=None, hours=None, weather=None, cube=None):
+    """
+    切片依單一維度分組 (by = year / month / weekday / hour / weather)
+    回傳 DataFrame [by, count, death, injury], 依 by 排序; Cube 不存在時回傳空的 DataFrame
+    """
+    cube = cube if cube is not None else load_cube()
+    if cube is None: return pd.DataFrame()
+    if by not in DIMENSIONS:
+        raise ValueError(f"by 必須是 {DIMENSIONS} 其中之一")
+    idx = select(cube, bounds, years, months, weekdays, hours, weather)
+    keys, inverse = np.unique(cube[by][idx], return_inverse=True)
+    df = pd.DataFrame({by: keys})
+    for name in ("count", "death", "injury"):
+        df[name] = np.bincount(inverse, weights=cube[name][idx], minlength=len(keys)).astype(np.int64)
+    if by == "weather":
+        categories = np.array(cube["meta"]["weather_categories"], dtype=object)
+        df[by] = categories[keys] if len(categories) else keys
+    return df
+
+def heatmap_cells(level=FINEST, bounds=None, years=None, months=None, weekdays=None, hours=None, weather=None,
+                  cube=None):
+    """
+    切片的熱力圖格子 [[緯度, 經度, 事故數], ...] (與 heatmap_pyramid.get_heatmap_cells 相同格式)
+    level 必須是 CELL_DEG 的整數倍; Cube 不存在時回傳 None
+    """
+    cube = cube if cube is not None else load_cube()
+    if cube is None: return None
+    idx = select(cube, bounds, years, months, weekdays, hours, weather)
+    factor = int(round(level / cube["meta"]["cell_deg"]))
+    key = (np.floor_divide(cube["gy"][idx], factor).astype(np.int64) * KEY_STRIDE
+           + np.floor_divide(cube["gx"][idx], factor))
+    uniq, inverse = np.unique(key, return_inverse=True)
+    counts = np.bincount(inverse, weights=cube["count"][idx], minlength=len(uniq)).astype(np.int64)
+    return np.column_stack([
+        np.round((np.floor_divide(uniq, KEY_STRIDE) + 0.5) * level, 6),
+        np.round((np.mod(uniq, KEY_STRIDE) + 0.5) * level, 6),
+        counts]).tolist()
+
+def tile_cells(level, ty, tx, years=None, months=None, weekdays=None, hours=None, weather=None, cube=None):
+    """
+    切片的熱力圖格子 (與 heatmap_pyramid.get_tile_cells 相同的切片範圍, 南/西邊含、北/東邊不含)
+    Cube 不存在時回傳 None
+    """
+    cube = cube if cube is not None else load_cube()
+    if cube is None: return None
+    south, west, north, east = tile_bounds(level, ty, tx)
+    # 邊界剛好落在格線上: 往內縮半格, 避免浮點誤差把相鄰切片的格子算進來
+    half = cube["meta"]["cell_deg"] / 2
+    return heatmap_cells(level, (south + half, west + half, north - half, east - half),
+                         years, months, weekdays, hours, weather, cube=cube)
+
+# ==========================================
+# 4. 自我測試 (合成資料, 不需要資料庫)
+# ==========================================
+def _synthetic_rows(n, seed=42):
+    from bench_spatial_radius import synthetic_latlon
+    rng = np.random.default_rng(seed)
+    lat, lon = synthetic_latlon(n, rng)
+    start = np.datetime64("2020-01-01T00:00:00").astype(np.int64)
+    seconds = rng.integers(0, 3 * 365 * 86400, n)
+    dt = (start + seconds).astype("datetime64[s]")
+    dt[rng.random(n) < 0.001] = np.datetime64("NaT")
+    return pd.DataFrame({
+        "lat": lat.astype(np.float32), "lon": lon.astype(np.float32), "datetime": dt,
+        "year": np.where(np.isnat(dt), 0, dt.astype("datetime64[Y]").astype(np.int64) + 1970).astype(np.int16),
+        "hour": np.where(np.isnat(dt), 0, (seconds // 3600) % 24).astype(np.uint8),
+        "weather": rng.choice(4, n, p=[0.7, 0.15, 0.12, 0.03]).astype(np.uint8),
+        "death": (rng.random(n) < 0.02).astype(np.uint8),
+        "injury": rng.integers(0, 3, n).astype(np.uint8),
+    })
+
+def selftest(n=1_500_000, repeat=50):
+    df = _synthetic_rows(n)
+    started = time.perf_counter()
+    month, weekday = calendar_parts(df["datetime"].to_numpy())
+    cube = aggregate_rows(df["lat"], df["lon"], df["year"], month, weekday, df["hour"], df["weather"],
+                          df["death"], df["injury"])
+    cube["meta"] = {"cell_deg": CELL_DEG, "weather_categories": ["晴", "雨", "陰", "暴雨"]}
+    print(f"--- [系統] {n:,} 筆 -> {len(cube['count']):,} 列 Cube ({time.perf_counter() - started:.1f}s) ---")
+
+    # 逐筆計算的答案 (與 Cube 相同的格子篩選)
+    gy = np.floor(df["lat"].to_numpy(np.float64) / CELL_DEG)
+    gx = np.floor(df["lon"].to_numpy(np.float64) / CELL_DEG)
+    weekday_raw = df["datetime"].dt.dayofweek.fillna(UNKNOWN_WEEKDAY).to_numpy()
+    south, west, north, east = REGIONS["台北市"]
+    in_taipei = ((gy >= np.floor(south / CELL_DEG)) & (gy <= np.floor(north / CELL_DEG))
+                 & (gx >= np.floor(west / CELL_DEG)) & (gx <= np.floor(east / CELL_DEG)))
+    hours = df["hour"].to_numpy()
+    weather = df["weather"].to_numpy()
+    year = df["year"].to_numpy()
+    cases = [
+        ("台北市 下雨的星期五晚上 18~23 時",
+         dict(bounds="台北市", weekdays=4, hours=(18, 23), weather="雨"),
+         in_taipei & (weekday_raw == 4) & (hours >= 18) & (hours <= 23) & np.isin(weather, [1, 3])),
+        ("全台 2021~2022 年 深夜 22~2 時",
+         dict(years=(2021, 2022), hours=(22, 2)),
+         (year >= 2021) & (year <= 2022) & ((hours >= 22) | (hours <= 2))),
+        ("全台 週末 晴天", dict(weekdays={5, 6}, weather="晴"), np.isin(weekday_raw, [5, 6]) & (weather == 0)),
+    ]
+    for label, kwargs, expected_mask in cases:
+        expected = {"count": int(expected_mask.sum()), "death": int(df["death"].to_numpy()[expected_mask].sum()),
+                    "injury": int(df["injury"].to_numpy()[expected_mask].sum())}
+        result = query(cube=cube, **kwargs)
+        assert result == expected, f"{label}: {result} != {expected}"
+        timings = []
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            query(cube=cube, **kwargs)
+            timings.append((time.perf_counter() - t0) * 1000)
+        print(f"[測試] {label}: {result} (p50 {np.percentile(timings, 50):.2f} ms)")
+
+    by_hour = query_grouped("hour", bounds="台北市", weather="雨", cube=cube)
+    assert int(by_hour["count"].sum()) == int((in_taipei & np.isin(weather, [1, 3])).sum())
+    cells = heatmap_cells(0.01, years=2022, cube=cube)
+    assert sum(c[2] for c in cells) == int((year == 2022).sum())
+    # 切片不重疊: 台北附近 2x2 個切片的總和 = 涵蓋範圍的總和
+    tiles = [(ty, tx) for ty in (39, 40) for tx in (189, 190)]
+    tile_total = sum(c[2] for ty, tx in tiles for c in tile_cells(0.01, ty, tx, hours=(18, 23), cube=cube))
+    band = (gy >= 39 * 128) & (gy < 41 * 128) & (gx >= 189 * 128) & (gx < 191 * 128)
+    assert tile_total == int((band & (hours >= 18) & (hours <= 23)).sum())
+    print("--- [系統] 自我測試全部通過 ---")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="事故 時間維度聚合 Cube")
+    parser.add_argument("--selftest", action="store_true", help="以合成資料驗證查詢結果並量測時間")
+    args = parser.parse_args()
+    if args.selftest:
+        selftest()
+    else:
+        if build_cube():
+            t0 = time.perf_counter()
+            result = query(bounds="台北市", weekdays=4, hours=(18, 23), weather="雨")
+            print(f"台北市 下雨的星期五晚上 18~23 時: {result} ({(time.perf_counter() - t0) * 1000:.1f} ms)")
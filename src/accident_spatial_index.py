@@ -0,0 +1,199 @@
+import numpy as np
+
+# ==========================================
+# 事故點位 格網空間索引 (Grid / Z-order Index)
+# 把每個點放進 0.005° (約 500m) 的格子, 格子編號用 Morton (Z-order) 交錯編碼後排序,
+# 再記錄每個格子在排序後陣列中的起訖位置 (offset)
+# - 半徑查詢只看涵蓋範圍內的十幾個格子, 不用掃全部 150 萬點
+# - 支援 方框 (與 MySQL BETWEEN 相同) / 圓形 (球面距離) / K 近鄰 / 多中心批次查詢
+# ==========================================
+
+EARTH_RADIUS_KM = 6371.0
+
+def _part1by1(v):
+    """把 32-bit 整數的每個位元之間插入一個 0 (Morton 編碼用, 結果 64-bit)"""
+    v = v.astype(np.uint64) & np.uint64(0xFFFFFFFF)
+    v = (v | (v << np.uint64(16))) & np.uint64(0x0000FFFF0000FFFF)
+    v = (v | (v << np.uint64(8))) & np.uint64(0x00FF00FF00FF00FF)
+    v = (v | (v << np.uint64(4))) & np.uint64(0x0F0F0F0F0F0F0F0F)
+    v = (v | (v << np.uint64(2))) & np.uint64(0x3333333333333333)
+    v = (v | (v << np.uint64(1))) & np.uint64(0x5555555555555555)
+    return v
+
+def morton_key(gy, gx):
+    """(列, 欄) -> Z-order key, 相鄰格子的 key 大多也相鄰, 同一區域的點在記憶體中會放在一起"""
+    return (_part1by1(gy) << np.uint64(1)) | _part1by1(gx)
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """球面距離 (km), 支援 NumPy 陣列"""
+    phi1, phi2 = np.radians(lat1), np.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = np.radians(lon2 - lon1)
+    a = np.sin(dphi / 2) ** 2 + np.cos(phi1) * np.cos(phi2) * np.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+class GridIndex:
+    """
+    lat, lon: 點位座標陣列 (例如 accident_store 的欄位)
+    查詢結果一律回傳「原始陣列的列索引」, 呼叫端可以直接拿去取其他欄位
+    """
+    def __init__(self, lat, lon, cell_deg=0.005):
+        self.cell_deg = cell_deg
+        lat = np.asarray(lat, dtype=np.float64)
+        lon = np.asarray(lon, dtype=np.float64)
+        gy, gx = self._cell(lat, lon)
+        keys = morton_key(gy, gx)
+
+        self.order = np.argsort(keys, kind="stable")           # 排序後位置 -> 原始列索引
+        sorted_keys = keys[self.order]
+        self.cell_keys, self.starts = np.unique(sorted_keys, return_index=True)
+        self.ends = np.append(self.starts[1:], len(sorted_keys))
+        # 依格子順序存一份座標, 同一格的點在記憶體中連續, 比對時 cache 命中率高
+        self.lat = lat[self.order]
+        self.lon = lon[self.order]
+
+    def __len__(self):
+        return len(self.order)
+
+    def _cell(self, lat, lon):
+        # 平移到非負整數 (緯度 +90, 經度 +180), 0.005° 格子最多 36000 列 x 72000 欄, 超過 16-bit, Morton 用 32-bit
+        # 超出範圍的座標夾到邊界格子 (查詢時還會再比對實際座標, 只影響候選點, 不會算錯)
+        gy = np.floor((np.asarray(lat) + 90.0) / self.cell_deg).astype(np.int64)
+        gx = np.floor((np.asarray(lon) + 180.0) / self.cell_deg).astype(np.int64)
+        return (np.clip(gy, 0, int(np.ceil(180.0 / self.cell_deg))),
+                np.clip(gx, 0, int(np.ceil(360.0 / self.cell_deg))))
+
+    def _candidates(self, south, west, north, east):
+        """涵蓋矩形範圍的所有格子內的點 (排序後位置)"""
+        gy0, gx0 = self._cell(south, west)
+        gy1, gx1 = self._cell(north, east)
+        gy, gx = np.meshgrid(np.arange(gy0, gy1 + 1), np.arange(gx0, gx1 + 1), indexing="ij")
+        keys = morton_key(gy.ravel(), gx.ravel())
+        if len(self.cell_keys) == 0:
+            return np.empty(0, dtype=np.int64)
+
+        # 二分搜尋每個格子 key, 只保留真的有點的格子
+        pos = np.minimum(np.searchsorted(self.cell_keys, keys), len(self.cell_keys) - 1)
+        pos = pos[self.cell_keys[pos] == keys]
+        starts, ends = self.starts[pos], self.ends[pos]
+        lengths = ends - starts
+        total = int(lengths.sum())
+        if total == 0:
+            return np.empty(0, dtype=np.int64)
+        # 把多個 [start, end) 區段展開成連續索引 (向量化, 不用 Python 迴圈)
+        offsets = np.repeat(starts - np.concatenate([[0], np.cumsum(lengths)[:-1]]), lengths)
+        return offsets + np.arange(total)
+
+    # --- 單點查詢 ---
+    def query_box(self, center_lat, center_lon, radius_km):
+        """BETWEEN 方框 (經緯度都用 radius_km / 111), 與 MySQL 版本的範圍相同"""
+        offset = radius_km / 111.0
+        south, north = center_lat - offset, center_lat + offset
+        west, east = center_lon - offset, center_lon + offset
+        cand = self._candidates(south, west, north, east)
+        lat, lon = self.lat[cand], self.lon[cand]
+        mask = (lat >= south) & (lat <= north) & (lon >= west) & (lon <= east)
+        return np.sort(self.order[cand[mask]])
+
+    def query_radius(self, center_lat, center_lon, radius_km):
+        """真正的圓形範圍 (球面距離 <= radius_km)"""
+        dlat = radius_km / 111.0
+        dlon = radius_km / (111.0 * np.cos(np.radians(center_lat)))
+        cand = self._candidates(center_lat - dlat, center_lon - dlon, center_lat + dlat, center_lon + dlon)
+        dist = haversine_km(center_lat, center_lon, self.lat[cand], self.lon[cand])
+        return np.sort(self.order[cand[dist <= radius_km]])
+
+    def query(self, center_lat, center_lon, radius_km, mode="box"):
+        if mode == "circle":
+            return self.query_radius(center_lat, center_lon, radius_km)
+        return self.query_box(center_lat, center_lon, radius_km)
+
+    def query_knn(self, center_lat, center_lon, k=10):
+        """
+        K 近鄰: 由中心格子一圈一圈往外擴, 直到找到 k 個點且下一圈不可能更近為止
+        回傳 (列索引, 距離 km), 依距離由近到遠
+        """
+        if len(self) == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        cell_km = self.cell_deg * 111.0 * np.cos(np.radians(center_lat))  # 格子最短邊 (經度方向)
+        ring = 1
+        while True:
+            span = ring * self.cell_deg
+            cand = self._candidates(center_lat - span, center_lon - span, center_lat + span, center_lon + span)
+            if len(cand) >= k or len(cand) == len(self):
+                dist = haversine_km(center_lat, center_lon, self.lat[cand], self.lon[cand])
+                top = np.argsort(dist, kind="stable")[:k]
+                # 第 k 近的距離小於已搜尋範圍的內切半徑, 外圈不可能更近
+                if len(cand) == len(self) or dist[top[-1]] <= ring * cell_km:
+                    return self.order[cand[top]], dist[top]
+            ring *= 2
+
+    # --- 批次查詢 (例如全部夜市) ---
+    # 所有中心點的格子一次展開、一次 searchsorted、一次比對, 沒有逐點的 Python 迴圈
+    # 中心點分段處理 (BATCH_CENTERS 個一段), 候選點陣列的大小才不會隨中心點數無限成長
+    BATCH_CENTERS = 256
+
+    def _batch_matches(self, lat, lon, radius_km, mode):
+        """回傳 (中心點編號, 排序後位置): 每一對代表該點在該中心點的範圍內"""
+        dlat = np.full(len(lat), radius_km / 111.0)
+        dlon = radius_km / (111.0 * np.cos(np.radians(lat))) if mode == "circle" else dlat
+        south, north, west, east = lat - dlat, lat + dlat, lon - dlon, lon + dlon
+        gy0, gx0 = self._cell(south, west)
+        gy1, gx1 = self._cell(north, east)
+
+        # 每個中心點的格子數最多差 1, 以最大值展開成 (中心點, 列, 欄), 超出各自範圍的格子標為無效
+        ny, nx = int((gy1 - gy0).max()) + 1, int((gx1 - gx0).max()) + 1
+        dy, dx = np.meshgrid(np.arange(ny), np.arange(nx), indexing="ij")
+        gy = gy0[:, None] + dy.ravel()[None, :]
+        gx = gx0[:, None] + dx.ravel()[None, :]
+        valid = (gy <= gy1[:, None]) & (gx <= gx1[:, None])
+        center = np.broadcast_to(np.arange(len(lat))[:, None], gy.shape)[valid]
+        keys = morton_key(gy[valid], gx[valid])
+
+        pos = np.minimum(np.searchsorted(self.cell_keys, keys), len(self.cell_keys) - 1)
+        hit = self.cell_keys[pos] == keys
+        center, pos = center[hit], pos[hit]
+        starts, lengths = self.starts[pos], self.ends[pos] - self.starts[pos]
+        total = int(lengths.sum())
+        if total == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        offsets = np.repeat(starts - np.concatenate([[0], np.cumsum(lengths)[:-1]]), lengths)
+        cand = offsets + np.arange(total)
+        owner = np.repeat(center, lengths)
+
+        plat, plon = self.lat[cand], self.lon[cand]
+        if mode == "circle":
+            mask = haversine_km(lat[owner], lon[owner], plat, plon) <= radius_km
+        else:
+            mask = (plat >= south[owner]) & (plat <= north[owner]) & (plon >= west[owner]) & (plon <= east[owner])
+        return owner[mask], cand[mask]
+
+    def _batches(self, centers):
+        centers = np.asarray(centers, dtype=np.float64).reshape(-1, 2)
+        for start in range(0, len(centers), self.BATCH_CENTERS):
+            part = centers[start:start + self.BATCH_CENTERS]
+            yield part[:, 0], part[:, 1]
+
+    def count_batch(self, centers, radius_km, mode="box"):
+        """centers: [(lat, lon), ...], 回傳每個中心點範圍內的點數 (與逐點呼叫 query 的結果相同)"""
+        if len(self) == 0:
+            return np.zeros(len(centers), dtype=np.int64)
+        counts = []
+        for lat, lon in self._batches(centers):
+            owner, _ = self._batch_matches(lat, lon, radius_km, mode)
+            counts.append(np.bincount(owner, minlength=len(lat)))
+        return np.concatenate(counts).astype(np.int64) if counts else np.empty(0, dtype=np.int64)
+
+    def query_batch(self, centers, radius_km, mode="box"):
+        """centers: [(lat, lon), ...], 回傳每個中心點的列索引陣列 (與逐點呼叫 query 的結果相同)"""
+        if len(self) == 0:
+            return [np.empty(0, dtype=np.int64) for _ in range(len(centers))]
+        results = []
+        for lat, lon in self._batches(centers):
+            owner, cand = self._batch_matches(lat, lon, radius_km, mode)
+            rows = self.order[cand]
+            by_center = np.lexsort((rows, owner))       # 依中心點分組, 組內依列索引排序
+            bounds = np.searchsorted(owner[by_center], np.arange(len(lat) + 1))
+            rows = rows[by_center]
+            results.extend(rows[bounds[i]:bounds[i + 1]] for i in range(len(lat)))
+        return results
@@ -0,0 +1,334 @@
+import os
+import json
+import time
+import shutil
+import threading
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+from db_utils import get_db_engine
+from heatmap_pyramid import level_for_zoom, KEY_STRIDE, TAIWAN_BOUNDS
+from accident_spatial_index import GridIndex
+
+# ==========================================
+# 事故資料 本機欄式儲存 (Columnar Store, NumPy memory-mapped)
+# 把 accident_main 分析會用到的 8 個欄位匯出成 .npy (每欄一個檔), 約 33 MB / 150 萬筆
+# - 讀取時用 mmap_mode='r': 多個 Streamlit worker 共用作業系統的 page cache, 不用各自複製
+# - 資料依緯度排序 (全台熱力圖用二分搜尋切出台灣範圍); 半徑查詢走格網空間索引 (accident_spatial_index)
+# 匯出: python accident_store.py
+# ==========================================
+
+DATA_CACHE_DIR = os.getenv(
+    "DATA_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data", "cache"))
+STORE_DIR = os.getenv("ACCIDENT_STORE_DIR", os.path.join(DATA_CACHE_DIR, "accident_store"))
+
+# 欄位 -> NumPy 型態
+COLUMNS = {
+    "lat": np.float32,             # 緯度
+    "lon": np.float32,             # 經度
+    "datetime": "datetime64[s]",   # 發生時間 (accident_datetime)
+    "hour": np.uint8,              # 發生時 (accident_hour)
+    "year": np.int16,              # 發生年度 (accident_year)
+    "death": np.uint8,             # 死亡人數
+    "injury": np.uint8,            # 受傷人數
+    "weather": np.uint8,           # 天候 (字典編碼, 對照表存在 meta.json)
+}
+
+_store = {"mtime": None, "data": None}
+_heat_cache = {}                   # (資料版本, 層級) -> 熱力圖格子
+_index = {"version": None, "index": None}
+_lock = threading.Lock()
+
+# ==========================================
+# 1. 匯出 (MySQL -> .npy)
+# ==========================================
+def export_store(engine=None, chunksize=200_000, store_dir=STORE_DIR):
+    """分批讀取 accident_main, 轉成欄式陣列並依緯度排序後寫入 store_dir"""
+    engine = engine or get_db_engine()
+    if not engine:
+        print("Connection failed. Please check .env and db_utils.py")
+        return None
+
+    sql = text("""
+    SELECT latitude, longitude, accident_datetime, accident_hour, accident_year,
+           death_count, injury_count, weather_condition
+    FROM test_db.accident_main
+    WHERE latitude IS NOT NULL AND longitude IS NOT NULL
+    """)
+
+    started = time.perf_counter()
+    parts = {name: [] for name in COLUMNS}
+    weather_parts = []
+    total = 0
+    # stream_results: 用伺服器端游標逐批取回, 不會一次把 150 萬筆塞進記憶體
+    with engine.connect().execution_options(stream_results=True) as conn:
+        for chunk in pd.read_sql(sql, conn, chunksize=chunksize):
+            parts["lat"].append(pd.to_numeric(chunk['latitude'], errors='coerce').to_numpy(np.float32))
+            parts["lon"].append(pd.to_numeric(chunk['longitude'], errors='coerce').to_numpy(np.float32))
+            parts["datetime"].append(pd.to_datetime(chunk['accident_datetime'], errors='coerce').to_numpy("datetime64[s]"))
+            parts["hour"].append(chunk['accident_hour'].fillna(0).to_numpy(np.uint8))
+            parts["year"].append(chunk['accident_year'].fillna(0).to_numpy(np.int16))
+            parts["death"].append(chunk['death_count'].fillna(0).clip(0, 255).to_numpy(np.uint8))
+            parts["injury"].append(chunk['injury_count'].fillna(0).clip(0, 255).to_numpy(np.uint8))
+            weather_parts.append(chunk['weather_condition'].fillna("").astype(str).to_numpy())
+            total += len(chunk)
+            print(f"    已讀取 {total:,} 筆 ({total / (time.perf_counter() - started):,.0f} rows/s)")
+
+    columns = {name: np.concatenate(arrs) if arrs else np.array([], dtype=COLUMNS[name])
+               for name, arrs in parts.items() if name != "weather"}
+    # 天候字典編碼: 字串 -> 0..N 的代碼 (全台只有十幾種天候)
+    categories, codes = np.unique(np.concatenate(weather_parts) if weather_parts else np.array([], dtype=str),
+                                  return_inverse=True)
+    columns["weather"] = codes.astype(np.uint8)
+
+    # 依緯度排序, 查詢時可以二分搜尋緯度範圍
+    order = np.argsort(columns["lat"], kind="stable")
+    columns = {name: arr[order] for name, arr in columns.items()}
+
+    meta = {
+        "rows": int(len(order)),
+        "built_at": datetime.now().isoformat(timespec="seconds"),
+        "weather_categories": [str(c) for c in categories],
+        "dtypes": {name: str(arr.dtype) for name, arr in columns.items()},
+    }
+    _write_store(columns, meta, store_dir)
+    print(f"--- [系統] 欄式儲存已寫入 {store_dir} ({meta['rows']:,} 筆, {time.perf_counter() - started:.1f}s) ---")
+    return meta
+
+def _write_store(columns, meta, store_dir):
+    """先寫到暫存資料夾再整個換上去, 讀取端不會看到寫一半的檔案"""
+    tmp_dir, old_dir = f"{store_dir}.tmp", f"{store_dir}.old"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    for name, arr in columns.items():
+        np.save(os.path.join(tmp_dir, f"{name}.npy"), arr)
+    with open(os.path.join(tmp_dir, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False)
+
+    shutil.rmtree(old_dir, ignore_errors=True)
+    if os.path.exists(store_dir):
+        os.replace(store_dir, old_dir)
+    os.replace(tmp_dir, store_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+
+# ==========================================
+# 2. 讀取 (memory-mapped)
+# ==========================================
+def load_store(store_dir=STORE_DIR):
+    """回傳 {欄位: 唯讀 memmap 陣列, "meta": dict}; 尚未匯出時回傳 None"""
+    meta_path = os.path.join(store_dir, "meta.json")
+    try:
+        mtime = os.path.getmtime(meta_path)
+    except OSError:
+        return None
+    if _store["mtime"] != mtime:
+        with _lock:
+            if _store["mtime"] != mtime:
+                with open(meta_path, encoding="utf-8") as f:
+                    meta = json.load(f)
+                data = {name: np.load(os.path.join(store_dir, f"{name}.npy"), mmap_mode="r") for name in COLUMNS}
+                data["meta"] = meta
+                _store["data"], _store["mtime"] = data, mtime
+    return _store["data"]
+
+def is_available():
+    return load_store() is not None
+
+def data_version():
+    """欄式儲存的版本 (匯出時間), 可當快取 key"""
+    store = load_store()
+    return store["meta"]["built_at"] if store else None
+
+def get_spatial_index(store):
+    """依目前的欄式儲存建立格網空間索引 (每個版本只建一次, 150 萬筆約 0.3 秒)"""
+    version = store["meta"]["built_at"]
+    if _index["version"] != version:
+        with _lock:
+            if _index["version"] != version:
+                started = time.perf_counter()
+                _index["index"] = GridIndex(store["lat"], store["lon"])
+                _index["version"] = version
+                print(f"--- [系統] 事故空間索引建立完成 ({len(_index['index']):,} 筆, "
+                      f"{time.perf_counter() - started:.2f}s) ---")
+    return _index["index"]
+
+def radius_indices(store, center_lat, center_lon, radius_km, mode="box"):
+    """
+    回傳範圍內的列索引 (由小到大)
+    mode="box": BETWEEN 方框 (radius_km / 111), 與 MySQL 版本的查詢範圍相同
+    mode="circle": 球面距離 <= radius_km, 與空間索引模式 (ST_Distance_Sphere) 相同
+    """
+    return get_spatial_index(store).query(center_lat, center_lon, radius_km, mode)
+
+def box_indices(store, center_lat, center_lon, radius_km):
+    """回傳 BETWEEN 方框 (radius_km / 111) 內的列索引 (與 MySQL 版本的查詢範圍相同)"""
+    return radius_indices(store, center_lat, center_lon, radius_km, "box")
+
+def range_mask(values, spec):
+    """
+    (起, 迄) 含頭含尾的範圍遮罩; 起 > 迄 時視為跨越週期 (例如 hours=(22, 2) 代表 22 時 ~ 隔天 2 時)
+    spec 為 None 時回傳 None (不篩選)
+    """
+    if spec is None:
+        return None
+    start, end = spec
+    if start <= end:
+        return (values >= start) & (values <= end)
+    return (values >= start) | (values <= end)
+
+def filter_time(store, idx, years=None, hours=None):
+    """依發生年度 / 時段篩選列索引 (只看 idx 這幾列, 不掃描全表)"""
+    for column, spec in (("year", years), ("hour", hours)):
+        mask = range_mask(store[column][idx], spec)
+        if mask is not None:
+            idx = idx[mask]
+    return idx
+
+def year_range():
+    """資料的年度範圍 (最早, 最晚); 尚未匯出時回傳 None"""
+    store = load_store()
+    if store is None or not len(store["year"]): return None
+    years = store["year"][store["year"] > 0]
+    return (int(years.min()), int(years.max())) if len(years) else None
+
+# ==========================================
+# 3. 查詢 (與 import_traffic 同名同參數, 不經過資料庫)
+# ==========================================
+def _weather_names(store, codes):
+    categories = np.array(store["meta"]["weather_categories"], dtype=object)
+    return categories[codes] if len(categories) else np.array([], dtype=object)
+
+def _detail_frame(store, idx, limit):
+    """事故明細 (依發生時間由新到舊, 最多 limit 筆), 欄位與 MySQL 版本相同"""
+    if len(idx) > limit:
+        # 只需要最新的 limit 筆: argpartition 比整個排序快
+        newest = np.argpartition(store["datetime"][idx], len(idx) - limit)[len(idx) - limit:]
+        idx = idx[newest]
+    idx = idx[np.argsort(store["datetime"][idx], kind="stable")[::-1]]
+    return pd.DataFrame({
+        'lat': store["lat"][idx].astype(float),
+        'lon': store["lon"][idx].astype(float),
+        'weather_condition': _weather_names(store, store["weather"][idx]),
+        'accident_hour': store["hour"][idx].astype(int),
+        'accident_year': store["year"][idx].astype(int),
+        'death_count': store["death"][idx].astype(int),
+        'injury_count': store["injury"][idx].astype(int),
+    })
+
+def get_zone_stats(center_lat, center_lon, radius_km=1.0, mode="box", years=None, hours=None):
+    """計算指定半徑範圍內的車禍總數 (可依年度 / 時段篩選)"""
+    store = load_store()
+    if store is None: return 0
+    idx = radius_indices(store, center_lat, center_lon, radius_km, mode)
+    return int(len(filter_time(store, idx, years, hours)))
+
+def get_nearby_top10(center_lat, center_lon, radius_km=1.0, mode="box"):
+    """範圍內的事故 (前 10 筆), 欄位與 MySQL 版本相同: lat, lon, 路段 (天候), 事故數"""
+    store = load_store()
+    if store is None: return pd.DataFrame()
+    idx = radius_indices(store, center_lat, center_lon, radius_km, mode)[:10]
+    return pd.DataFrame({
+        'lat': store["lat"][idx].astype(float),
+        'lon': store["lon"][idx].astype(float),
+        '路段': _weather_names(store, store["weather"][idx]),
+        '事故數': np.ones(len(idx), dtype=int),
+    })
+
+def get_nearby_accidents_data(center_lat, center_lon, radius_km=0.5, limit=800, mode="box", years=None, hours=None):
+    """指定半徑內最新的事故明細 (依發生時間由新到舊, 最多 limit 筆, 可依年度 / 時段篩選)"""
+    store = load_store()
+    if store is None: return pd.DataFrame()
+    idx = radius_indices(store, center_lat, center_lon, radius_km, mode)
+    return _detail_frame(store, filter_time(store, idx, years, hours), limit)
+
+def get_market_profile_data(center_lat, center_lon, radii_km=(0.5, 1.0), detail_radius_km=0.5,
+                            top_n=10, detail_limit=800, mode="box", years=None, hours=None):
+    """與 import_traffic.get_market_profile_data 相同的回傳格式, 只查一次最大半徑再切出其他結果"""
+    result = {"total": 0, "radius_counts": {}, "top10": pd.DataFrame(), "accidents": pd.DataFrame()}
+    store = load_store()
+    if store is None: return result
+
+    radii_km = sorted(set(radii_km) | {detail_radius_km})
+    index = get_spatial_index(store)
+    idx = index.query(center_lat, center_lon, radii_km[-1], mode)
+    # 較小的半徑只看涵蓋範圍內的幾個格子, 多查幾次的成本很低
+    subsets = {r: index.query(center_lat, center_lon, r, mode) for r in radii_km[:-1]}
+    subsets[radii_km[-1]] = idx
+    if years is not None or hours is not None:
+        subsets = {r: filter_time(store, sub, years, hours) for r, sub in subsets.items()}
+        idx = subsets[radii_km[-1]]
+
+    result["radius_counts"] = {float(r): int(len(sub)) for r, sub in subsets.items()}
+    result["total"] = result["radius_counts"][float(radii_km[-1])]
+
+    counts = np.bincount(store["weather"][idx], minlength=len(store["meta"]["weather_categories"]))
+    top = np.argsort(counts, kind="stable")[::-1][:int(top_n)]
+    top = top[counts[top] > 0]
+    result["top10"] = pd.DataFrame({'路段': _weather_names(store, top), '事故數': counts[top].astype(int)})
+    result["accidents"] = _detail_frame(store, subsets[detail_radius_km], detail_limit)
+    return result
+
+def get_nearest_accidents(center_lat, center_lon, k=10):
+    """距離最近的 k 筆事故 (依距離由近到遠), 多一個 distance_km 欄位"""
+    store = load_store()
+    if store is None: return pd.DataFrame()
+    idx, dist = get_spatial_index(store).query_knn(center_lat, center_lon, k)
+    return pd.DataFrame({
+        'lat': store["lat"][idx].astype(float),
+        'lon': store["lon"][idx].astype(float),
+        'weather_condition': _weather_names(store, store["weather"][idx]),
+        'accident_year': store["year"][idx].astype(int),
+        'distance_km': dist,
+    })
+
+def count_zone_batch(centers, radius_km=1.0, mode="box"):
+    """一次計算多個中心點 (例如全部夜市) 範圍內的事故數, 回傳與 centers 同順序的 list"""
+    store = load_store()
+    if store is None: return [0] * len(centers)
+    return get_spatial_index(store).count_batch(centers, radius_km, mode).tolist()
+
+def get_taiwan_heatmap_data(zoom=None):
+    """
+    全台格網聚合 [[lat, lon, count], ...]
+    zoom 未指定時與 MySQL 版本相同 (ROUND 到小數 2 位); 指定時依熱力圖金字塔的層級切格子
+    """
+    store = load_store()
+    if store is None: return []
+
+    level = None if zoom is None else level_for_zoom(zoom)
+    cache_key = (store["meta"]["built_at"], level)
+    if cache_key in _heat_cache:
+        return _heat_cache[cache_key]
+
+    lat, lon = store["lat"], store["lon"]
+    lo = np.searchsorted(lat, TAIWAN_BOUNDS["min_lat"], side="left")
+    hi = np.searchsorted(lat, TAIWAN_BOUNDS["max_lat"], side="right")
+    lat, lon = np.asarray(lat[lo:hi], dtype=np.float64), np.asarray(lon[lo:hi], dtype=np.float64)
+    keep = (lon >= TAIWAN_BOUNDS["min_lon"]) & (lon <= TAIWAN_BOUNDS["max_lon"])
+    lat, lon = lat[keep], lon[keep]
+
+    if level is None:
+        gy, gx, step, shift = np.round(lat * 100).astype(np.int64), np.round(lon * 100).astype(np.int64), 0.01, 0.0
+    else:
+        gy, gx, step, shift = np.floor(lat / level).astype(np.int64), np.floor(lon / level).astype(np.int64), level, 0.5
+    keys, counts = np.unique(gy * KEY_STRIDE + gx, return_counts=True)
+    cells = np.column_stack([
+        np.round((np.floor_divide(keys, KEY_STRIDE) + shift) * step, 6),
+        np.round((np.mod(keys, KEY_STRIDE) + shift) * step, 6),
+        counts]).tolist()
+    _heat_cache[cache_key] = cells
+    return cells
+
+# ==========================================
+# 4. 測試程式
+# ==========================================
+if __name__ == "__main__":
+    export_store()
+
+    # 模擬士林夜市座標
+    shilin_lat, shilin_lon = 25.088, 121.524
+    t0 = time.perf_counter()
+    total_1km = get_zone_stats(shilin_lat, shilin_lon, radius_km=1.0)
+    df_details = get_nearby_accidents_data(shilin_lat, shilin_lon, radius_km=0.5)
+    print(f"1km 事故總數: {total_1km}, 500m 明細: {len(df_details)} 筆 ({(time.perf_counter() - t0) * 1000:.1f} ms)")
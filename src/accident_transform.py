@@ -0,0 +1,233 @@
+import re
+import time
+import hashlib # 產生PK (唯一雜湊ID)
+import numpy as np
+import pandas as pd
+from sqlalchemy import types
+
+# ==========================================
+# 交通事故 CSV 的資料表定義與清洗邏輯
+# 由 archive/2026-01-21_traffic-accidents-crawler-mysql-ingestion/111year_traffic_Crawler.ipynb 搬出,
+# 供 ingest_accidents.py 使用
+# transform_data 為向量化版本 (pandas .str / str.extract), 輸出與原本逐列處理的 transform_data_legacy 完全相同
+# 驗證: python accident_transform.py (以 data/data_accident_partial 的樣本 CSV 比對兩個版本)
+# ==========================================
+
+# 主表：一件事故只有一筆資料 (去重)
+MAIN_SCHEMA = {
+    "發生年度": {"name": "accident_year", "type": types.INTEGER},
+    "發生月份": {"name": "accident_month", "type": types.INTEGER},
+    "formatted_date": {"name": "accident_date", "type": types.Date},
+    "formatted_time": {"name": "accident_time", "type": types.Time},
+    "formatted_datetime": {"name": "accident_datetime", "type": types.DateTime},  # 地圖依時間排序用
+    "formatted_hour": {"name": "accident_hour", "type": types.INTEGER},          # 時段統計用
+    "發生地點": {"name": "accident_location", "type": types.VARCHAR(150)},
+    "death_count": {"name": "death_count", "type": types.INTEGER},
+    "injury_count": {"name": "injury_count", "type": types.INTEGER},
+    "天候名稱": {"name": "weather_condition", "type": types.VARCHAR(20)},
+    "經度": {"name": "longitude", "type": types.DECIMAL(10, 6)},
+    "緯度": {"name": "latitude", "type": types.DECIMAL(10, 6)},
+    "accident_id": {"name": "accident_id", "type": types.BigInteger}
+}
+
+# 細節表：包含所有當事者資訊 (保留所有筆數)
+DETAIL_SCHEMA = {
+    "accident_id": {"name": "accident_id", "type": types.BigInteger},
+    "當事者順位": {"name": "party_sequence", "type": types.INTEGER},
+    "事故類別名稱": {"name": "accident_category", "type": types.VARCHAR(50)},
+    "處理單位名稱警局層": {"name": "police_department", "type": types.VARCHAR(100)},
+    "光線名稱": {"name": "light_condition", "type": types.VARCHAR(30)},
+    "道路類別-第1當事者-名稱": {"name": "road_type_primary_party", "type": types.VARCHAR(30)},
+    "速限-第1當事者": {"name": "speed_limit_primary_party", "type": types.SMALLINT},
+    "道路型態大類別名稱": {"name": "road_form_major", "type": types.VARCHAR(30)},
+    "道路型態子類別名稱": {"name": "road_form_minor", "type": types.VARCHAR(30)},
+    "事故位置大類別名稱": {"name": "accident_position_major", "type": types.VARCHAR(30)},
+    "事故位置子類別名稱": {"name": "accident_position_minor", "type": types.VARCHAR(30)},
+    "路面狀況-路面鋪裝名稱": {"name": "road_surface_pavement", "type": types.VARCHAR(30)},
+    "路面狀況-路面狀態名稱": {"name": "road_surface_condition", "type": types.VARCHAR(30)},
+    "路面狀況-路面缺陷名稱": {"name": "road_surface_defect", "type": types.VARCHAR(30)},
+    "道路障礙-障礙物名稱": {"name": "road_obstacle", "type": types.VARCHAR(30)},
+    "視距-視距情形名稱": {"name": "sight_distance_quality", "type": types.VARCHAR(30)},
+    "視距-視距名稱": {"name": "sight_distance", "type": types.VARCHAR(30)},
+    "號誌-號誌種類名稱": {"name": "traffic_signal_type", "type": types.VARCHAR(30)},
+    "號誌-號誌動作名稱": {"name": "traffic_signal_action", "type": types.VARCHAR(30)},
+    "車道劃分設施-分向設施大類別名稱": {"name": "lane_divider_direction_major", "type": types.VARCHAR(40)},
+    "車道劃分設施-分向設施子類別名稱": {"name": "lane_divider_direction_minor", "type": types.VARCHAR(40)},
+    "車道劃分設施-快慢車道間名稱": {"name": "lane_divider_fast_slow", "type": types.VARCHAR(40)},
+    "車道劃分設施-主車道線名稱": {"name": "lane_divider_main_general", "type": types.VARCHAR(40)},
+    "車道劃分設施-路邊邊線名稱": {"name": "lane_edge_marking", "type": types.VARCHAR(40)},
+    "事故類型及型態大類別名稱": {"name": "accident_type_major", "type": types.VARCHAR(40)},
+    "事故類型及型態子類別名稱": {"name": "accident_type_minor", "type": types.VARCHAR(100)},
+    "肇因研判大類別名稱-主要": {"name": "cause_analysis_major_primary", "type": types.VARCHAR(100)},
+    "肇因研判子類別名稱-主要": {"name": "cause_analysis_minor_primary", "type": types.VARCHAR(200)},
+    "當事者區分-類別-大類別名稱-車種": {"name": "vehicle_type_major", "type": types.VARCHAR(40)},
+    "當事者區分-類別-子類別名稱-車種": {"name": "vehicle_type_minor", "type": types.VARCHAR(100)},
+    "當事者屬-性-別名稱": {"name": "gender", "type": types.VARCHAR(30)},
+    "當事者事故發生時年齡": {"name": "age", "type": types.SMALLINT},
+    "保護裝備名稱": {"name": "protective_equipment", "type": types.VARCHAR(30)},
+    "行動電話或電腦或其他相類功能裝置名稱": {"name": "mobile_device_usage", "type": types.VARCHAR(30)},
+    "當事者動作大類別名稱": {"name": "party_action_major", "type": types.VARCHAR(40)},
+    "當事者動作子類別名稱": {"name": "party_action_minor", "type": types.VARCHAR(40)},
+    "碰撞部位-最初大類別名稱": {"name": "impact_point_major_initial", "type": types.VARCHAR(40)},
+    "碰撞部位-最初子類別名稱": {"name": "impact_point_minor_initial", "type": types.VARCHAR(40)},
+    "碰撞部位-其他大類別名稱": {"name": "impact_point_major_other", "type": types.VARCHAR(40)},
+    "碰撞部位-其他子類別名稱": {"name": "impact_point_minor_other", "type": types.VARCHAR(40)},
+    "肇因研判大類別名稱-個別": {"name": "cause_analysis_major_individual", "type": types.VARCHAR(40)},
+    "肇因研判子類別名稱-個別": {"name": "cause_analysis_minor_individual", "type": types.VARCHAR(200)},
+    "肇事逃逸類別名稱-是否肇逃": {"name": "hit_and_run", "type": types.VARCHAR(20)}
+}
+
+# 產生 accident_id 時用到的數值欄位
+# 整份 CSV 讀入時, 檔尾的「資料提供日期」說明列會讓這些欄位變成 float (例如 20220101.0),
+# 現有資料庫的 accident_id 就是用 float 字串算出來的; 分批讀取時每批一律轉成 float, ID 才會一致
+NUMERIC_KEY_COLUMNS = ["發生日期", "發生時間", "經度", "緯度"]
+
+def normalize_chunk(df):
+    """讀檔後的型態統一 (不論整檔或分批讀取, 結果都相同)"""
+    for col in NUMERIC_KEY_COLUMNS:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors='coerce').astype(float)
+    return df
+
+def transform_data_legacy(df):
+    """資料清洗與 ID 生成 (notebook 原始的逐列版本, 保留作為 transform_data 的比對基準)"""
+    df = df.map(lambda x: x.strip() if isinstance(x, str) else x)
+
+    # 日期轉換：20220101 -> 2022-01-01
+    def fix_date(x):
+        s = str(x).split('.')[0]
+        # s[:4] 取前四碼 (年), s[4:6] 取中間兩碼 (月), s[6:8] 取最後兩碼 (日)
+        return f"{s[:4]}-{s[4:6]}-{s[6:8]}" if len(s) >= 8 else None
+
+    df['formatted_date'] = df['發生日期'].apply(fix_date)
+
+    # 時間轉換：14700 -> 01:47:00 (補至六位並加上冒號)
+    df['formatted_time'] = df['發生時間'].apply(lambda x: f"{str(x).split('.')[0].zfill(6)[:2]}:{str(x).split('.')[0].zfill(6)[2:4]}:{str(x).split('.')[0].zfill(6)[4:6]}")
+
+    # 日期 + 時間 -> accident_datetime / accident_hour (地圖與統計表使用)
+    df['formatted_datetime'] = df['formatted_date'] + " " + df['formatted_time']
+    df['formatted_hour'] = df['formatted_time'].str[:2].apply(lambda x: int(x) if x.isdigit() else None)
+
+    # 傷亡拆分：運用Group概念從"死亡1受傷2"提取數字
+    def extract_num(val):
+        d = re.search(r'死亡(\d+)', str(val)); i = re.search(r'受傷(\d+)', str(val))
+        return int(d.group(1)) if d else 0, int(i.group(1)) if i else 0
+
+    # 將提取結果分配給兩個新欄位
+    df[['death_count', 'injury_count']] = df['死亡受傷人數'].apply(lambda x: pd.Series(extract_num(x)))
+
+    # 生成ID：用SHA256雜湊將地點時間轉成唯一編號
+    df['accident_id'] = df.apply(lambda r: int(hashlib.sha256(f"{r['發生日期']}{r['發生時間']}{r['發生地點']}{r['經度']}{r['緯度']}".encode()).hexdigest(), 16) % (10**15), axis=1)
+
+    return df.dropna(subset=['formatted_date'])
+
+# pandas 推斷字串欄位時使用的型態 (pandas 3 為 str, 舊版為 object), 輸出型態才會與逐列版本相同
+_STR_DTYPE = pd.Series(["x"]).dtype
+
+def _as_str(s):
+    """與 str(x) 相同的字串化 (NaN -> "nan"), 數值欄位交給 NumPy 一次轉換"""
+    if pd.api.types.is_float_dtype(s.dtype) or pd.api.types.is_integer_dtype(s.dtype):
+        return pd.Series(np.asarray(s).astype(str), index=s.index, dtype=_STR_DTYPE)
+    if pd.api.types.is_string_dtype(s.dtype) and s.dtype != object:
+        return s.fillna("nan")
+    return s.map(str).astype(_STR_DTYPE)
+
+def _hash_ids(keys):
+    """批次產生 accident_id: SHA256 -> 取 10^15 餘數 (與 int(hexdigest, 16) % 10**15 相同)"""
+    sha256, from_bytes, mod = hashlib.sha256, int.from_bytes, 10**15
+    return np.fromiter((from_bytes(sha256(k.encode()).digest(), "big") % mod for k in keys),
+                       dtype=np.int64, count=len(keys))
+
+def _by_unique(s, func):
+    """
+    重複值很多的欄位 (日期、時間、傷亡字串...): 只對不重複的值做字串運算, 再依代碼展開回每一列
+    func 接收不重複值組成的 Series, 回傳同長度的 Series
+    """
+    codes, uniques = pd.factorize(s, use_na_sentinel=False)
+    out = func(pd.Series(uniques, dtype=s.dtype))
+    return out.take(codes).set_axis(s.index)
+
+def _strip(s):
+    if pd.api.types.is_string_dtype(s.dtype) and s.dtype != object:
+        return s.str.strip()
+    stripped = s.str.strip()               # 非字串的值會變成 NaN, 保留原值
+    return stripped.where(stripped.notna(), s)
+
+def _format_date(s):
+    # 取小數點前的字串, 至少 8 碼才有效
+    date_str = _as_str(s).str.partition('.')[0]
+    formatted = date_str.str[:4] + "-" + date_str.str[4:6] + "-" + date_str.str[6:8]
+    return formatted.where(date_str.str.len() >= 8)
+
+def _format_time(s):
+    time_str = _as_str(s).str.partition('.')[0].str.zfill(6)
+    return time_str.str[:2] + ":" + time_str.str[2:4] + ":" + time_str.str[4:6]
+
+def _extract_count(pattern):
+    return lambda s: pd.to_numeric(_as_str(s).str.extract(pattern, expand=False)).fillna(0).astype(np.int64)
+
+ID_COLUMNS = ['發生日期', '發生時間', '發生地點', '經度', '緯度']
+
+def transform_data(df):
+    """資料清洗與 ID 生成 (向量化版本)"""
+    df = df.copy()
+    # 去除字串前後空白: 只處理字串欄位, 數值欄位不動 (類別欄位的不重複值很少)
+    for col in df.columns:
+        if pd.api.types.is_string_dtype(df[col].dtype):
+            df[col] = _by_unique(df[col], _strip)
+
+    # 日期轉換：20220101 -> 2022-01-01
+    df['formatted_date'] = _by_unique(df['發生日期'], _format_date)
+
+    # 時間轉換：14700 -> 01:47:00 (補至六位並加上冒號)
+    df['formatted_time'] = _by_unique(df['發生時間'], _format_time)
+
+    # 日期 + 時間 -> accident_datetime / accident_hour
+    df['formatted_datetime'] = df['formatted_date'] + " " + df['formatted_time']
+    hour_str = df['formatted_time'].str[:2]
+    df['formatted_hour'] = pd.to_numeric(hour_str.where(hour_str.str.isdigit()), errors='coerce')
+
+    # 傷亡拆分："死亡1;受傷2" -> 兩個數字 (str.extract 一次抽取整欄)
+    df['death_count'] = _by_unique(df['死亡受傷人數'], _extract_count(r'死亡(\d+)'))
+    df['injury_count'] = _by_unique(df['死亡受傷人數'], _extract_count(r'受傷(\d+)'))
+
+    # 生成ID：同一事故的每個當事者 ID 都相同, 只對不重複的 (日期, 時間, 地點, 經度, 緯度) 雜湊一次
+    codes = df.groupby(ID_COLUMNS, sort=False, dropna=False).ngroup().to_numpy()
+    first = np.unique(codes, return_index=True)[1]
+    keys = _as_str(df[ID_COLUMNS[0]].iloc[first])
+    for col in ID_COLUMNS[1:]:
+        keys = keys + _as_str(df[col].iloc[first])
+    df['accident_id'] = _hash_ids(keys.tolist())[codes]
+
+    return df.dropna(subset=['formatted_date'])
+
+def split_tables(df):
+    """清洗後的資料 -> (主表 DataFrame, 細節表 DataFrame), 欄位名稱已轉成資料庫名稱"""
+    # 建立欄位對照表 (原始名稱: 資料庫名稱), 篩選欄位、更名、並根據 accident_id 去除重複項
+    m_map = {key: value['name'] for key, value in MAIN_SCHEMA.items() if key in df.columns}
+    df_m = df[list(m_map.keys())].rename(columns=m_map)
+    df_m = df_m.drop_duplicates(subset=['accident_id'])
+
+    # 細節表不去重，保留所有當事者
+    d_map = {key: value['name'] for key, value in DETAIL_SCHEMA.items() if key in df.columns}
+    df_d = df[list(d_map.keys())].rename(columns=d_map)
+    return df_m, df_d
+
+# ==========================================
+# 測試程式: 向量化版本與原始版本比對
+# ==========================================
+if __name__ == "__main__":
+    import os
+    sample = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          "..", "data", "data_accident_partial", "111年度A1交通事故資料.csv")
+    raw = pd.read_csv(sample, encoding='utf-8-sig', low_memory=False)
+
+    t0 = time.perf_counter()
+    expected = transform_data_legacy(raw.copy())
+    t1 = time.perf_counter()
+    actual = transform_data(raw.copy())
+    t2 = time.perf_counter()
+
+    pd.testing.assert_frame_equal(actual, expected)
+    print(f"--- [系統] 輸出一致: {len(actual):,} 列 x {actual.shape[1]} 欄 ---")
+    print(f"    原始版本 {t1 - t0:.3f}s / 向量化版本 {t2 - t1:.3f}s ({(t1 - t0) / (t2 - t1):.1f} 倍)")
@@ -1,103 +1,263 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import streamlit as st
 import pandas as pd
 from streamlit_folium import st_folium
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 
 # --- 引入模組 ---
 import import_weather
 import import_night_market as nm
 import import_traffic as tr
 import import_view_manager as vm
-import import_weather_station as wx 
+import import_market_profile as mp
+import heatmap_pyramid
+import data_version as dv
+import warm_market_cache
+import db_utils
 
 df_local_accidents = pd.DataFrame()
 # ---------------------------------------------------------
 # 1. 載入資料 (Data Loading)
 # ---------------------------------------------------------
-@st.cache_data(ttl=3600, show_spinner=False)
-def get_cached_taiwan_heatmap():
-    return tr.get_taiwan_heatmap_data()
+# 全島概覽 / 夜市詳細的地圖縮放 (與 build_map 的 zoom_start 相同), 決定熱力圖金字塔的層級
+OVERVIEW_ZOOM = 8
+DETAIL_ZOOM = 16
 
-@st.cache_data(ttl=3600, show_spinner=False)
-def get_cached_local_accidents(lat, lon, radius):
-    return tr.get_nearby_accidents_data(lat, lon, radius)
+# 快取失效: 不再固定每小時過期, 改以資料版本 token 當 key 的一部分 (version 參數)
+# 資料沒變就一直命中; 匯入新資料 / 重建預先計算檔後, 下一次版本檢查 (DATA_VERSION_CHECK_INTERVAL) 就換 key
+# 舊版本的項目不會再被用到, 由 max_entries 淘汰
+# 即時氣象不是資料庫來源, 仍然以時間過期
+WEATHER_TTL = 600   # 秒: 氣象署觀測資料約 10 分鐘更新一次
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def get_cached_taiwan_heatmap(zoom=None, years=None, hours=None, version=None):
+    return tr.get_taiwan_heatmap_data(zoom, years, hours)
+
+# 熱力圖以「切片」為單位快取: 地圖小幅平移時切片不變, 直接命中快取
+# 年度 / 時段篩選也是快取 key 的一部分 (有篩選時由聚合 Cube 切片, 每個切片只要幾毫秒)
+@st.cache_data(max_entries=4096, show_spinner=False)
+def get_cached_heatmap_tile(level, ty, tx, years=None, hours=None, version=None):
+    return tr.get_heatmap_tile(level, ty, tx, years, hours)
+
+def get_viewport_heatmap(bounds, zoom, years=None, hours=None):
+    """只取可視範圍內、對應縮放層級的熱力圖格子 (SQL 結果與 HTML 都只包含看得到的部分)"""
+    level, tiles = heatmap_pyramid.tiles_for_bounds(*bounds, zoom)
+    version = tr.accident_version()
+    cells = []
+    for ty, tx in tiles:
+        cells.extend(get_cached_heatmap_tile(level, ty, tx, years, hours, version))
+    return cells
+
+# 側邊欄年度滑桿的範圍 (最早, 最晚)
+@st.cache_data(max_entries=4, show_spinner=False)
+def get_cached_year_range(version=None):
+    return tr.get_accident_year_range()
+
+# 車禍點位聚合: 查詢範圍比畫面大一圈 (上下左右各多 CLUSTER_PAD 個畫面寬/高的一半), 小幅平移不用重新查詢
+CLUSTER_PAD = 0.5
+
+@st.cache_data(max_entries=512, show_spinner=False)
+def get_cached_clusters(bounds=None, zoom=None, version=None):
+    return tr.get_accident_clusters(bounds, zoom)
+
+def cluster_bounds(view):
+    """聚合點的查詢範圍 (可視範圍往外擴)"""
+    south, west, north, east = view['bounds']
+    pad_h, pad_w = (north - south) * CLUSTER_PAD, (east - west) * CLUSTER_PAD
+    return (south - pad_h, west - pad_w, north + pad_h, east + pad_w)
+
+def view_changed(new_view, old_view, layers):
+    """平移/縮放後是否需要重新取資料: 熱力圖換了切片, 或 (開啟車禍點位時) 縮放層級改變 / 移出聚合點的查詢範圍"""
+    if view_tiles(new_view) != view_tiles(old_view):
+        return True
+    if not layers.get('traffic_points'):
+        return False
+    if old_view is None or new_view['zoom'] != old_view['zoom']:
+        return True
+    south, west, north, east = cluster_bounds(old_view)
+    n_south, n_west, n_north, n_east = new_view['bounds']
+    return not (n_south >= south and n_west >= west and n_north <= north and n_east <= east)
+
+def view_tiles(view):
+    """視角對應的 (層級, 切片清單), 用來判斷平移/縮放後是否需要重新取資料"""
+    if not view: return None
+    return heatmap_pyramid.tiles_for_bounds(*view['bounds'], view['zoom'])
+
+# 啟動時預熱資料庫連線池 (cache_resource: 整個 Process 只執行一次)
+@st.cache_resource(show_spinner=False)
+def init_db_pool():
+    return db_utils.warm_up_engine()
+
+# 啟動時在背景預熱所有夜市的詳細頁快取 (.env CACHE_WARMUP_ON_START=1; 整個 Process 只執行一次)
+@st.cache_resource(show_spinner=False)
+def start_cache_warmer():
+    if warm_market_cache.WARMUP_ON_START:
+        return warm_market_cache.start_background_warmup()
+    return None
+
+@st.cache_data(max_entries=4, show_spinner=False)
+def get_cached_markets(version=None):
+    return nm.get_all_nightmarkets()
+
+@st.cache_data(ttl=WEATHER_TTL, show_spinner=False)
+def get_cached_weather():
+    return import_weather.fetch_weather_data()
+
+# 啟動資料 (夜市 / 年度範圍 / 全台熱力圖 / 氣象) 彼此獨立, 在背景同時載入:
+# 等待時間 ≈ 最慢的一個來源, 而不是加總; 畫面依序「用到才等」(夜市到了就先畫側邊欄, 地圖圖層之後補上)
+# 所有 session 共用同一個執行緒池 (結果本身由上面的快取共用, 同時載入同一份資料只會查一次)
+_loader = ThreadPoolExecutor(max_workers=8, thread_name_prefix="app-loader")
+
+# 各來源失敗時的預設值 (與各函式原本失敗時的回傳一致)
+_LOAD_DEFAULTS = {
+    "markets": pd.DataFrame,
+    "year_range": lambda: None,
+    "heatmap": list,
+    "weather": lambda: ([], [], [], {"name": "計算中", "rain": 0}),
+}
+
+def _submit(func, *args, **kwargs):
+    """在背景執行緒執行, 並帶上目前 session 的 ScriptRunContext (st.cache_data 需要)"""
+    ctx = get_script_run_ctx()
+    def run():
+        add_script_run_ctx(threading.current_thread(), ctx)
+        return func(*args, **kwargs)
+    return _loader.submit(run)
 
 # 定義 load_data
-@st.cache_data(ttl=3600)
+# 本身不快取: 各項資料各自依版本 (夜市 / 事故) 或時間 (氣象) 快取, 只有變動的部分會重新讀取
+# 回傳 {名稱: Future}, 用 loaded(loads, 名稱) 取結果 (會等到該來源載入完成)
 def load_data():
-    # 1. 載入夜市資料
-    df_market = nm.get_all_nightmarkets()
-    
-    # 2. 載入全台熱力圖數據
-    # traffic_global 就會變成「全台格網數據」，而且只有 4 個回傳值
-    traffic_global = get_cached_taiwan_heatmap() 
-    
-    # 3. 載入天氣資料
-    weather_data = import_weather.fetch_weather_data()
-    
-    # 4. 載入 Top 10 (預設空值)
-    df_top10 = pd.DataFrame()
+    return {
+        # 1. 夜市資料 (側邊欄 / 夜市清單)
+        "markets": _submit(lambda: get_cached_markets(dv.source_version("nightmarkets"))),
+        # 2. 事故年度範圍 (側邊欄年度滑桿)
+        "year_range": _submit(lambda: get_cached_year_range(tr.accident_version())),
+        # 3. 全台熱力圖數據 (格網)
+        "heatmap": _submit(lambda: get_cached_taiwan_heatmap(OVERVIEW_ZOOM, version=tr.accident_version())),
+        # 4. 天氣資料 (CWA API, 最長 10 秒)
+        "weather": _submit(get_cached_weather),
+    }
 
-    # 🔥 確認這裡只回傳 4 個變數，跟 main() 裡面的接收端一致！
-    return df_market, traffic_global, weather_data, df_top10
+def loaded(loads, name):
+    """等待某個來源載入完成並回傳結果; 失敗時回傳預設值, 不影響其他來源"""
+    try:
+        return loads[name].result()
+    except Exception as e:
+        print(f"[錯誤] 載入 {name} 失敗: {e}")
+        return _LOAD_DEFAULTS[name]()
 
 # ---------------------------------------------------------
 # 2. 主程式邏輯 (Main)
 # ---------------------------------------------------------
 def main():
     st.set_page_config(layout="wide", page_title="台灣夜市風險地圖")
+    init_db_pool()
+    start_cache_warmer()
     
-    # 讀取資料
-    df_market, traffic_global, weather_data, _ = load_data()
+    # 讀取資料 (背景同時載入, 下面用到哪個才等哪個)
+    loads = load_data()
+    df_market = loaded(loads, "markets")
     
     # --- 側邊欄渲染 (Sidebar) ---
-    is_overview, target_market, layers = vm.render_sidebar(df_market)
+    # 只等夜市清單: 熱力圖 / 氣象還在載入時, 側邊欄就已經可以操作
+    # 年度範圍要掃整張事故表 (MIN/MAX), 還沒查完就先不顯示年度滑桿, 不讓側邊欄等它;
+    # 查到後記在 session_state, 之後重跑時即使背景還在載入也能直接顯示滑桿
+    if loads["year_range"].done():
+        st.session_state['year_range'] = loaded(loads, "year_range")
+    is_overview, target_market, layers, time_filter = vm.render_sidebar(df_market, st.session_state.get('year_range'))
+    years, hours = time_filter['years'], time_filter['hours']
+
+    # 標題與版面先畫出來, 地圖在資料到齊前顯示載入中
+    st.markdown("<h1 style='text-align: center;'>台灣夜市與交通事故風險地圖</h1>", unsafe_allow_html=True)
+    # 建立左右兩欄 (7:3)
+    # col_map (左邊 70%): 放地圖
+    # col_info (右邊 30%): 放分析數據
+    col_map, col_info = st.columns([7, 3])
+    with col_map:
+        map_loading = st.empty()
+        map_loading.info("🗺️ 地圖資料載入中...")
     
     # 預設變數 (先給空值，避免後面報錯)
     df_top10 = pd.DataFrame()
     nearest_station_info = None  # 準備傳給右邊的變數
     risk_count = 0               # 準備傳給右邊的變數
     df_local_accidents = pd.DataFrame() 
+    df_clusters = None
     
 
+    # 概覽模式：使用者平移/縮放過地圖後, 熱力圖只取目前可視範圍 (第一次顯示沿用 load_data 的全島資料)
+    # traffic_global 為 None 時, 畫地圖前才等 load_data 的全島熱力圖 (沒用到就不等, 背景載入完成後留在快取裡)
+    map_view = st.session_state.get('map_view') if is_overview else None
+    traffic_global = None
+    if map_view:
+        traffic_global = get_viewport_heatmap(map_view['bounds'], map_view['zoom'], years, hours)
+    elif is_overview and (years or hours):
+        # 有時間篩選: load_data 的全島資料是全期的, 改取篩選後的全島格子
+        traffic_global = get_cached_taiwan_heatmap(OVERVIEW_ZOOM, years, hours, tr.accident_version())
+
+    # 車禍點位 (全部事故的階層式聚合): 只取目前視角看得到的聚合點, 第一次顯示為全島範圍
+    # 聚合索引是全部年度 / 時段的資料, 不套用時間篩選
+    if is_overview and layers['traffic_points']:
+        version = tr.accident_version()
+        df_clusters = (get_cached_clusters(cluster_bounds(map_view), map_view['zoom'], version) if map_view
+                       else get_cached_clusters(None, OVERVIEW_ZOOM, version))
+        if df_clusters is None:
+            st.sidebar.caption("⚠️ 尚未建立事故聚合索引 (python accident_clusters.py)")
+
     if not is_overview and target_market is not None:
-        # 1. 搜尋最近測站
-        nearest_station_info = wx.find_nearest_station(target_market['lat'], target_market['lon'])
-        
-        # 2. 計算 1km 內事故風險
-        risk_count = tr.get_zone_stats(target_market['lat'], target_market['lon'], radius_km=1.0)
-        
-        # 3. 更新 Top 10
-        df_top10 = tr.get_nearby_top10(target_market['lat'], target_market['lon'])
-        
-        # 4. 呼叫後端抓 500m 內的事故點
-        df_local_accidents = tr.get_nearby_accidents_data(
-            target_market['lat'], 
-            target_market['lon'], 
-            radius_km=0.5
-        )
-        # 5. 呼叫有快取的函式
-        df_local_accidents = get_cached_local_accidents(target_market['lat'], target_market['lon'], 0.5)
+        # 詳細模式：只取夜市周邊 (街道等級) 的細格熱力圖
+        detail_bounds = vm.estimate_bounds(target_market['lat'], target_market['lon'], DETAIL_ZOOM)
+        traffic_global = get_viewport_heatmap(detail_bounds, DETAIL_ZOOM, years, hours)
 
+        # 最近測站 與 事故綜合查詢 (1km 事故風險、Top 10、500m 事故點 一次取回) 同時送出
+        # 等待時間 ≈ 最慢的一個查詢, 而不是加總; 個別失敗時其他結果照常顯示
+        profile = mp.fetch_market_profile(
+            target_market['lat'], target_market['lon'],
+            risk_radius_km=1.0, detail_radius_km=0.5, years=years, hours=hours)
+        nearest_station_info = profile['station']
+        risk_count = profile['risk_count']
+        df_top10 = profile['top10']
+        df_local_accidents = profile['accidents']
+        if profile['errors']:
+            st.warning(f"⚠️ 部分資料載入失敗: {', '.join(profile['errors'])}")
 
-    # --- [B] 地圖渲染 (Map) ---
-    st.markdown("<h1 style='text-align: center;'>台灣夜市與交通事故風險地圖</h1>", unsafe_allow_html=True)
-    # 建立左右兩欄 (7:3)
-    # col_map (左邊 70%): 放地圖
-    # col_info (右邊 30%): 放分析數據
-    col_map, col_info = st.columns([7, 3])
 
+    weather_data = loaded(loads, "weather")
+
+    with col_info:
+        # 1. 右欄：顯示資訊面板 (只需要氣象 / 夜市查詢結果, 先於地圖顯示)
+        # 只要縮排在這個 with 底下，所有 st.write 都會自動跑到右邊
+        vm.render_info_panel(
+            is_overview, 
+            target_market, 
+            df_top10, 
+            weather_data, 
+            layers,
+            nearest_station_info, 
+            risk_count,
+            df_local_accidents,
+            time_filter
+            )
+
+    # --- [B] 地圖渲染 (Map) ---
     with col_map:
-        # 1. 左欄：呼叫 View Manager
+        # 2. 左欄：呼叫 View Manager (取代載入中的提示)
+        if traffic_global is None:
+            traffic_global = loaded(loads, "heatmap")
+        map_loading.empty()
         m = vm.build_map(
             is_overview, target_market, layers, weather_data, 
-            traffic_global, df_top10, df_market,df_local_accidents)
+            traffic_global, df_top10, df_market,df_local_accidents, view=map_view, df_clusters=df_clusters)
         
         if m:
             # 加上 use_container_width=True，讓地圖自動縮放填滿左欄
             # 動態決定要不要回傳點擊事件
-             #「概覽模式」，要監聽點擊 (跳轉夜市) --> ["last_object_clicked"]
+             #「概覽模式」，要監聽點擊 (跳轉夜市) 與 可視範圍 (熱力圖只取看得到的切片)
+             #     --> ["last_object_clicked", "bounds", "zoom", "center"]
              #「詳細模式」，不監聽任何東西 (純瀏覽) --> []
-            objects_to_return = ["last_object_clicked"] if is_overview else []
+            objects_to_return = ["last_object_clicked", "bounds", "zoom", "center"] if is_overview else []
             
             # 顯示地圖
             map_data = st_folium(
@@ -109,19 +269,13 @@ def main():
             if is_overview:
                 vm.handle_map_interaction(map_data, df_market)
 
-    with col_info:
-        # 2. 右欄：顯示資訊面板
-        # 只要縮排在這個 with 底下，所有 st.write 都會自動跑到右邊
-        vm.render_info_panel(
-            is_overview, 
-            target_market, 
-            df_top10, 
-            weather_data, 
-            layers,
-            nearest_station_info, 
-            risk_count,
-            df_local_accidents
-            )
+                # 可視範圍換到不同的切片 (或縮放層級) 才重新執行, 小幅平移不會觸發
+                new_view = vm.parse_map_view(map_data)
+                if new_view and view_changed(new_view, map_view, layers):
+                    st.session_state['map_view'] = new_view
+                    # 第一次回傳且仍是全島縮放: 畫面上已經是全島資料, 記下視角即可
+                    if map_view is not None or new_view['zoom'] != OVERVIEW_ZOOM:
+                        st.rerun()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
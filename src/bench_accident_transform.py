@@ -0,0 +1,62 @@
+import os
+import time
+import argparse
+import pandas as pd
+from accident_transform import normalize_chunk, transform_data, transform_data_legacy
+
+# ==========================================
+# Benchmark: transform_data 逐列版本 vs 向量化版本 (rows/s)
+# 以 data/data_accident_partial 的樣本 CSV 重複堆疊成指定列數, 不需要資料庫
+# 執行: python bench_accident_transform.py --rows 300000
+# ==========================================
+
+SAMPLE_CSV = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          "..", "data", "data_accident_partial", "111年度A1交通事故資料.csv")
+
+def _replicate(df, n_rows):
+    """
+    把樣本重複堆疊到 n_rows 列 (索引重新編號, 與讀大檔的情況相同)
+    每一份複本的經度平移一點點, 事故才不會全部重複 (否則 accident_id 只需雜湊一份樣本, 結果會太樂觀)
+    """
+    reps = -(-n_rows // len(df))
+    copies = []
+    for k in range(reps):
+        copy = df.copy()
+        copy['經度'] = copy['經度'] + k * 1e-5
+        copies.append(copy)
+    return pd.concat(copies, ignore_index=True).iloc[:n_rows]
+
+def _time(func, df, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        out = func(df.copy())
+        best = min(best, time.perf_counter() - t0)
+    return best, out
+
+def run_benchmark(n_rows=300_000, legacy_rows=20_000, repeat=3, path=SAMPLE_CSV):
+    sample = normalize_chunk(pd.read_csv(path, encoding='utf-8-sig', low_memory=False))
+    print(f"樣本: {len(sample):,} 列, 重複堆疊到 {n_rows:,} 列 (逐列版本只跑 {legacy_rows:,} 列)")
+
+    df_small = _replicate(sample, legacy_rows)
+    legacy_s, expected = _time(transform_data_legacy, df_small, 1)
+    vector_small_s, actual = _time(transform_data, df_small, repeat)
+    pd.testing.assert_frame_equal(actual, expected)
+    print(f"--- [系統] {legacy_rows:,} 列輸出一致 ---")
+
+    df_big = _replicate(sample, n_rows)
+    vector_s, _ = _time(transform_data, df_big, repeat)
+
+    print(f"{'版本':10s} {'列數':>10s} {'秒數':>8s} {'rows/s':>12s}")
+    print(f"{'逐列':10s} {legacy_rows:>10,} {legacy_s:8.2f} {legacy_rows / legacy_s:>12,.0f}")
+    print(f"{'向量化':10s} {legacy_rows:>10,} {vector_small_s:8.2f} {legacy_rows / vector_small_s:>12,.0f}")
+    print(f"{'向量化':10s} {n_rows:>10,} {vector_s:8.2f} {n_rows / vector_s:>12,.0f}")
+    print(f"加速: {(legacy_s / legacy_rows) / (vector_s / n_rows):.1f} 倍 (以每列耗時計算)")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="transform_data 逐列 vs 向量化 Benchmark")
+    parser.add_argument("--rows", type=int, default=300_000, help="向量化版本的測試列數")
+    parser.add_argument("--legacy-rows", type=int, default=20_000, help="逐列版本的測試列數 (很慢, 預設較少)")
+    parser.add_argument("--repeat", type=int, default=3, help="重複次數 (取最快)")
+    args = parser.parse_args()
+    run_benchmark(args.rows, args.legacy_rows, args.repeat)
@@ -0,0 +1,60 @@
+import gzip
+import time
+import argparse
+import numpy as np
+import folium
+from folium.plugins import HeatMap
+import map_layers
+import heatmap_pyramid
+from heatmap_pyramid import KEY_STRIDE, level_for_zoom
+from bench_spatial_radius import synthetic_latlon
+
+# ==========================================
+# Benchmark: 熱力圖頁面大小 folium.HeatMap (完整精度 JSON) vs CompactHeatMap (量化 + 差分 + base64)
+# 資料: 已建立熱力圖金字塔時用真實格子, 否則用 150 萬筆合成事故聚合成相同層級的格子
+# 同時量測 gzip 後大小 (Streamlit 傳輸時會壓縮) 與解碼誤差
+# 執行: python bench_heatmap_payload.py --zoom 8 10 12
+# ==========================================
+
+def synthetic_cells(level, n=1_500_000, seed=11):
+    """合成事故 -> 與 heatmap_pyramid.get_heatmap_cells 相同格式的 [[緯度, 經度, 事故數], ...]"""
+    lat, lon = synthetic_latlon(n, np.random.default_rng(seed))
+    gy, gx = np.floor(lat / level).astype(np.int64), np.floor(lon / level).astype(np.int64)
+    keys, counts = np.unique(gy * KEY_STRIDE + gx, return_counts=True)
+    return np.column_stack([
+        np.round((np.floor_divide(keys, KEY_STRIDE) + 0.5) * level, 6),
+        np.round((np.mod(keys, KEY_STRIDE) + 0.5) * level, 6),
+        counts]).tolist()
+
+def _measure(layer):
+    m = folium.Map(location=[23.7, 120.95], zoom_start=8)
+    t0 = time.perf_counter()
+    layer().add_to(m)
+    html = m.get_root().render().encode("utf-8")
+    return len(html), len(gzip.compress(html)), time.perf_counter() - t0
+
+def run_benchmark(zooms=(8, 10, 12)):
+    real = heatmap_pyramid.is_available()
+    print(f"資料來源: {'熱力圖金字塔' if real else '合成資料 (150 萬筆)'}")
+    print(f"{'zoom':>4s} {'格子數':>8s} {'版本':14s} {'HTML KB':>9s} {'gzip KB':>9s} {'耗時 s':>7s}")
+    for zoom in zooms:
+        cells = heatmap_pyramid.get_heatmap_cells(zoom) if real else synthetic_cells(level_for_zoom(zoom))
+        options = dict(radius=15, blur=10, max_zoom=10)
+        results = {
+            "HeatMap": _measure(lambda: HeatMap(cells, **options)),
+            "CompactHeatMap": _measure(lambda: map_layers.CompactHeatMap(cells, weight_scale=1, **options)),
+        }
+        for label, (size, gz, cost) in results.items():
+            print(f"{zoom:>4d} {len(cells):>8,} {label:14s} {size / 1024:9.1f} {gz / 1024:9.1f} {cost:7.2f}")
+        decoded = map_layers.decode_heat(map_layers.encode_heat(cells, weight_scale=1))
+        expected = np.asarray(cells, dtype=np.float64)
+        expected = expected[np.lexsort((expected[:, 1], expected[:, 0]))]
+        error = np.abs(decoded - expected).max() if len(cells) else 0.0
+        base, compact = results["HeatMap"][0], results["CompactHeatMap"][0]
+        print(f"     -> HTML 縮小 {1 - compact / base:.0%}, 解碼最大誤差 {error:.2g}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="熱力圖頁面大小 Benchmark")
+    parser.add_argument("--zoom", type=int, nargs="+", default=[8, 10, 12], help="測試的縮放層級")
+    args = parser.parse_args()
+    run_benchmark(args.zoom)
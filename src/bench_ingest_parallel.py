@@ -0,0 +1,72 @@
+import os
+import time
+import shutil
+import argparse
+import tempfile
+import pandas as pd
+from ingest_accidents import IngestSink, run_parallel, run_sequential, list_csv_sources, DEFAULT_MAX_MEMORY_MB
+from bench_accident_transform import SAMPLE_CSV, _replicate
+
+# ==========================================
+# Benchmark: 平行匯入 1 -> N 個 worker 的擴展性 (讀取 + 清洗, 不寫入資料庫)
+# 以樣本 CSV 產生多個本機檔案 (模擬一個年度 ZIP 裡的多個 A1/A2 CSV)
+# 執行: python bench_ingest_parallel.py --files 8 --rows-per-file 50000 --max-workers 4
+# ==========================================
+
+class NullWriter:
+    """只計算列數, 不連資料庫 (量測讀取 / 清洗的擴展性)"""
+    def write(self, table, df):
+        return len(df)
+
+def make_sample_files(out_dir, n_files, rows_per_file):
+    """每個檔案的經度各自平移, 內容不同 (事故 ID 不重複)"""
+    raw = pd.read_csv(SAMPLE_CSV, encoding='utf-8-sig', low_memory=False)
+    paths = []
+    for k in range(n_files):
+        df = _replicate(raw, rows_per_file)
+        df['經度'] = pd.to_numeric(df['經度'], errors='coerce') + k * 0.01
+        path = os.path.join(out_dir, f"sample_A{k + 1}.csv")
+        df.to_csv(path, index=False, encoding='utf-8-sig')
+        paths.append(path)
+    return paths
+
+def run_benchmark(n_files=8, rows_per_file=50_000, max_workers=None, chunksize=20_000,
+                  max_memory_mb=DEFAULT_MAX_MEMORY_MB):
+    max_workers = max_workers or os.cpu_count() or 1
+    out_dir = tempfile.mkdtemp(prefix="ingest_bench_")
+    try:
+        print(f"--- 產生 {n_files} 個樣本檔, 每個 {rows_per_file:,} 列 ---")
+        sources = [s for path in make_sample_files(out_dir, n_files, rows_per_file)
+                   for s in list_csv_sources(path)]
+        total_rows = n_files * rows_per_file
+
+        results = []
+        worker_counts = sorted({1, *[w for w in (2, 4, 8, 16) if w < max_workers], max_workers})
+        for workers in worker_counts:
+            sink = IngestSink(NullWriter(), chunksize)
+            t0 = time.perf_counter()
+            if workers == 1:
+                run_sequential(sources, sink, chunksize)
+            else:
+                run_parallel(sources, sink, workers, chunksize, max_memory_mb)
+            elapsed = time.perf_counter() - t0
+            assert sink.stats["read"]["rows"] == total_rows and not sink.failed
+            results.append((workers, elapsed))
+
+        base = results[0][1]
+        print(f"\n{'workers':>8s} {'秒數':>8s} {'rows/s':>12s} {'加速':>6s} {'效率':>6s}")
+        for workers, elapsed in results:
+            print(f"{workers:>8d} {elapsed:8.2f} {total_rows / elapsed:>12,.0f} "
+                  f"{base / elapsed:>5.1f}x {base / elapsed / workers:>6.0%}")
+    finally:
+        shutil.rmtree(out_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="平行匯入 擴展性 Benchmark")
+    parser.add_argument("--files", type=int, default=8, help="樣本檔數量")
+    parser.add_argument("--rows-per-file", type=int, default=50_000, help="每個樣本檔的列數")
+    parser.add_argument("--max-workers", type=int, default=None, help="最多 worker 數 (預設為 CPU 核心數)")
+    parser.add_argument("--chunksize", type=int, default=20_000, help="每批讀取的 CSV 列數")
+    parser.add_argument("--max-memory-mb", type=int, default=DEFAULT_MAX_MEMORY_MB, help="記憶體上限 (MB)")
+    args = parser.parse_args()
+    run_benchmark(args.files, args.rows_per_file, args.max_workers, args.chunksize, args.max_memory_mb)
@@ -0,0 +1,79 @@
+import time
+import argparse
+import numpy as np
+import pandas as pd
+import folium
+import map_layers
+from bench_spatial_radius import synthetic_latlon
+
+# ==========================================
+# Benchmark: 點位圖層 逐列 folium 物件 vs 向量化 GeoJSON / FastMarkerCluster
+# 量測 建立圖層 + 輸出 HTML 的時間, 以及 HTML 大小 (不需要資料庫)
+# 執行: python bench_map_layers.py --points 2000 5000 20000
+# ==========================================
+
+POPUP = """<div style="font-family: Arial; width: 150px;">
+    <b>時間:</b> {accident_datetime}<br>
+    <b>狀況:</b> {weather_condition}
+</div>"""
+
+def _sample(n, seed=3):
+    rng = np.random.default_rng(seed)
+    lat, lon = synthetic_latlon(n, rng)
+    start = np.datetime64("2022-01-01T00:00:00")
+    return pd.DataFrame({
+        "lat": lat, "lon": lon,
+        "accident_datetime": start + rng.integers(0, 365 * 86400, n).astype("timedelta64[s]"),
+        "weather_condition": rng.choice(["晴", "雨", "陰"], n),
+    })
+
+def legacy_circles(m, df):
+    """原本的作法: 每一列一個 CircleMarker + Popup"""
+    fg = folium.FeatureGroup(name="legacy")
+    for _, row in df.iterrows():
+        popup_html = POPUP.format(accident_datetime=row['accident_datetime'], weather_condition=row['weather_condition'])
+        folium.CircleMarker(location=[row['lat'], row['lon']], radius=3, color='blue', fill=True,
+                            popup=folium.Popup(popup_html, max_width=200)).add_to(fg)
+    fg.add_to(m)
+
+def vector_circles(m, df):
+    map_layers.point_layer(df, "vector", marker=folium.CircleMarker(radius=3, color='blue', fill=True),
+                           popup=POPUP, max_width=200).add_to(m)
+
+def legacy_cluster(m, df):
+    from folium.plugins import MarkerCluster
+    fg = folium.FeatureGroup(name="legacy")
+    cluster = MarkerCluster().add_to(fg)
+    for _, row in df.iterrows():
+        popup_html = POPUP.format(accident_datetime=row['accident_datetime'], weather_condition=row['weather_condition'])
+        folium.Marker(location=[row['lat'], row['lon']], popup=folium.Popup(popup_html, max_width=200),
+                      icon=folium.Icon(color='red', icon='exclamation-sign')).add_to(cluster)
+    fg.add_to(m)
+
+def vector_cluster(m, df):
+    map_layers.cluster_layer(df, "vector", popup=POPUP, icon={"icon": "exclamation-sign", "markerColor": "red"}).add_to(m)
+
+def _measure(builder, df):
+    t0 = time.perf_counter()
+    m = folium.Map(location=[23.7, 120.95], zoom_start=8)
+    builder(m, df)
+    t1 = time.perf_counter()
+    html = m.get_root().render()
+    t2 = time.perf_counter()
+    return t1 - t0, t2 - t1, len(html.encode("utf-8"))
+
+def run_benchmark(sizes=(2000, 5000, 20000)):
+    cases = [("CircleMarker", legacy_circles, vector_circles), ("MarkerCluster", legacy_cluster, vector_cluster)]
+    print(f"{'圖層':14s} {'點數':>7s} {'版本':6s} {'建立 s':>8s} {'輸出 s':>8s} {'HTML MB':>8s}")
+    for n in sizes:
+        df = _sample(n)
+        for label, legacy, vector in cases:
+            for version, builder in (("逐列", legacy), ("向量化", vector)):
+                build_s, render_s, size = _measure(builder, df)
+                print(f"{label:14s} {n:>7,} {version:6s} {build_s:8.2f} {render_s:8.2f} {size / 2**20:8.2f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="點位圖層 逐列 vs 向量化 Benchmark")
+    parser.add_argument("--points", type=int, nargs="+", default=[2000, 5000, 20000], help="測試的點數")
+    args = parser.parse_args()
+    run_benchmark(args.points)
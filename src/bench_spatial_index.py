@@ -0,0 +1,89 @@
+import argparse
+import os
+import time
+import numpy as np
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import make_url
+from accident_spatial_index import GridIndex
+from bench_spatial_radius import synthetic_latlon, random_centers
+from import_traffic import build_radius_filter
+
+# ==========================================
+# Benchmark: 格網空間索引 (GridIndex) vs NumPy 全表掃描 vs MySQL BETWEEN 方框
+# 本機部分不需要資料庫; 加上 --url 時會再量一次 bench_spatial_radius.py 建立的替身資料表
+# 執行: python bench_spatial_index.py [--url mysql+pymysql://root:pw@127.0.0.1:3306/bench_db]
+# ==========================================
+
+def _percentiles(latencies):
+    arr = np.array(latencies) * 1000
+    return np.percentile(arr, 50), np.percentile(arr, 99)
+
+def _time_calls(func, centers, repeat):
+    """對每個中心點呼叫 func(lat, lon) repeat 次, 回傳 (延遲秒數 list, 每個中心點的筆數)"""
+    latencies, counts = [], []
+    for lat, lon in centers:
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            n = func(lat, lon)
+            latencies.append(time.perf_counter() - t0)
+        counts.append(n)
+    return latencies, np.array(counts)
+
+def run_benchmark(n_rows=1_500_000, n_centers=200, radius_km=1.0, repeat=5, url=None):
+    # 與 bench_spatial_radius.py 的替身資料表使用相同的亂數種子, 座標一致 (DECIMAL(10, 6))
+    lat, lon = synthetic_latlon(n_rows, np.random.default_rng(42))
+    lat, lon = np.round(lat, 6), np.round(lon, 6)
+    centers = random_centers(n_centers)
+
+    t0 = time.perf_counter()
+    index = GridIndex(lat, lon)
+    print(f"--- 建立索引: {n_rows:,} 筆, {len(index.cell_keys):,} 個格子, {time.perf_counter() - t0:.2f}s ---")
+
+    def brute_box(c_lat, c_lon):
+        offset = radius_km / 111.0
+        return int(np.count_nonzero((lat >= c_lat - offset) & (lat <= c_lat + offset) &
+                                    (lon >= c_lon - offset) & (lon <= c_lon + offset)))
+
+    cases = [
+        ("NumPy 全表方框", brute_box, 1),
+        ("索引 方框", lambda a, b: len(index.query_box(a, b, radius_km)), repeat),
+        ("索引 圓形", lambda a, b: len(index.query_radius(a, b, radius_km)), repeat),
+        ("索引 kNN (k=10)", lambda a, b: len(index.query_knn(a, b, 10)[0]), repeat),
+    ]
+
+    if url:
+        table = f"{make_url(url).database}.accident_main_bench"
+        conn = create_engine(url).connect()
+
+        def mysql_box(c_lat, c_lon):
+            where, params = build_radius_filter(c_lat, c_lon, radius_km, spatial=False)
+            return conn.execute(text(f"SELECT COUNT(*) FROM {table} WHERE {where}"), params).scalar()
+        cases.append(("MySQL 方框", mysql_box, repeat))
+
+    print(f"\n半徑 {radius_km} km, {n_centers} 個中心點")
+    print(f"{'模式':16s} {'p50 (ms)':>10s} {'p99 (ms)':>10s} {'平均筆數':>10s}")
+    results = {}
+    for label, func, times in cases:
+        latencies, counts = _time_calls(func, centers, times)
+        results[label] = counts
+        p50, p99 = _percentiles(latencies)
+        print(f"{label:16s} {p50:10.3f} {p99:10.3f} {counts.mean():10.0f}")
+
+    # 正確性: 索引方框必須與全表掃描 (以及 MySQL) 的筆數完全相同
+    for label in ("索引 方框", "MySQL 方框"):
+        if label in results and not np.array_equal(results[label], results["NumPy 全表方框"]):
+            print(f"[警告] {label} 的筆數與全表掃描不一致")
+
+    t0 = time.perf_counter()
+    index.count_batch(centers, radius_km)
+    elapsed = time.perf_counter() - t0
+    print(f"\n批次查詢 {n_centers} 個中心點: {elapsed * 1000:.1f} ms ({elapsed / n_centers * 1e6:.0f} µs/點)")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="格網空間索引 半徑查詢 Benchmark")
+    parser.add_argument("--url", default=os.getenv("BENCH_MYSQL_URL"), help="本機 MySQL 替身的連線字串 (選用)")
+    parser.add_argument("--rows", type=int, default=1_500_000, help="假資料筆數 (需與替身資料表相同)")
+    parser.add_argument("--centers", type=int, default=200, help="查詢中心點數量")
+    parser.add_argument("--radius", type=float, default=1.0, help="查詢半徑 (km)")
+    args = parser.parse_args()
+    run_benchmark(args.rows, args.centers, args.radius, url=args.url)
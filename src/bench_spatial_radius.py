@@ -0,0 +1,148 @@
+import argparse
+import os
+import time
+import numpy as np
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import make_url
+from import_traffic import build_radius_filter
+from migrate_spatial_index import add_spatial_column
+
+# ==========================================
+# Benchmark: BETWEEN 方框 vs SPATIAL 索引 (MBRContains + ST_Distance_Sphere)
+# 需要一台本機 MySQL 8 (例如 docker run -p 3306:3306 mysql:8) 當作替身, 不會碰到正式資料庫
+# 執行: python bench_spatial_radius.py --url mysql+pymysql://root:pw@127.0.0.1:3306/bench_db
+# ==========================================
+
+# 模擬事故集中的城市中心 (緯度, 經度, 權重)
+CITY_CENTERS = [
+    (25.04, 121.54, 0.30),  # 台北
+    (24.15, 120.67, 0.20),  # 台中
+    (22.63, 120.30, 0.20),  # 高雄
+    (23.00, 120.21, 0.12),  # 台南
+    (24.99, 121.30, 0.10),  # 桃園
+    (24.80, 120.97, 0.08),  # 新竹
+]
+
+def synthetic_latlon(n, rng):
+    """產生 n 個集中在各城市附近的座標 (常態分佈 + 少量全島散佈)"""
+    weights = np.array([c[2] for c in CITY_CENTERS])
+    city = rng.choice(len(CITY_CENTERS), size=n, p=weights / weights.sum())
+    lat = np.array([c[0] for c in CITY_CENTERS])[city] + rng.normal(0, 0.08, n)
+    lon = np.array([c[1] for c in CITY_CENTERS])[city] + rng.normal(0, 0.08, n)
+    background = rng.random(n) < 0.1
+    lat[background] = rng.uniform(21.9, 25.3, background.sum())
+    lon[background] = rng.uniform(120.0, 122.0, background.sum())
+    return lat, lon
+
+def random_centers(n_centers, seed=7):
+    """在城市附近隨機挑中心點 (模擬夜市位置)"""
+    rng = np.random.default_rng(seed)
+    picks = rng.choice(len(CITY_CENTERS), size=n_centers)
+    return [(CITY_CENTERS[i][0] + rng.normal(0, 0.05), CITY_CENTERS[i][1] + rng.normal(0, 0.05)) for i in picks]
+
+def _synthetic_rows(n, seed=42):
+    """產生 n 筆集中在各城市附近的假事故"""
+    rng = np.random.default_rng(seed)
+    lat, lon = synthetic_latlon(n, rng)
+
+    year = rng.integers(2019, 2025, n)
+    seconds = rng.integers(0, 365 * 24 * 3600, n)
+    hour = (seconds // 3600) % 24
+    weather = rng.choice(["晴", "陰", "雨"], size=n, p=[0.6, 0.25, 0.15])
+    death = (rng.random(n) < 0.01).astype(int)
+    injury = rng.integers(0, 3, n)
+    year_start = np.array([f"{y}-01-01" for y in range(2019, 2025)], dtype="datetime64[s]")
+    dt = year_start[year - 2019] + seconds.astype("timedelta64[s]")
+    dt_str = np.char.replace(np.datetime_as_string(dt, unit="s"), "T", " ")
+    yield from zip(np.round(lat, 6).tolist(), np.round(lon, 6).tolist(), dt_str.tolist(),
+                   year.tolist(), hour.tolist(), weather.tolist(), death.tolist(), injury.tolist())
+
+def load_synthetic_table(engine, table, n_rows, batch_size=50000):
+    """建立替身資料表 (欄位與 accident_main 查詢用到的相同) 並灌入假資料"""
+    with engine.begin() as conn:
+        conn.execute(text(f"DROP TABLE IF EXISTS {table}"))
+        conn.execute(text(f"""
+        CREATE TABLE {table} (
+            accident_id BIGINT AUTO_INCREMENT PRIMARY KEY,
+            latitude DECIMAL(10, 6),
+            longitude DECIMAL(10, 6),
+            accident_datetime DATETIME,
+            accident_year INT,
+            accident_hour INT,
+            weather_condition VARCHAR(20),
+            death_count INT,
+            injury_count INT,
+            INDEX idx_lat_lon (latitude, longitude)
+        )"""))
+
+    insert_sql = (f"INSERT INTO {table} (latitude, longitude, accident_datetime, accident_year, "
+                  f"accident_hour, weather_condition, death_count, injury_count) "
+                  f"VALUES (%s, %s, %s, %s, %s, %s, %s, %s)")
+    started, batch = time.perf_counter(), []
+    raw = engine.raw_connection()
+    try:
+        cur = raw.cursor()
+        for i, row in enumerate(_synthetic_rows(n_rows), 1):
+            batch.append(row)
+            if len(batch) == batch_size or i == n_rows:
+                cur.executemany(insert_sql, batch)   # pymysql 會組成多列 INSERT
+                raw.commit()
+                batch.clear()
+                print(f"    已寫入 {i:,}/{n_rows:,} 筆 ({i / (time.perf_counter() - started):,.0f} rows/s)")
+    finally:
+        raw.close()
+
+def _time_query(engine, table, centers, radius_km, spatial, repeat):
+    """對每個中心點跑 COUNT + 明細查詢, 回傳 (延遲秒數陣列, 每個中心點的筆數)"""
+    latencies, counts = [], []
+    with engine.connect() as conn:
+        for lat, lon in centers:
+            where, params = build_radius_filter(lat, lon, radius_km, spatial)
+            count_sql = text(f"SELECT COUNT(*) FROM {table} WHERE {where}")
+            detail_sql = text(f"""
+            SELECT latitude, longitude, weather_condition, accident_hour, accident_year,
+                   death_count, injury_count
+            FROM {table} WHERE {where}
+            ORDER BY accident_datetime DESC LIMIT 800""")
+            for _ in range(repeat):
+                t0 = time.perf_counter()
+                n = conn.execute(count_sql, params).scalar()
+                conn.execute(detail_sql, params).fetchall()
+                latencies.append(time.perf_counter() - t0)
+            counts.append(n)
+    return np.array(latencies), np.array(counts)
+
+def run_benchmark(engine, table, n_centers=50, radius_km=1.0, repeat=3, seed=7):
+    centers = random_centers(n_centers, seed)
+
+    print(f"\n半徑 {radius_km} km, {n_centers} 個中心點 x {repeat} 次")
+    print(f"{'模式':14s} {'p50 (ms)':>10s} {'p99 (ms)':>10s} {'平均筆數':>10s}")
+    results = {}
+    for label, spatial in [("BETWEEN 方框", False), ("SPATIAL 圓形", True)]:
+        lat_s, counts = _time_query(engine, table, centers, radius_km, spatial, repeat)
+        results[label] = counts
+        print(f"{label:14s} {np.percentile(lat_s, 50) * 1000:10.1f} {np.percentile(lat_s, 99) * 1000:10.1f} {counts.mean():10.0f}")
+
+    box, circle = results["BETWEEN 方框"], results["SPATIAL 圓形"]
+    ratio = box[circle > 0] / circle[circle > 0]
+    print(f"方框筆數 / 圓形筆數 平均 {ratio.mean():.2f} 倍 (方框多了四個角落, 但經度方向只有 cos(緯度) 倍寬, 理論值約 4·cos(緯度)/π ≈ 1.16)")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="BETWEEN 方框 vs SPATIAL 索引 半徑查詢 Benchmark")
+    parser.add_argument("--url", default=os.getenv("BENCH_MYSQL_URL"), help="本機 MySQL 替身的連線字串")
+    parser.add_argument("--rows", type=int, default=1_500_000, help="假資料筆數")
+    parser.add_argument("--centers", type=int, default=50, help="查詢中心點數量")
+    parser.add_argument("--radius", type=float, default=1.0, help="查詢半徑 (km)")
+    parser.add_argument("--skip-load", action="store_true", help="沿用已建立的替身資料表")
+    args = parser.parse_args()
+
+    if not args.url:
+        parser.error("請用 --url 或 BENCH_MYSQL_URL 指定本機 MySQL 替身")
+    table = f"{make_url(args.url).database}.accident_main_bench"
+    bench_engine = create_engine(args.url)
+
+    if not args.skip_load:
+        print(f"--- 建立替身資料表 {table} ({args.rows:,} 筆) ---")
+        load_synthetic_table(bench_engine, table, args.rows)
+        add_spatial_column(bench_engine, table)
+    run_benchmark(bench_engine, table, args.centers, args.radius)
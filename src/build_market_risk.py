@@ -0,0 +1,151 @@
+import argparse
+import time
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import text
+from db_utils import get_db_engine
+import import_night_market as nm
+import import_traffic as tr
+import market_risk as mr
+import data_version
+
+# ==========================================
+# 夜市風險表 批次計算 (Batch Job)
+# 對每個夜市預先算好 0.3 / 0.5 / 1 / 2 km 內的事故數、死亡數、受傷數 (按年度分開存)
+# - 全部重建: python build_market_risk.py --full
+# - 新資料匯入後只重算該年度: python build_market_risk.py --years 2024
+# - 只補新增的夜市 (預設): python build_market_risk.py
+# - ingest_accidents.py 匯入新資料後會自動以 --years 的方式重算匯入的年度
+# ==========================================
+
+def _market_sql(center_lat, center_lon, radii_km, spatial, years=None):
+    """
+    單一夜市的查詢: 只掃最大半徑一次, 依年度分組, 用條件加總算出每個半徑的數字
+    半徑判斷方式與 get_zone_stats 相同 (方框 或 空間索引圓形), 查表與即時查詢的數字才會一致
+    """
+    where, params = tr.build_radius_filter(center_lat, center_lon, max(radii_km), spatial)
+    columns = []
+    for i, r in enumerate(radii_km):
+        if spatial:
+            cond = (f"ST_Distance_Sphere({tr.SPATIAL_COLUMN}, "
+                    f"ST_GeomFromText(:center, 4326, 'axis-order=long-lat')) <= :r_m_{i}")
+            params[f"r_m_{i}"] = r * 1000
+        else:
+            offset = r / 111.0
+            cond = (f"latitude BETWEEN :min_lat_{i} AND :max_lat_{i} "
+                    f"AND longitude BETWEEN :min_lon_{i} AND :max_lon_{i}")
+            params.update({
+                f"min_lat_{i}": center_lat - offset, f"max_lat_{i}": center_lat + offset,
+                f"min_lon_{i}": center_lon - offset, f"max_lon_{i}": center_lon + offset})
+        columns.append(f"SUM({cond}) AS n_{i}, "
+                       f"SUM(IF({cond}, death_count, 0)) AS d_{i}, "
+                       f"SUM(IF({cond}, injury_count, 0)) AS i_{i}")
+
+    year_filter = ""
+    if years:
+        year_filter = f"AND accident_year IN ({', '.join(str(int(y)) for y in years)})"
+
+    sql = text(f"""
+    SELECT accident_year, {', '.join(columns)}
+    FROM test_db.accident_main
+    WHERE {where} {year_filter}
+    GROUP BY accident_year
+    """)
+    return sql, params
+
+def compute_market(engine, center_lat, center_lon, radii_km, spatial, years=None):
+    """回傳 {年度: {半徑: [事故數, 死亡數, 受傷數]}}"""
+    sql, params = _market_sql(center_lat, center_lon, radii_km, spatial, years)
+    with engine.connect() as conn:
+        rows = conn.execute(sql, params).fetchall()
+
+    by_year = {}
+    for row in rows:
+        per_radius = {}
+        for i, r in enumerate(radii_km):
+            per_radius[mr.radius_key(r)] = [int(row[1 + 3 * i] or 0), int(row[2 + 3 * i] or 0), int(row[3 + 3 * i] or 0)]
+        by_year[str(int(row[0]))] = per_radius
+    return by_year
+
+def refresh_market_risk(years=None, full=False, workers=4, engine=None):
+    """
+    更新夜市風險表
+    full=True : 全部夜市、全部年度重算
+    years     : 只重算指定年度 (新資料匯入後使用), 其他年度沿用舊結果
+    預設      : 只計算表中還沒有的夜市 (新增或座標有變動)
+    """
+    engine = engine or get_db_engine()
+    if not engine:
+        print("Connection failed. Please check .env and db_utils.py")
+        return None
+    df_market = nm.get_all_nightmarkets()
+    if df_market.empty:
+        print("[錯誤] 讀不到夜市資料, 略過更新")
+        return None
+
+    spatial = tr.is_spatial_enabled(engine)
+    mode = "spatial" if spatial else "box"
+    radii_km = list(mr.RADII_KM)
+
+    data = None if full else mr.load_market_risk()
+    if (not data or data.get("mode") != mode or data.get("radii_km") != radii_km
+            or data.get("radius_key") != mr.RADIUS_KEY_FORMAT):
+        # 沒有舊表, 或計算方式 / 半徑設定 / key 格式不同: 只能全部重算
+        data = {"mode": mode, "radii_km": radii_km, "radius_key": mr.RADIUS_KEY_FORMAT, "markets": {}}
+        full = True
+
+    # 決定每個夜市要算哪些年度 (None = 全部年度)
+    jobs, current = [], {}
+    for _, row in df_market.iterrows():
+        key = mr.market_key(row['lat'], row['lon'])
+        current[key] = row
+        if full or key not in data["markets"]:
+            jobs.append((key, None))
+        elif years:
+            jobs.append((key, years))
+
+    # 已經不在夜市清單中的舊資料移除
+    for key in set(data["markets"]) - set(current):
+        del data["markets"][key]
+
+    print(f"--- [系統] 夜市風險表更新: {len(jobs)}/{len(current)} 個夜市 "
+          f"({'全部年度' if full or not years else f'年度 {list(years)}'}, 模式 {mode}) ---")
+    started = time.perf_counter()
+
+    def run(job):
+        key, job_years = job
+        row = current[key]
+        return key, job_years, compute_market(engine, float(row['lat']), float(row['lon']), radii_km, spatial, job_years)
+
+    done = 0
+    # 查詢大多在等網路 I/O, 用少量執行緒並行 (連線由連線池控管)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for key, job_years, by_year in pool.map(run, jobs):
+            row = current[key]
+            entry = data["markets"].setdefault(key, {"by_year": {}})
+            entry.update({"name": row['MarketName'], "lat": float(row['lat']), "lon": float(row['lon'])})
+            if job_years is None:
+                entry["by_year"] = by_year
+            else:
+                # 只替換重算的年度 (該年度沒有事故就移除)
+                for y in job_years:
+                    entry["by_year"].pop(str(int(y)), None)
+                entry["by_year"].update(by_year)
+            done += 1
+            if done % 50 == 0 or done == len(jobs):
+                print(f"    進度: {done}/{len(jobs)} ({time.perf_counter() - started:.1f}s)")
+
+    data["built_at"] = datetime.now().isoformat(timespec="seconds")
+    # 記下計算時的事故資料版本: 之後再匯入新資料 (版本改變) 時, 查表端會改用即時查詢直到重算
+    data["source_version"] = data_version.get_data_version("accidents", engine)
+    mr.save_market_risk(data)
+    print(f"--- [系統] 夜市風險表已寫入 {mr.MARKET_RISK_FILE} ({time.perf_counter() - started:.1f}s) ---")
+    return data
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="夜市風險表 批次計算")
+    parser.add_argument("--full", action="store_true", help="全部夜市、全部年度重算")
+    parser.add_argument("--years", type=int, nargs="+", help="只重算指定年度 (例如新匯入的 2024)")
+    parser.add_argument("--workers", type=int, default=4, help="並行查詢數")
+    args = parser.parse_args()
+    refresh_market_risk(years=args.years, full=args.full, workers=args.workers)
@@ -0,0 +1,432 @@
+import os
+import sys
+import time
+import pickle
+import sqlite3
+import hashlib
+import inspect
+import functools
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+
+# ==========================================
+# 資料存取快取 (Data Cache, 不依賴 Streamlit)
+# 原本只有 app.py 的 @st.cache_data: key 是原始的浮點座標, 除了 1 小時 TTL 之外沒有大小上限
+# 這裡的快取放在資料模組 (import_traffic / import_weather_station / import_night_market) 裡:
+# - key 正規化: 經緯度 / 半徑先四捨五入 (COORD_DIGITS / RADIUS_DIGITS 位小數), 查詢也用正規化後的值
+# - 依「位元組」做 LRU 淘汰: 整個 Process 共用 MAX_BYTES, 超過時先丟最久沒用到的
+# - 請求合併 (single-flight): 50 個 session 同時打開士林夜市, 只有第一個送出查詢, 其他等同一份結果
+# - 命中 / 未命中 / 合併 / 淘汰 計數, 可用 stats() 查看
+# - 磁碟層 (persist=True 的函式): 結果另外寫一份到 DATA_CACHE_DIR 下的 SQLite (WAL 模式)
+#   重新啟動 / 同一台主機上的其他 replica 直接讀取, 不用再跑一次全台 GROUP BY
+# - 資料版本 (version=...): 來源的版本 token 放進 key, 資料沒變就一直有效 (ttl=0), 匯入新資料後自動換 key
+# ==========================================
+
+MAX_BYTES = int(float(os.getenv("DATA_CACHE_MAX_MB", "256")) * 2**20)
+TTL = float(os.getenv("DATA_CACHE_TTL", "3600"))      # 秒, 0 = 不過期 (沒有指定 version 的函式才會用到)
+COORD_DIGITS = int(os.getenv("DATA_CACHE_COORD_DIGITS", "5"))   # 0.00001° 約 1 m, 與 market_risk.market_key 相同
+RADIUS_DIGITS = 3                                     # 0.001 km = 1 m
+
+DATA_CACHE_DIR = os.getenv(
+    "DATA_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data", "cache"))
+DISK_ENABLED = os.getenv("DATA_CACHE_DISK", "1") == "1"
+DISK_PATH = os.getenv("DATA_CACHE_DISK_PATH", os.path.join(DATA_CACHE_DIR, "data_cache.sqlite"))
+DISK_MAX_BYTES = int(float(os.getenv("DATA_CACHE_DISK_MAX_MB", "1024")) * 2**20)
+
+# ==========================================
+# 1. 大小估算與複製
+# ==========================================
+def estimate_bytes(value, _sample=64):
+    """估算物件佔用的記憶體 (DataFrame / ndarray 精確計算, 大型 list 用前幾個元素抽樣推估)"""
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return int(value.memory_usage(deep=True).sum()) if isinstance(value, pd.DataFrame) \
+            else int(value.memory_usage(deep=True))
+    if isinstance(value, np.ndarray):
+        return int(value.nbytes)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(estimate_bytes(k) + estimate_bytes(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        size = sys.getsizeof(value)
+        if not value:
+            return size
+        head = value[:_sample]
+        return size + int(sum(estimate_bytes(v) for v in head) * len(value) / len(head))
+    return sys.getsizeof(value)
+
+def _copy(value):
+    """命中時回傳副本: 呼叫端常直接改 DataFrame (例如新增欄位), 不能改到快取裡的那一份"""
+    if isinstance(value, (pd.DataFrame, pd.Series, np.ndarray)):
+        return value.copy()
+    if isinstance(value, dict):
+        return {k: _copy(v) for k, v in value.items()}
+    if isinstance(value, tuple):
+        return tuple(_copy(v) for v in value)
+    if isinstance(value, list):
+        return list(value)
+    return value
+
+def _is_empty(value):
+    """查詢失敗時各函式回傳 None / 空 DataFrame, 這類結果不放進快取 (下次重新查詢)"""
+    return value is None or (isinstance(value, pd.DataFrame) and value.empty)
+
+# ==========================================
+# 2. 快取本體
+# ==========================================
+class _Flight:
+    """進行中的查詢: 其他執行緒等待 done, 再取 result / error"""
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class DiskCache:
+    """
+    SQLite 磁碟快取 (多個 Process 共用同一個檔案)
+    - WAL 模式: 寫入時其他 Process 照常讀取, 讀到的一定是完整 commit 過的資料
+    - 每次寫入是一個交易 (INSERT OR REPLACE), 不會留下寫一半的結果
+    - 值用 pickle 存 (DataFrame / list / dict 都可以); 超過 max_bytes 時刪除最舊的項目
+    - 任何 SQLite 錯誤都只印警告並當作未命中, 不影響查詢本身
+    """
+    PRUNE_EVERY = 50        # 每寫入幾次檢查一次總大小
+
+    def __init__(self, path=DISK_PATH, max_bytes=DISK_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._local = threading.local()   # sqlite3 連線不能跨執行緒共用: 每個執行緒一條
+        self._writes = 0
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(cache)")}
+            if columns and "expires_at" not in columns:
+                conn.execute("DROP TABLE cache")     # 舊版格式 (沒有 expires_at): 內容只是快取, 直接重建
+            conn.execute("""CREATE TABLE IF NOT EXISTS cache (
+                key TEXT PRIMARY KEY, namespace TEXT, value BLOB, size INTEGER, created_at REAL, expires_at REAL)""")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_cache_created ON cache (created_at)")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _digest(key):
+        # key 只包含字串 / 數字 / None / tuple, repr 在不同 Process 之間是固定的
+        return hashlib.sha1(repr(key).encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """回傳 (是否命中, 值)"""
+        try:
+            row = self._conn().execute(
+                "SELECT value, expires_at FROM cache WHERE key = ?", (self._digest(key),)).fetchone()
+        except sqlite3.Error as e:
+            print(f"[警告] 磁碟快取讀取失敗: {e}")
+            return False, None
+        if row is None or (row[1] is not None and time.time() > row[1]):
+            return False, None
+        try:
+            return True, pickle.loads(row[0])
+        except Exception as e:
+            print(f"[警告] 磁碟快取內容無法還原 ({key[0]}): {e}")
+            return False, None
+
+    def put(self, key, value, ttl=0):
+        """ttl: 有效秒數, 0 = 不過期 (以版本為 key 的結果)"""
+        try:
+            blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+            if len(blob) > self.max_bytes:
+                return
+            conn = self._conn()
+            now = time.time()
+            conn.execute("INSERT OR REPLACE INTO cache (key, namespace, value, size, created_at, expires_at) "
+                         "VALUES (?, ?, ?, ?, ?, ?)",
+                         (self._digest(key), str(key[0]), blob, len(blob), now, now + ttl if ttl else None))
+            self._writes += 1
+            if self._writes % self.PRUNE_EVERY == 0:
+                self.prune()
+        except (sqlite3.Error, pickle.PicklingError, TypeError) as e:
+            print(f"[警告] 磁碟快取寫入失敗: {e}")
+
+    def prune(self):
+        """刪除過期項目; 總大小超過上限時再由最舊的開始刪"""
+        conn = self._conn()
+        with conn:
+            conn.execute("DELETE FROM cache WHERE expires_at < ?", (time.time(),))
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM cache").fetchone()[0]
+            if total > self.max_bytes:
+                rows = conn.execute("SELECT key, size FROM cache ORDER BY created_at").fetchall()
+                drop = []
+                for key, size in rows:
+                    if total <= self.max_bytes: break
+                    drop.append((key,))
+                    total -= size
+                conn.executemany("DELETE FROM cache WHERE key = ?", drop)
+
+    def invalidate(self, namespace=None):
+        try:
+            with self._conn() as conn:
+                if namespace is None:
+                    conn.execute("DELETE FROM cache")
+                else:
+                    conn.execute("DELETE FROM cache WHERE namespace = ?", (namespace,))
+        except sqlite3.Error as e:
+            print(f"[警告] 磁碟快取清除失敗: {e}")
+
+class DataCache:
+    """
+    以位元組為上限的 LRU 快取 + 請求合併
+    get_or_load(key, loader): 命中直接回傳; 同一個 key 正在查詢時等待那一次的結果; 否則呼叫 loader
+    persist=True 時記憶體未命中會先查磁碟層 (disk), 查詢結果也會寫入磁碟層
+    """
+    def __init__(self, max_bytes=MAX_BYTES, ttl=TTL, disk=None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.disk = disk
+        self._entries = OrderedDict()     # key -> (value, size, 到期時間 or None)
+        self._flights = {}                # key -> _Flight
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "misses": 0, "coalesced": 0, "evictions": 0, "errors": 0, "disk_hits": 0}
+        self._by_namespace = {}           # namespace -> {"hits", "misses"}
+
+    def _count(self, key, field):
+        self._counters[field] += 1
+        if field in ("hits", "misses") and isinstance(key, tuple) and key:
+            ns = self._by_namespace.setdefault(key[0], {"hits": 0, "misses": 0})
+            ns[field] += 1
+
+    def _lookup(self, key):
+        """在鎖內呼叫: 回傳 (是否命中, 值); 過期的項目直接移除"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return False, None
+        value, size, expires_at = entry
+        if expires_at is not None and time.monotonic() > expires_at:
+            del self._entries[key]
+            self._bytes -= size
+            return False, None
+        self._entries.move_to_end(key)
+        return True, value
+
+    def _store(self, key, value, ttl):
+        size = estimate_bytes(value)
+        if size > self.max_bytes:
+            return                       # 單一結果比整個快取還大: 不存
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._entries[key] = (value, size, time.monotonic() + ttl if ttl else None)
+            self._bytes += size
+            while self._bytes > self.max_bytes and self._entries:
+                _, (_, evicted, _) = self._entries.popitem(last=False)
+                self._bytes -= evicted
+                self._counters["evictions"] += 1
+
+    def get_or_load(self, key, loader, skip=_is_empty, persist=False, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        with self._lock:
+            hit, value = self._lookup(key)
+            if hit:
+                self._count(key, "hits")
+                return _copy(value)
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self._count(key, "misses")
+            else:
+                self._counters["coalesced"] += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return _copy(flight.result)
+
+        try:
+            disk = self.disk if persist else None
+            found, value = disk.get(key) if disk else (False, None)
+            if found:
+                with self._lock:
+                    self._counters["disk_hits"] += 1
+                flight.result = value
+                self._store(key, value, ttl)
+                return _copy(value)
+            flight.result = loader()
+            if not skip(flight.result):
+                self._store(key, flight.result, ttl)
+                if disk:
+                    disk.put(key, flight.result, ttl)
+            return _copy(flight.result)
+        except Exception as e:
+            flight.error = e
+            with self._lock:
+                self._counters["errors"] += 1
+            raise
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.done.set()
+
+    def invalidate(self, namespace=None):
+        """清除整個快取, 或只清除某個 namespace (函式名稱) 的項目 (磁碟層一併清除)"""
+        with self._lock:
+            for key in [k for k in self._entries if namespace is None or (isinstance(k, tuple) and k[0] == namespace)]:
+                self._bytes -= self._entries.pop(key)[1]
+        if self.disk:
+            self.disk.invalidate(namespace)
+
+    def stats(self):
+        with self._lock:
+            total = self._counters["hits"] + self._counters["misses"]
+            return {**self._counters, "entries": len(self._entries), "bytes": self._bytes,
+                    "max_bytes": self.max_bytes, "hit_rate": self._counters["hits"] / total if total else 0.0,
+                    "by_namespace": {k: dict(v) for k, v in self._by_namespace.items()}}
+
+# 整個 Process 共用一份 (所有資料模組、所有 Streamlit session); 磁碟層則是同一台主機的所有 Process 共用
+shared_cache = DataCache(disk=DiskCache() if DISK_ENABLED else None)
+
+def stats():
+    return shared_cache.stats()
+
+# ==========================================
+# 3. 裝飾器
+# ==========================================
+def round_coord(value):
+    return None if value is None else round(float(value), COORD_DIGITS)
+
+def round_radius(value):
+    if isinstance(value, (list, tuple)):
+        return tuple(round(float(v), RADIUS_DIGITS) for v in value)
+    return None if value is None else round(float(value), RADIUS_DIGITS)
+
+def round_bounds(value):
+    return None if value is None else tuple(round(float(v), COORD_DIGITS) for v in value)
+
+def _freeze(value):
+    """list / dict 轉成可以當 key 的 tuple"""
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+def cached(namespace=None, normalize=None, ignore=(), skip=_is_empty, cache=None, persist=False, version=None, ttl=None):
+    """
+    把資料存取函式包上共用快取
+    normalize: {參數名稱: 正規化函式}, 例如 {"center_lat": round_coord}; 函式本身也會拿到正規化後的值
+    ignore: 不列入 key 的參數 (例如共用的 engine)
+    persist: 結果也寫入磁碟層 (重新啟動 / 其他 replica 可以直接使用), 只用在查詢成本高、結果可 pickle 的函式
+    version: 回傳資料版本 token 的函式 (例如 data_version.source_version), token 會放進 key;
+             有 version 時預設不過期 (ttl=0), 否則用 TTL
+    ttl: 有效秒數 (覆寫預設值), 0 = 不過期
+    被包裝的函式多了 .uncached (原始函式) 與 .invalidate()
+    """
+    normalize = normalize or {}
+
+    def decorator(func):
+        name = namespace or f"{func.__module__}.{func.__name__}"
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            for param, fn in normalize.items():
+                if param in bound.arguments:
+                    bound.arguments[param] = fn(bound.arguments[param])
+            key = (name,) + tuple((k, _freeze(v)) for k, v in bound.arguments.items() if k not in ignore)
+            if version is not None:
+                key += (("__version__", _freeze(version())),)
+            store = cache or shared_cache
+            return store.get_or_load(key, lambda: func(*bound.args, **bound.kwargs), skip, persist,
+                                     ttl if ttl is not None else (0 if version is not None else None))
+
+        wrapper.uncached = func
+        wrapper.invalidate = lambda: (cache or shared_cache).invalidate(name)
+        return wrapper
+    return decorator
+
+# ==========================================
+# 4. 自我測試
+# ==========================================
+def _disk_worker(path, i):
+    """模擬另一個 Process (replica): 自己的記憶體快取 + 共用的磁碟層, 回傳實際查詢的次數"""
+    cache = DataCache(ttl=0, disk=DiskCache(path))
+    calls = []
+    def load():
+        calls.append(i)
+        time.sleep(0.05)
+        return pd.DataFrame({"market": [i] * 500, "count": np.arange(500)})
+    df = cache.get_or_load(("heatmap", i), load, persist=True)
+    assert len(df) == 500 and int(df["market"].iloc[0]) == i
+    return len(calls)
+
+if __name__ == "__main__":
+    from concurrent.futures import ThreadPoolExecutor
+
+    calls = []
+    test_cache = DataCache(max_bytes=2 * 2**20, ttl=0)
+
+    @cached(normalize={"lat": round_coord, "lon": round_coord}, cache=test_cache)
+    def slow_query(lat, lon):
+        calls.append((lat, lon))
+        time.sleep(0.3)
+        return pd.DataFrame({"lat": [lat] * 1000, "lon": [lon] * 1000})
+
+    # 1. 50 個 session 同時查士林夜市 (座標末幾位不同): 只送出一次查詢
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=50) as pool:
+        results = list(pool.map(lambda i: slow_query(25.0880 + i * 1e-7, 121.5240), range(50)))
+    assert len(calls) == 1, f"送出 {len(calls)} 次查詢"
+    assert all(len(r) == 1000 for r in results)
+    print(f"[測試] 50 個同時請求 -> {len(calls)} 次查詢 ({time.perf_counter() - started:.2f}s)")
+
+    # 2. 命中時回傳副本: 改呼叫端的 DataFrame 不影響快取
+    results[0]["extra"] = 1
+    assert "extra" not in slow_query(25.088, 121.524).columns
+
+    # 3. 超過位元組上限時淘汰最久沒用到的
+    for i in range(200):
+        test_cache.get_or_load(("fill", i), lambda: np.zeros(20_000))   # 每筆 160 KB
+    s = test_cache.stats()
+    assert s["bytes"] <= test_cache.max_bytes and s["evictions"] > 0
+    print(f"[測試] LRU: {s['entries']} 筆 / {s['bytes'] / 2**20:.2f} MB (上限 {s['max_bytes'] / 2**20:.0f} MB), "
+          f"淘汰 {s['evictions']} 筆")
+    print(f"[測試] 計數: 命中 {s['hits']}, 未命中 {s['misses']}, 合併 {s['coalesced']}")
+
+    # 4. 版本 token: 版本沒變一直命中 (不過期), 版本改變後重新查詢
+    token = {"v": "a"}
+    @cached(version=lambda: token["v"], cache=test_cache)
+    def versioned():
+        calls.append("versioned")
+        return pd.DataFrame({"v": [token["v"]]})
+    before = len(calls)
+    versioned(); versioned()
+    token["v"] = "b"
+    assert versioned()["v"].iloc[0] == "b" and len(calls) - before == 2
+    print("[測試] 版本 token: 版本改變後才重新查詢")
+
+    # 5. 磁碟層: 多個 Process 同時讀寫同一個 SQLite; 「重新啟動」(新的 Process) 直接命中
+    import tempfile
+    import multiprocessing
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "cache.sqlite")
+        started = time.perf_counter()
+        with multiprocessing.get_context("spawn").Pool(4) as pool:
+            loaded = pool.starmap(_disk_worker, [(path, i % 8) for i in range(32)])
+        first = time.perf_counter() - started
+        assert sum(loaded) <= 32
+        with multiprocessing.get_context("spawn").Pool(4) as pool:
+            reloaded = pool.starmap(_disk_worker, [(path, i % 8) for i in range(32)])
+        assert sum(reloaded) == 0, f"重新啟動後仍重新查詢 {sum(reloaded)} 次"
+        print(f"[測試] 磁碟層: 4 個 Process 共 {sum(loaded)} 次查詢 ({first:.2f}s); "
+              f"新的 Process 全部由磁碟命中 ({time.perf_counter() - started - first:.2f}s)")
+    print("--- [系統] 自我測試全部通過 ---")
@@ -0,0 +1,161 @@
+import os
+import time
+import hashlib
+import threading
+from datetime import datetime
+from sqlalchemy import text, MetaData, Table, Column, String, DateTime
+from db_utils import get_db_engine
+
+# ==========================================
+# 資料版本 (Data Version)
+# 每個資料來源 (例如 "accidents") 一個版本字串, 匯入流程有寫入新資料時才會改變
+# 下游的快取 / 預先計算結果可以用版本當 key, 版本沒變就不用重算
+# ==========================================
+
+VERSION_DB = os.getenv("ACCIDENT_DB", "test_db")
+VERSION_TABLE = "data_version"
+
+# 各資料來源對應的資料表 (schema, table); 版本 token 由匯入流程寫的版本列 + 資料表的更新狀態組成
+SOURCE_TABLES = {
+    "accidents": (VERSION_DB, "accident_main"),
+    "nightmarkets": ("test_NM", "nightmarkets"),
+    "stations": ("test_db", "Obs_Stations"),
+}
+CHECK_INTERVAL = float(os.getenv("DATA_VERSION_CHECK_INTERVAL", "60"))   # 秒: 版本最多多久查一次
+FALLBACK_TTL = 3600         # 查不到版本 (資料庫無法連線) 時, 退回每小時換一次 token (等同原本的 ttl=3600)
+
+_tokens = {"checked_at": None, "tokens": {}, "versions": {}}
+_tokens_lock = threading.Lock()
+_has_version_table = None   # data_version 表是否存在 (確定不存在後就不再 UNION)
+MYSQL_NO_SUCH_TABLE = 1146  # MySQL 錯誤碼: Table doesn't exist
+
+def version_table(metadata):
+    return Table(
+        VERSION_TABLE, metadata,
+        Column("source", String(50), primary_key=True),   # 資料來源名稱
+        Column("version", String(64), nullable=False),    # 版本字串 (內容雜湊)
+        Column("updated_at", DateTime, nullable=False))
+
+def ensure_table(engine, database=VERSION_DB):
+    metadata = MetaData(schema=database)
+    version_table(metadata)
+    metadata.create_all(engine, checkfirst=True)
+
+def content_version(parts):
+    """由多個 (名稱, 內容雜湊) 組出版本字串: 內容相同版本就相同, 與匯入順序無關"""
+    digest = hashlib.sha256()
+    for name, sha in sorted(parts):
+        digest.update(f"{name}\t{sha}\n".encode())
+    return digest.hexdigest()[:16]
+
+def set_data_version(conn, source, version, database=VERSION_DB):
+    conn.execute(text(f"""
+    INSERT INTO {database}.{VERSION_TABLE} (source, version, updated_at)
+    VALUES (:source, :version, :updated_at)
+    ON DUPLICATE KEY UPDATE version = VALUES(version), updated_at = VALUES(updated_at)
+    """), {"source": source, "version": version, "updated_at": datetime.now().replace(microsecond=0)})
+
+def get_data_version(source="accidents", engine=None, database=VERSION_DB):
+    """讀取資料來源目前的版本; 資料表不存在或查詢失敗時回傳 None"""
+    engine = engine or get_db_engine()
+    if not engine: return None
+    try:
+        with engine.connect() as conn:
+            return conn.execute(
+                text(f"SELECT version FROM {database}.{VERSION_TABLE} WHERE source = :source"),
+                {"source": source}).scalar()
+    except Exception as e:
+        print(f"[警告] 讀取資料版本失敗: {e}")
+        return None
+
+# ==========================================
+# 來源版本 token (快取失效用)
+# 一次小查詢取得所有來源的 token:
+# - information_schema.TABLES 的 CREATE_TIME / UPDATE_TIME / TABLE_ROWS (任何寫入都會改變)
+# - data_version 表的版本列 (匯入流程寫入, 內容雜湊)
+# 呼叫端把 token 放進快取 key: 資料沒變就一直命中, 匯入新資料後下一次檢查就換 key
+# ==========================================
+def _token(*parts):
+    return hashlib.sha1("|".join(str(p) for p in parts).encode("utf-8")).hexdigest()[:12]
+
+def fetch_source_versions(engine=None, database=VERSION_DB):
+    """
+    查詢所有來源目前的版本: {來源: (token, 匯入流程寫入的版本字串 or None)}; 查詢失敗時回傳 None
+    """
+    global _has_version_table
+    engine = engine or get_db_engine()
+    if not engine: return None
+
+    tables = ", ".join(f"('{schema}', '{table}')" for schema, table in SOURCE_TABLES.values())
+    stats_sql = f"""
+    SELECT CONCAT(TABLE_SCHEMA, '.', TABLE_NAME) AS name,
+           CONCAT_WS('|', CREATE_TIME, UPDATE_TIME, TABLE_ROWS) AS token
+    FROM information_schema.TABLES
+    WHERE (TABLE_SCHEMA, TABLE_NAME) IN ({tables})"""
+    union_sql = stats_sql + f"""
+    UNION ALL
+    SELECT CONCAT('version:', source), version FROM {database}.{VERSION_TABLE}"""
+    try:
+        with engine.connect() as conn:
+            try:
+                # MySQL 8 預設把 information_schema 的統計快取 24 小時, 這個 session 改成即時
+                conn.execute(text("SET SESSION information_schema_stats_expiry = 0"))
+            except Exception:
+                pass   # MariaDB / 舊版 MySQL 沒有這個變數, 本來就是即時的
+            rows = None
+            if _has_version_table is not False:
+                try:
+                    rows = conn.execute(text(union_sql)).fetchall()
+                    _has_version_table = True
+                except Exception as e:
+                    # 只有「資料表不存在」(MySQL 1146) 才記住不再 UNION;
+                    # 其他錯誤 (斷線、逾時...) 這次先退回只查統計, 下一個 CHECK_INTERVAL 再試
+                    if _is_missing_table(e):
+                        _has_version_table = False
+            if rows is None:
+                rows = conn.execute(text(stats_sql)).fetchall()
+    except Exception as e:
+        print(f"[警告] 讀取資料來源版本失敗: {e}")
+        return None
+
+    found = {name: token for name, token in rows}
+    return {source: (_token(found.get(f"{schema}.{table}"), found.get(f"version:{source}")),
+                     found.get(f"version:{source}"))
+            for source, (schema, table) in SOURCE_TABLES.items()}
+
+def _is_missing_table(error):
+    """是否為 MySQL 的「資料表不存在」錯誤 (1146); SQLAlchemy 的錯誤包著原本的 driver 錯誤 (orig)"""
+    args = getattr(getattr(error, "orig", error), "args", ())
+    return bool(args) and args[0] == MYSQL_NO_SUCH_TABLE
+
+def _refresh_versions(engine=None):
+    """每 CHECK_INTERVAL 秒最多查一次資料庫, 其他時候沿用上次的結果"""
+    now = time.monotonic()
+    checked_at = _tokens["checked_at"]
+    if checked_at is None or now - checked_at > CHECK_INTERVAL:
+        # 同時只讓一個執行緒去查, 其他執行緒沿用舊的 token (第一次則等待查詢結果)
+        if _tokens_lock.acquire(blocking=checked_at is None):
+            try:
+                if _tokens["checked_at"] is None or now - _tokens["checked_at"] > CHECK_INTERVAL:
+                    found = fetch_source_versions(engine) or {}
+                    _tokens["tokens"] = {source: token for source, (token, _) in found.items()}
+                    _tokens["versions"] = {source: version for source, (_, version) in found.items()}
+                    _tokens["checked_at"] = time.monotonic()
+            finally:
+                _tokens_lock.release()
+
+def source_version(source, engine=None):
+    """
+    來源目前的版本 token (每 CHECK_INTERVAL 秒最多查一次資料庫, 其他時候直接回傳上次的結果)
+    查不到時回傳以小時為單位的 token, 快取仍會定期更新
+    """
+    _refresh_versions(engine)
+    return _tokens["tokens"].get(source) or f"ttl-{int(time.time() // FALLBACK_TTL)}"
+
+def current_data_version(source, engine=None):
+    """
+    匯入流程寫入的版本字串 (同 get_data_version, 但與 source_version 共用同一次檢查, 不另外查詢)
+    沒有版本列或查詢失敗時回傳 None
+    """
+    _refresh_versions(engine)
+    return _tokens["versions"].get(source)
@@ -3,15 +3,27 @@ import time                     # 讓程式暫停幾秒 (等待連線建立)
 import socket                   # 檢查網路 Port 是否有通 (像打電話確認有沒有人接)
 import subprocess               # 在背景執行外部指令 (這裡是執行 gcloud 指令)
 import atexit                   # 註冊「程式結束時」要執行的收尾動作
-from sqlalchemy import create_engine  # 用於建立資料庫連線物件 (Engine)
+import threading                # 保護全域 Engine 登錄表 / 背景監控 SSH Tunnel
+from collections import deque   # 保留最近的 Tunnel 事件與輸出 (固定長度)
+from sqlalchemy import create_engine, text  # 用於建立資料庫連線物件 (Engine)
 from sqlalchemy.engine import make_url # 用於解析資料庫連線字串 (把 URL 拆解成 user, host, port...)
 from dotenv import load_dotenv  # 載入 .env 檔案
 
 
-# 定義一個全域變數, 用來存放 SSH Tunnel 的處理程序
+# 定義一個全域變數, 用來存放 SSH Tunnel 的監控器 (TunnelSupervisor)
 # 這樣才能在程式結束時找到它, 並將其關閉
 load_dotenv()
-_tunnel_process = None
+_tunnel_supervisor = None
+
+# Engine 登錄表: 名稱 -> Engine
+# 每個 Engine 自帶一個連線池, 整個 Process 共用, 不再每次查詢都重建
+_engine_registry = {}
+_registry_lock = threading.Lock()
+
+# 連線池預設值 (可由 .env 覆寫)
+DEFAULT_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))         # 常駐連線數
+DEFAULT_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))  # 尖峰時可額外借出的連線數
+DEFAULT_POOL_RECYCLE = 3600                                     # 每小時回收連線一次
 
 def is_port_open(host, port):
     # 建立一個 socket 物件 (像是一支電話)
@@ -28,27 +40,14 @@ def is_port_open(host, port):
     finally:
         s.close()     # 確保釋放資源
 
-def start_ssh_tunnel(local_port):
-    """
-    自動執行 gcloud 指令, 建立 SSH Tunnel (地道)
-    local_port: 希望在本機開在哪個 Port (例如 3307)
-    """
-    global _tunnel_process # 宣告修改外面的全域變數
-    
-    # 從.env讀取 VM 的連線資訊
+def build_tunnel_cmd(local_port):
+    """組合 gcloud 指令 (拆成 List 格式), VM 資訊從 .env 讀取"""
     vm_name = os.getenv("VM_NAME")       # 例如: test_db
     zone = os.getenv("VM_ZONE")          # 例如: asia-east1-c
     project = os.getenv("PROJECT_ID")    # 例如: watchful-net-xxxxx
-    
-    if is_port_open("127.0.0.1", local_port):
-        # print(f"SSH 通道已存在 (Port {local_port}), 直接使用現有通道")
-        return
 
-    print(f"偵測到 Port {local_port} 未開啟, 正在建立 SSH Tunnel 連線到 {vm_name}...")
-    
-    # 組合 gcloud 指令 (拆成 List 格式)
     # 格式: gcloud compute ssh [VM] --zone [ZONE] --project [ID] --tunnel-through-iap -- -N -L [LOCAL]:localhost:3306
-    cmd = [
+    return [
         "gcloud", "compute", "ssh", vm_name,
         "--zone", zone,
         "--project", project,
@@ -58,60 +57,334 @@ def start_ssh_tunnel(local_port):
         "-L", f"{local_port}:localhost:3306" # 建立地道：把本機的 local_port 對應到 VM 的 3306
     ]
 
-    # 設定隱藏視窗的旗標 (Flag)
-    # 如果是在 Windows 系統 (os.name == 'nt'), 設定 CREATE_NO_WINDOW 來隱藏黑視窗
-    # 如果是 Mac/Linux, 則設為 0 (不特別設定)
-    creation_flags = subprocess.CREATE_NO_WINDOW if os.name == 'nt' else 0
-    
-    # 使用 subprocess.Popen 在背景啟動指令
-    _tunnel_process = subprocess.Popen(
-        cmd, 
-        stdout=subprocess.PIPE,       # 把標準輸出導向 PIPE (不顯示在螢幕上)
-        stderr=subprocess.PIPE,       # 把錯誤輸出導向 PIPE
-        creationflags=creation_flags  # 套用剛剛設定的隱藏視窗設定
-    )
-
-    print("⏳ 等待連線建立中 (約 5 秒)...")
-    time.sleep(5) # 強制等待 5 秒, 讓 gcloud 有時間完成連線握手
-    
-    # 再次檢查 Port, 確認連線是否成功
-    if is_port_open("127.0.0.1", local_port):
+class TunnelSupervisor:
+    """
+    SSH Tunnel 監控器 (背景執行緒)
+    1. 啟動指令後, 以指數退避 (0.1s, 0.2s, 0.4s...) 輪詢 Port, 握手多久就等多久
+    2. 持續檢查 Port, Tunnel 掛掉時自動重啟
+    3. 背景讀取子程序的輸出, 避免 PIPE 塞滿導致子程序卡住 (保留最後幾行方便除錯)
+    4. 透過 on_event(event, detail) 回報 up / down / restart / failed 事件
+    cmd: 要執行的指令 (List), 測試時可換成本機的假 Tunnel, 例如 python -m http.server
+    max_restarts: 連續重啟失敗幾次後放棄 (None = 不限次數); 成功就緒後重新計算
+    """
+    def __init__(self, cmd, local_port, host="127.0.0.1", on_event=None,
+                 check_interval=5.0, ready_timeout=60.0,
+                 initial_backoff=0.1, max_backoff=5.0, log_lines=50, max_restarts=None):
+        self.cmd = cmd
+        self.local_port = int(local_port)
+        self.host = host
+        self.on_event = on_event or self._print_event
+        self.check_interval = check_interval   # 健康檢查間隔 (秒)
+        self.ready_timeout = ready_timeout     # 單次啟動最長等待時間 (秒)
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.max_restarts = max_restarts
+        self.restart_count = 0
+        self._failed_restarts = 0              # 連續重啟失敗次數
+        self.events = deque(maxlen=100)        # 事件紀錄 (時間, 事件, 說明)
+        self.output = deque(maxlen=log_lines)  # 子程序最後 N 行輸出
+        self._process = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._wake = threading.Event()         # 叫醒監控執行緒, 立刻檢查 (不用等 check_interval)
+        self._monitor = None
+
+    # --- 事件回報 ---
+    @staticmethod
+    def _print_event(event, detail):
+        icons = {"start": "🚀", "up": "✅", "down": "⚠️", "restart": "🔄", "failed": "❌"}
+        print(f"{icons.get(event, '')} [SSH Tunnel] {event}: {detail}")
+
+    def _emit(self, event, detail=""):
+        self.events.append((time.time(), event, detail))
+        try:
+            self.on_event(event, detail)
+        except Exception as e:
+            print(f"[警告] Tunnel 事件回呼失敗: {e}")
+
+    # --- 子程序管理 ---
+    def _drain(self, stream):
+        """持續讀取子程序輸出, 直到 PIPE 關閉"""
+        for line in iter(stream.readline, b""):
+            self.output.append(line.decode(errors="replace").rstrip())
+        stream.close()
+
+    def _launch(self):
+        # 設定隱藏視窗的旗標 (Flag)
+        # 如果是在 Windows 系統 (os.name == 'nt'), 設定 CREATE_NO_WINDOW 來隱藏黑視窗
+        # 如果是 Mac/Linux, 則設為 0 (不特別設定)
+        creation_flags = subprocess.CREATE_NO_WINDOW if os.name == 'nt' else 0
+        self._process = subprocess.Popen(
+            self.cmd,
+            stdout=subprocess.PIPE,       # 標準輸出導向 PIPE, 由背景執行緒讀取
+            stderr=subprocess.STDOUT,     # 錯誤輸出合併進同一條 PIPE
+            stdin=subprocess.DEVNULL,
+            creationflags=creation_flags  # 套用剛剛設定的隱藏視窗設定
+        )
+        threading.Thread(target=self._drain, args=(self._process.stdout,), daemon=True).start()
+
+    def _terminate(self):
+        proc, self._process = self._process, None
+        if proc and proc.poll() is None:
+            proc.terminate()
+            try:
+                proc.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+
+    def _wait_for_port(self, timeout=None):
+        """剛啟動的子程序: 以指數退避輪詢 Port, 成功回傳 True; 逾時或子程序提早結束回傳 False"""
+        deadline = time.monotonic() + (self.ready_timeout if timeout is None else timeout)
+        delay = self.initial_backoff
+        while not self._stop.is_set():
+            if is_port_open(self.host, self.local_port):
+                return True
+            if self._process is not None and self._process.poll() is not None:
+                return False   # 子程序已經結束 (例如 gcloud 未登入), 不用再等
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            self._stop.wait(min(delay, remaining))
+            delay = min(delay * 2, self.max_backoff)
+        return False
+
+    def restart_pending(self):
+        """監控器還會重啟 Tunnel 嗎 (監控執行緒在跑, 且還沒用完重啟次數)"""
+        if self._stop.is_set() or self._monitor is None or not self._monitor.is_alive():
+            return False
+        return self.max_restarts is None or self._failed_restarts < self.max_restarts
+
+    def wait_until_ready(self, timeout=None):
+        """
+        等待 Tunnel 就緒 (包含等監控器重啟完成), 成功回傳 True
+        子程序已結束時叫醒監控器立刻重啟; 只有在不會再重啟 (未監控 / 重啟次數用完) 或逾時才回傳 False
+        """
+        deadline = time.monotonic() + (self.ready_timeout if timeout is None else timeout)
+        delay = self.initial_backoff
+        while not self._stop.is_set():
+            if is_port_open(self.host, self.local_port):
+                return True
+            process = self._process
+            if process is not None and process.poll() is not None:
+                if not self.restart_pending():
+                    return False   # 子程序已經結束且不會重啟 (例如 gcloud 未登入), 不用再等
+                self._wake.set()   # 不用等下一次健康檢查, 立刻重啟
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            self._stop.wait(min(delay, remaining))
+            delay = min(delay * 2, self.max_backoff)
+        return False
+
+    def _bring_up(self, event):
+        """(重新) 啟動 Tunnel 並等待就緒"""
+        with self._lock:
+            self._terminate()
+            self._launch()
+            self._emit(event, f"Port {self.local_port} (累計重啟 {self.restart_count} 次)")
+            started = time.monotonic()
+            if self._wait_for_port():
+                self._emit("up", f"Port {self.local_port} 就緒 ({time.monotonic() - started:.1f}s)")
+                return True
+            last = self.output[-1] if self.output else "無輸出"
+            self._emit("failed", f"Port {self.local_port} 未就緒: {last}")
+            return False
+
+    def _monitor_loop(self):
+        retry_delay = self.initial_backoff
+        while True:
+            self._wake.wait(self.check_interval)
+            self._wake.clear()
+            if self._stop.is_set():
+                break
+            if is_port_open(self.host, self.local_port):
+                retry_delay = self.initial_backoff
+                continue
+            self._emit("down", f"Port {self.local_port} 無回應")
+            self.restart_count += 1
+            if self._bring_up("restart"):
+                self._failed_restarts = 0
+                continue
+            self._failed_restarts += 1
+            if self.max_restarts is not None and self._failed_restarts >= self.max_restarts:
+                self._emit("failed", f"連續重啟失敗 {self._failed_restarts} 次, 停止監控")
+                break
+            # 重啟失敗: 退避後再試, 避免狂開子程序
+            self._stop.wait(retry_delay)
+            retry_delay = min(retry_delay * 2, self.max_backoff * 10)
+
+    # --- 對外介面 ---
+    def start(self):
+        """啟動 Tunnel (若 Port 已經開著就直接沿用) 並開始背景監控, 回傳是否就緒"""
+        if is_port_open(self.host, self.local_port):
+            ready = True
+            self._emit("up", f"Port {self.local_port} 已存在, 直接使用現有通道")
+        else:
+            ready = self._bring_up("start")
+        if self._monitor is None:
+            self._monitor = threading.Thread(target=self._monitor_loop, name="tunnel-supervisor", daemon=True)
+            self._monitor.start()
+        return ready
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        with self._lock:
+            self._terminate()
+
+    def is_alive(self):
+        return is_port_open(self.host, self.local_port)
+
+def start_ssh_tunnel(local_port, cmd=None, on_event=None):
+    """
+    自動執行 gcloud 指令, 建立 SSH Tunnel (地道), 並交給 TunnelSupervisor 在背景監控
+    local_port: 希望在本機開在哪個 Port (例如 3307)
+    cmd: 自訂指令 (預設為 gcloud compute ssh, 測試時可換成假 Tunnel)
+    """
+    global _tunnel_supervisor # 宣告修改外面的全域變數
+
+    if _tunnel_supervisor is not None and _tunnel_supervisor.local_port == int(local_port):
+        # 已經有監控器在跑: Port 通就直接用, 不通就等它重啟完成
+        return _tunnel_supervisor.is_alive() or _tunnel_supervisor.wait_until_ready()
+
+    # 就算 SSH 通道已存在 (例如手動開啟) 也掛上監控器, 斷線時由它接手重啟
+    if not is_port_open("127.0.0.1", local_port):
+        print(f"偵測到 Port {local_port} 未開啟, 正在建立 SSH Tunnel 連線...")
+
+    _tunnel_supervisor = TunnelSupervisor(cmd or build_tunnel_cmd(local_port), local_port, on_event=on_event)
+    ready = _tunnel_supervisor.start()
+    if ready:
         print("SSH Tunnel 建立成功！資料庫連線準備就緒")
     else:
         print("SSH Tunnel 建立失敗！請檢查網路或 gcloud login 狀態")
+    return ready
 
 # 負責關閉 gcloud 背景程式, 如果不關掉, Port 會一直被佔用, 下次執行會報錯
 def cleanup_tunnel():
-    global _tunnel_process
-    if _tunnel_process:
+    global _tunnel_supervisor
+    if _tunnel_supervisor:
         print("正在關閉 SSH Tunnel...")
-        _tunnel_process.terminate() # 強制終止程序
-        _tunnel_process = None
+        _tunnel_supervisor.stop() # 停止監控並終止程序
+        _tunnel_supervisor = None
 
 # 使用 atexit 註冊：當 Python 程式結束(無論正常結束或當機)時, 自動執行 cleanup_tunnel
 atexit.register(cleanup_tunnel)
 
-def get_db_engine():
+def _create_engine(db_url, pool_size, max_overflow):
+    """解析 URL、確認 SSH Tunnel, 並建立帶連線池的 Engine (只在登錄表沒有時呼叫)"""
+    url_obj = make_url(db_url)
+    target_port = url_obj.port
+    if not target_port:
+        target_port = 3307
+        print(f"⚠️ URL 未指定 Port, 預設使用 {target_port}")
+    start_ssh_tunnel(target_port)
+    return create_engine(
+        db_url,
+        pool_size=pool_size,              # 常駐連線數
+        max_overflow=max_overflow,        # 額外可借出的連線數
+        pool_pre_ping=True,               # 借出前先 ping, 自動汰換被 Tunnel 斷掉的連線
+        pool_recycle=DEFAULT_POOL_RECYCLE)
+
+def get_db_engine(name="default", db_url=None, pool_size=None, max_overflow=None):
     """
     主函式：取得資料庫連線引擎 (Engine)
-    它會自動處理 URL 解析、通道建立、以及連線物件生成
+    同一個 name 在整個 Process 只會建立一次, 之後都回傳同一個 Engine (共用連線池)
+    name: Engine 名稱 (預設 "default", 使用 .env 的 MYSQL URL)
+    db_url: 指定連線字串 (第一次註冊該 name 時才有作用)
+    pool_size / max_overflow: 連線池大小設定 (第一次註冊該 name 時才有作用)
     """
+    engine = _engine_registry.get(name)
+    if engine is not None:
+        return engine
 
     # 如果沒設定 URL, 印出錯誤並回傳 None
-    db_url = os.getenv("MYSQLSQL_URL") 
+    db_url = db_url or os.getenv("MYSQLSQL_URL")
     if not db_url: 
         print("錯誤: .env 檔案中找不到 MYSQL_URL 設定")
         return None
-    try:
-        url_obj = make_url(db_url)
-        target_port = url_obj.port
-        if not target_port:
-            target_port = 3307
-            print(f"⚠️ URL 未指定 Port, 預設使用 {target_port}")
-        start_ssh_tunnel(target_port)
-        engine = create_engine(db_url, pool_recycle=3600) # pool_recycle=3600 每小時回收連線一次)
+
+    with _registry_lock:
+        # 雙重檢查: 等鎖期間可能已經有其他執行緒建好了
+        engine = _engine_registry.get(name)
+        if engine is not None:
+            return engine
+        try:
+            engine = _create_engine(
+                db_url,
+                DEFAULT_POOL_SIZE if pool_size is None else pool_size,
+                DEFAULT_MAX_OVERFLOW if max_overflow is None else max_overflow)
+        except Exception as e:
+            print(f"資料庫連線初始化失敗: {e}")
+            return None
+        _engine_registry[name] = engine
         return engine
-        
+
+def warm_up_engine(name="default", connections=None):
+    """
+    啟動時預熱連線池：先借出 N 條連線並執行 SELECT 1, 再全部歸還
+    讓第一個使用者不用負擔 TCP + IAP 握手時間
+    回傳成功建立的連線數
+    """
+    engine = get_db_engine(name)
+    if not engine: return 0
+
+    n = connections or engine.pool.size()
+    conns = []
+    try:
+        for _ in range(n):
+            conn = engine.connect()
+            conn.execute(text("SELECT 1"))
+            conns.append(conn)
     except Exception as e:
-        print(f"資料庫連線初始化失敗: {e}")
-        return None
\ No newline at end of file
+        print(f"[警告] 連線池預熱中斷: {e}")
+    finally:
+        for conn in conns:
+            conn.close()   # 歸還連線池 (不是真的斷線)
+    print(f"--- [系統] 連線池 '{name}' 預熱完成 ({len(conns)}/{n}) ---")
+    return len(conns)
+
+def get_pool_stats():
+    """
+    回傳所有已註冊 Engine 的連線池狀態, 方便除錯與監控
+    格式: {name: {"size", "checked_in", "checked_out", "overflow"}}
+    """
+    stats = {}
+    for name, engine in list(_engine_registry.items()):
+        pool = engine.pool
+        stats[name] = {
+            "size": pool.size(),              # 常駐連線數上限
+            "checked_in": pool.checkedin(),   # 閒置在池中的連線
+            "checked_out": pool.checkedout(), # 目前被借出的連線
+            "overflow": pool.overflow(),      # 超出常駐數的額外連線
+        }
+    return stats
+
+def dispose_engines():
+    """關閉所有 Engine 的連線池 (程式結束時呼叫)"""
+    with _registry_lock:
+        for engine in _engine_registry.values():
+            engine.dispose()
+        _engine_registry.clear()
+
+# atexit 以後進先出順序執行: 先關連線池, 再關 SSH Tunnel
+atexit.register(dispose_engines)
+
+# ==========================================
+# 測試程式：用本機的假 Tunnel (http.server) 驗證自動重啟
+# ==========================================
+if __name__ == "__main__":
+    import sys
+    fake_port = 3399
+    fake_cmd = [sys.executable, "-m", "http.server", str(fake_port), "--bind", "127.0.0.1"]
+
+    sup = TunnelSupervisor(fake_cmd, fake_port, check_interval=0.5)
+    print(f"[測試 1] 啟動假 Tunnel: {sup.start()}")
+
+    print("[測試 2] 模擬 Tunnel 斷線, 等待監控器重啟...")
+    sup._process.kill()
+    time.sleep(0.5)
+    print(f"重啟後就緒: {sup.wait_until_ready(timeout=10)} (重啟次數: {sup.restart_count})")
+
+    sup.stop()
+    for ts, event, detail in sup.events:
+        print(f"  {time.strftime('%H:%M:%S', time.localtime(ts))} {event:8s} {detail}")
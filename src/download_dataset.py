@@ -0,0 +1,273 @@
+import os
+import re
+import json
+import time
+import hashlib
+import argparse
+import threading
+import requests
+import urllib3
+
+# ==========================================
+# 內政部交通事故資料集 下載器 (串流 + 斷點續傳 + 快取)
+# - 串流寫入磁碟 (每次 1 MB), 不把整個 ZIP 放進記憶體
+# - 下載中斷時保留 .part 檔, 重試 / 下次執行用 HTTP Range 從中斷處繼續 (If-Range 確保檔案沒換)
+# - 完成後檢查大小與 SHA256, 再原子性地換成正式檔名
+# - 旁邊存一份 .meta.json (ETag / Last-Modified / 大小 / SHA256), 伺服器檔案沒變就直接用快取
+# 執行: python download_dataset.py [網址] [--dest 路徑] [--sha256 雜湊]
+#       python download_dataset.py --selftest   (用本機 HTTP 替身測試續傳 / 快取 / 驗證)
+# ==========================================
+
+urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+DATA_CACHE_DIR = os.getenv(
+    "DATA_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data", "cache"))
+DOWNLOAD_DIR = os.path.join(DATA_CACHE_DIR, "downloads")
+
+# 111 年度交通事故資料 (同 notebook 的 zip_url)
+MOI_ACCIDENT_ZIP_URL = ("https://opdadm.moi.gov.tw/api/v1/no-auth/resource/api/dataset/"
+                        "E528373B-155F-4D2A-946E-21C87041FC87/resource/28128A43-4F80-4670-8F61-30F959477218/download")
+
+CHUNK_BYTES = 1 << 20
+
+class DownloadError(Exception):
+    pass
+
+def _meta_path(path):
+    return f"{path}.meta.json"
+
+def _read_meta(path):
+    try:
+        with open(_meta_path(path), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _write_meta(path, meta):
+    tmp = f"{_meta_path(path)}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False)
+    os.replace(tmp, _meta_path(path))
+
+def _remove(*paths):
+    for p in paths:
+        try:
+            os.remove(p)
+        except OSError:
+            pass
+
+def _validators(headers):
+    """伺服器回傳的檔案識別資訊 (用來判斷檔案有沒有換過)"""
+    size = headers.get("Content-Length")
+    return {"etag": headers.get("ETag"), "last_modified": headers.get("Last-Modified"),
+            "size": int(size) if size and size.isdigit() else None}
+
+def _same_remote(meta, remote):
+    """ETag 或 Last-Modified 其中一個相同 (且大小相同) 就視為同一份檔案"""
+    if not meta: return False
+    if remote["size"] is not None and meta.get("size") not in (None, remote["size"]):
+        return False
+    if remote["etag"] and meta.get("etag"):
+        return remote["etag"] == meta["etag"]
+    if remote["last_modified"] and meta.get("last_modified"):
+        return remote["last_modified"] == meta["last_modified"]
+    return False
+
+def _file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(CHUNK_BYTES), b""):
+            digest.update(block)
+    return digest
+
+def default_dest(url, headers=None):
+    """快取檔名: 優先用伺服器給的檔名, 否則用網址雜湊 (同一個網址永遠對到同一個檔案)"""
+    name = None
+    disposition = (headers or {}).get("Content-Disposition", "")
+    m = re.search(r"filename\*?=(?:UTF-8'')?\"?([^\";]+)\"?", disposition)
+    if m:
+        name = os.path.basename(requests.utils.unquote(m.group(1)))
+    url_key = hashlib.sha1(url.encode()).hexdigest()[:12]
+    return os.path.join(DOWNLOAD_DIR, f"{url_key}_{name}" if name else f"{url_key}.zip")
+
+def download(url, dest=None, expected_sha256=None, expected_size=None, retries=5, timeout=30, verify=False):
+    """
+    下載 url 到 dest (未指定時放在 DATA_CACHE_DIR/downloads), 回傳檔案路徑
+    - dest 已存在且伺服器的 ETag / Last-Modified 沒變: 直接回傳, 不下載
+    - 中斷時自動重試 (指數退避), 從 .part 的大小繼續
+    - 大小或 SHA256 不符時刪除暫存並拋出 DownloadError
+    """
+    session = requests.Session()
+    head = session.head(url, allow_redirects=True, timeout=timeout, verify=verify)
+    remote = _validators(head.headers) if head.ok else {"etag": None, "last_modified": None, "size": None}
+    dest = dest or default_dest(url, head.headers if head.ok else None)
+    os.makedirs(os.path.dirname(os.path.abspath(dest)), exist_ok=True)
+    part = f"{dest}.part"
+
+    # --- 1. 快取: 檔案存在且伺服器端沒有變更 ---
+    meta = _read_meta(dest)
+    if os.path.exists(dest) and _same_remote(meta, remote) and os.path.getsize(dest) == meta.get("size"):
+        if not expected_sha256 or meta.get("sha256") == expected_sha256:
+            print(f"--- [系統] 快取檔未變更 (ETag/Last-Modified 相同), 略過下載: {dest} ---")
+            return dest
+
+    # --- 2. 下載 (可續傳) ---
+    # .part 是別的版本留下的 (ETag 不同): 不能接著下載, 從頭開始
+    if os.path.exists(part) and not _same_remote(_read_meta(part), remote):
+        _remove(part, _meta_path(part))
+    _write_meta(part, {"url": url, **remote})
+
+    backoff = 1.0
+    for attempt in range(1, retries + 1):
+        try:
+            _download_part(session, url, part, remote, timeout, verify)
+            break
+        except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+            if attempt == retries:
+                raise DownloadError(f"下載失敗 (已重試 {retries} 次): {e}") from e
+            have = os.path.getsize(part) if os.path.exists(part) else 0
+            print(f"[警告] 下載中斷 ({e.__class__.__name__}), {backoff:.0f}s 後從 {have:,} bytes 繼續 "
+                  f"({attempt}/{retries})")
+            time.sleep(backoff)
+            backoff = min(backoff * 2, 30)
+
+    # --- 3. 驗證大小與雜湊, 通過才換成正式檔名 ---
+    size = os.path.getsize(part)
+    expected = expected_size or remote["size"]
+    if expected is not None and size != expected:
+        _remove(part, _meta_path(part))
+        raise DownloadError(f"檔案大小不符: 預期 {expected:,} bytes, 實際 {size:,} bytes")
+    sha = _file_sha256(part).hexdigest()
+    if expected_sha256 and sha != expected_sha256.lower():
+        _remove(part, _meta_path(part))
+        raise DownloadError(f"SHA256 不符: 預期 {expected_sha256}, 實際 {sha}")
+
+    os.replace(part, dest)
+    _remove(_meta_path(part))
+    _write_meta(dest, {"url": url, **remote, "size": size, "sha256": sha})
+    print(f"--- [系統] 下載完成: {dest} ({size:,} bytes, sha256 {sha[:12]}...) ---")
+    return dest
+
+def _download_part(session, url, part, remote, timeout, verify):
+    """從 .part 目前的大小續傳到結束"""
+    have = os.path.getsize(part) if os.path.exists(part) else 0
+    if remote["size"] is not None and have == remote["size"]:
+        return
+    headers = {}
+    if have:
+        headers["Range"] = f"bytes={have}-"
+        validator = remote["etag"] or remote["last_modified"]
+        if validator:
+            headers["If-Range"] = validator   # 伺服器檔案換過時會回 200 (整份), 而不是 206
+    with session.get(url, headers=headers, stream=True, timeout=timeout, verify=verify) as resp:
+        resp.raise_for_status()
+        if have and resp.status_code != 206:
+            have = 0                          # 不支援續傳 (或檔案已變更): 從頭寫
+        mode = "ab" if have else "wb"
+        started, received = time.perf_counter(), 0
+        with open(part, mode) as f:
+            for block in resp.iter_content(CHUNK_BYTES):
+                f.write(block)
+                received += len(block)
+        elapsed = max(time.perf_counter() - started, 1e-9)
+        print(f"    已接收 {received:,} bytes ({'續傳' if have else '完整下載'}, {received / elapsed / 2**20:.1f} MB/s)")
+
+# ==========================================
+# 自我測試: 本機 HTTP 替身 (支援 Range / ETag / If-None-Match, 可模擬連線中斷)
+# ==========================================
+def _serve_stand_in(payload, etag, drop_after=None):
+    """啟動本機 HTTP 伺服器, 回傳 (server, 網址, 狀態 dict); drop_after: 第一次傳到這個位元組數就斷線"""
+    from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+    state = {"payload": payload, "etag": etag, "drop_after": drop_after, "requests": []}
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def _headers(self, status, length, extra=None):
+            self.send_response(status)
+            self.send_header("Content-Length", str(length))
+            self.send_header("ETag", state["etag"])
+            self.send_header("Last-Modified", "Sat, 01 Jul 2023 00:00:00 GMT")
+            self.send_header("Accept-Ranges", "bytes")
+            for k, v in (extra or {}).items():
+                self.send_header(k, v)
+            self.end_headers()
+
+        def do_HEAD(self):
+            state["requests"].append(("HEAD", None))
+            self._headers(200, len(state["payload"]))
+
+        def do_GET(self):
+            data, start = state["payload"], 0
+            rng = self.headers.get("Range")
+            state["requests"].append(("GET", rng))
+            if rng and self.headers.get("If-Range") in (None, state["etag"]):
+                start = int(rng.split("=")[1].split("-")[0])
+                self._headers(206, len(data) - start, {"Content-Range": f"bytes {start}-{len(data) - 1}/{len(data)}"})
+            else:
+                self._headers(200, len(data))
+            body = data[start:]
+            if state["drop_after"] is not None:
+                cut, state["drop_after"] = state["drop_after"] - start, None
+                self.wfile.write(body[:cut])
+                self.wfile.flush()
+                self.connection.close()       # 模擬連線中斷 (Content-Length 還沒送完)
+                return
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/dataset.zip", state
+
+def selftest():
+    import tempfile
+    payload = os.urandom(5 * CHUNK_BYTES + 12345)
+    sha = hashlib.sha256(payload).hexdigest()
+    server, url, state = _serve_stand_in(payload, '"v1"', drop_after=2 * CHUNK_BYTES + 7)
+    with tempfile.TemporaryDirectory() as tmp:
+        dest = os.path.join(tmp, "dataset.zip")
+        try:
+            # 1. 中途斷線 -> 自動以 Range 續傳, 內容與雜湊正確
+            download(url, dest, expected_sha256=sha)
+            with open(dest, "rb") as f:
+                assert f.read() == payload, "續傳後內容不一致"
+            assert any(method == "GET" and rng for method, rng in state["requests"]), "沒有使用 Range 續傳"
+            print("[測試] 斷線續傳 OK")
+
+            # 2. ETag 沒變 -> 不再下載
+            state["requests"].clear()
+            download(url, dest, expected_sha256=sha)
+            assert all(method == "HEAD" for method, _ in state["requests"]), "ETag 相同卻重新下載"
+            print("[測試] ETag 快取 OK")
+
+            # 3. 伺服器檔案更新 (ETag 改變) -> 重新下載
+            state["payload"], state["etag"] = payload[::-1], '"v2"'
+            download(url, dest)
+            with open(dest, "rb") as f:
+                assert f.read() == payload[::-1], "檔案更新後內容不一致"
+            print("[測試] 檔案更新 OK")
+
+            # 4. 雜湊不符 -> 拋出 DownloadError 且不留下檔案
+            _remove(dest, _meta_path(dest))
+            try:
+                download(url, dest, expected_sha256="0" * 64)
+                raise AssertionError("雜湊不符卻沒有報錯")
+            except DownloadError:
+                assert not os.path.exists(dest) and not os.path.exists(f"{dest}.part")
+            print("[測試] 雜湊驗證 OK")
+        finally:
+            server.shutdown()
+    print("--- [系統] 自我測試全部通過 ---")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="交通事故資料集 串流下載 (可續傳)")
+    parser.add_argument("url", nargs="?", default=MOI_ACCIDENT_ZIP_URL, help="下載網址 (預設 111 年度資料)")
+    parser.add_argument("--dest", help="存檔路徑 (預設放在 DATA_CACHE_DIR/downloads)")
+    parser.add_argument("--sha256", help="預期的 SHA256 (選用)")
+    parser.add_argument("--selftest", action="store_true", help="以本機 HTTP 替身測試續傳 / 快取 / 驗證")
+    args = parser.parse_args()
+    if args.selftest:
+        selftest()
+    else:
+        download(args.url, args.dest, expected_sha256=args.sha256)
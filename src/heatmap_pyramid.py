@@ -0,0 +1,183 @@
+import os
+import time
+import threading
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+from db_utils import get_db_engine
+
+# ==========================================
+# 全台熱力圖 多解析度金字塔 (Heatmap Pyramid)
+# 匯入資料後執行一次: python heatmap_pyramid.py
+# - 資料庫只做一次最細格 (0.005°) 的 GROUP BY, 較粗的層級用 NumPy 由細格合併
+# - 每層存成一個 .npz (格子索引 int32 + 事故數 int32), 請求時直接讀檔, 不再跑 GROUP BY
+# - 依地圖縮放 (zoom) 挑層級: 全島概覽只送幾千個格子, 放大到街道才用細格
+# ==========================================
+
+DATA_CACHE_DIR = os.getenv(
+    "DATA_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data", "cache"))
+PYRAMID_DIR = os.path.join(DATA_CACHE_DIR, "heatmap")
+
+LEVELS = (0.1, 0.05, 0.01, 0.005)   # 格子大小 (度), 0.01° 約 1.1 km
+FINEST = LEVELS[-1]
+KEY_STRIDE = 1 << 20                # 合併 (列, 欄) 成單一整數 key 用 (經度 180 / 0.005 = 36000 < 2^20)
+
+# 全台範圍 (與原本 get_taiwan_heatmap_data 相同)
+TAIWAN_BOUNDS = {"min_lat": 21, "max_lat": 26, "min_lon": 119, "max_lon": 122}
+
+_cache = {}                         # 層級 -> (mtime, dict of arrays)
+_lock = threading.Lock()
+
+def level_for_zoom(zoom):
+    """
+    依 Leaflet zoom 挑選格子大小 (讓每個格子在螢幕上約 5~15 px)
+    zoom 8 (全島) -> 0.05°, zoom 10~11 (城市) -> 0.01°, zoom 12 以上 (街道) -> 0.005°
+    """
+    if zoom is None: return 0.01    # 未指定時維持原本的 ~1.1 km 解析度
+    if zoom <= 7: return 0.1
+    if zoom <= 9: return 0.05
+    if zoom <= 11: return 0.01
+    return 0.005
+
+def _level_path(level):
+    return os.path.join(PYRAMID_DIR, f"level_{level:g}.npz")
+
+# ==========================================
+# 1. 建立金字塔 (匯入資料後執行)
+# ==========================================
+def _fetch_finest_cells(engine):
+    """資料庫端只做一次最細層級的 GROUP BY, 回傳 (列索引, 欄索引, 事故數)"""
+    sql = text(f"""
+    SELECT
+        FLOOR(latitude / {FINEST}) AS gy,
+        FLOOR(longitude / {FINEST}) AS gx,
+        COUNT(*) AS count
+    FROM test_db.accident_main
+    WHERE latitude BETWEEN :min_lat AND :max_lat
+      AND longitude BETWEEN :min_lon AND :max_lon
+    GROUP BY gy, gx
+    """)
+    with engine.connect() as conn:
+        df = pd.read_sql(sql, conn, params=TAIWAN_BOUNDS)
+    return (df['gy'].to_numpy(np.int64), df['gx'].to_numpy(np.int64), df['count'].to_numpy(np.int64))
+
+def aggregate_cells(gy, gx, count, factor):
+    """把細格合併成 factor 倍大的粗格 (整數除法 + bincount, 全程向量化)"""
+    key = np.floor_divide(gy, factor) * KEY_STRIDE + np.floor_divide(gx, factor)
+    uniq, inverse = np.unique(key, return_inverse=True)
+    sums = np.bincount(inverse, weights=count)
+    return (np.floor_divide(uniq, KEY_STRIDE).astype(np.int32),
+            np.mod(uniq, KEY_STRIDE).astype(np.int32),
+            sums.astype(np.int32))
+
+def _save_level(level, gy, gx, count):
+    """寫入單一層級: 先寫暫存檔再 os.replace, 讀取端不會讀到寫一半的檔案"""
+    os.makedirs(PYRAMID_DIR, exist_ok=True)
+    path = _level_path(level)
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    with open(tmp_path, "wb") as f:
+        np.savez(f, gy=gy, gx=gx, count=count, step=np.float64(level))
+    os.replace(tmp_path, path)
+
+def build_pyramid(engine=None):
+    """從 accident_main 建立所有層級, 回傳 {層級: 格子數}"""
+    engine = engine or get_db_engine()
+    if not engine:
+        print("Connection failed. Please check .env and db_utils.py")
+        return {}
+
+    started = time.perf_counter()
+    print(f"--- [系統] 聚合全台事故資料 (最細格 {FINEST}°) ---")
+    gy, gx, count = _fetch_finest_cells(engine)
+    print(f"    資料庫聚合完成: {len(count):,} 格, {int(count.sum()):,} 筆 ({time.perf_counter() - started:.1f}s)")
+
+    summary = {}
+    for level in LEVELS:
+        factor = int(round(level / FINEST))
+        lgy, lgx, lcount = aggregate_cells(gy, gx, count, factor)
+        _save_level(level, lgy, lgx, lcount)
+        summary[level] = len(lcount)
+        print(f"    層級 {level:g}°: {len(lcount):,} 格")
+    print(f"--- [系統] 熱力圖金字塔已寫入 {PYRAMID_DIR} ({time.perf_counter() - started:.1f}s) ---")
+    return summary
+
+# ==========================================
+# 2. 讀取 (請求時使用)
+# ==========================================
+def load_level(level):
+    """讀取單一層級 (檔案有更新才重新讀取), 不存在時回傳 None"""
+    path = _level_path(level)
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return None
+    cached = _cache.get(level)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    with _lock:
+        with np.load(path) as npz:
+            arrays = {k: npz[k] for k in ("gy", "gx", "count")}
+        _cache[level] = (mtime, arrays)
+    return arrays
+
+def is_available():
+    return all(os.path.exists(_level_path(level)) for level in LEVELS)
+
+def data_version():
+    """金字塔的版本 (最細層級檔案的修改時間), 可當快取 key; 不存在時回傳 None"""
+    try:
+        return os.path.getmtime(_level_path(FINEST))
+    except OSError:
+        return None
+
+def get_heatmap_cells(zoom=None, level=None):
+    """
+    回傳 HeatMap 格式 [[緯度, 經度, 事故數], ...] (格子中心點)
+    level 未指定時依 zoom 自動挑選; 金字塔不存在時回傳 None (由呼叫端改查資料庫)
+    """
+    level = level or level_for_zoom(zoom)
+    arrays = load_level(level)
+    if arrays is None:
+        return None
+    lat = np.round((arrays["gy"] + 0.5) * level, 6)
+    lon = np.round((arrays["gx"] + 0.5) * level, 6)
+    return np.column_stack([lat, lon, arrays["count"]]).tolist()
+
+# ==========================================
+# 3. 可視範圍 (Viewport) 切片
+# 依地圖目前的邊界只回傳看得到的格子; 邊界會對齊固定大小的「切片」,
+# 小幅平移時切片不變, 呼叫端可以用 (層級, 切片) 當快取 key
+# ==========================================
+TILE_CELLS = 64   # 每個切片邊長 = 64 個格子
+
+def tiles_for_bounds(south, west, north, east, zoom):
+    """回傳 (層級, [(切片列, 切片欄), ...]), 範圍先裁切到台灣邊界內"""
+    level = level_for_zoom(zoom)
+    size = level * TILE_CELLS
+    south, north = max(south, TAIWAN_BOUNDS["min_lat"]), min(north, TAIWAN_BOUNDS["max_lat"])
+    west, east = max(west, TAIWAN_BOUNDS["min_lon"]), min(east, TAIWAN_BOUNDS["max_lon"])
+    if south > north or west > east:
+        return level, []
+    rows = range(int(np.floor(south / size)), int(np.floor(north / size)) + 1)
+    cols = range(int(np.floor(west / size)), int(np.floor(east / size)) + 1)
+    return level, [(ty, tx) for ty in rows for tx in cols]
+
+def tile_bounds(level, ty, tx):
+    """切片的經緯度範圍 (south, west, north, east), 南/西邊含、北/東邊不含"""
+    size = level * TILE_CELLS
+    return ty * size, tx * size, (ty + 1) * size, (tx + 1) * size
+
+def get_tile_cells(level, ty, tx):
+    """回傳單一切片內的格子 [[緯度, 經度, 事故數], ...]; 金字塔不存在時回傳 None"""
+    arrays = load_level(level)
+    if arrays is None:
+        return None
+    gy, gx = arrays["gy"], arrays["gx"]
+    mask = ((gy >= ty * TILE_CELLS) & (gy < (ty + 1) * TILE_CELLS) &
+            (gx >= tx * TILE_CELLS) & (gx < (tx + 1) * TILE_CELLS))
+    lat = np.round((gy[mask] + 0.5) * level, 6)
+    lon = np.round((gx[mask] + 0.5) * level, 6)
+    return np.column_stack([lat, lon, arrays["count"][mask]]).tolist()
+
+if __name__ == "__main__":
+    build_pyramid()
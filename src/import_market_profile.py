@@ -0,0 +1,130 @@
+import os
+import time
+import pandas as pd
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+import import_traffic as tr
+import import_weather_station as wx
+
+# ==========================================
+# 夜市詳細頁資料 (Market Profile) - 並行查詢
+# 原本 app.main 依序呼叫 4 個查詢, 每個都要經過 SSH Tunnel 來回一次,
+# 等待時間是「加總」; 改成同時送出, 等待時間接近「最慢的那一個」
+# ==========================================
+
+# 每個查詢的預設逾時秒數 (可由 .env 覆寫)
+QUERY_TIMEOUT = float(os.getenv("PROFILE_QUERY_TIMEOUT", "15"))
+
+# 共用的執行緒池 (查詢大多在等網路 I/O, 用執行緒即可)
+# 連線數由 db_utils 的連線池控管, 這裡的 workers 不需要比連線池大
+_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="market-profile")
+
+# 查詢失敗或逾時時的預設值 (與各函式原本失敗時的回傳一致)
+# 用函式產生, 避免多個使用者共用同一個 DataFrame 物件
+_DEFAULTS = {
+    "station": lambda: (None, 0),
+    "traffic": lambda: {"total": 0, "radius_counts": {}, "top10": pd.DataFrame(), "accidents": pd.DataFrame()},
+}
+
+def _build_tasks(lat, lon, risk_radius_km, detail_radius_km, years=None, hours=None):
+    """
+    定義詳細頁要跑的查詢: 名稱 -> (函式, 參數)
+    事故相關的 3 個查詢 (1km 總數、分類排行、500m 明細) 已合併成 get_market_profile_data,
+    只掃一次索引、只來回一次; 再與氣象站查詢並行
+    """
+    return {
+        "station": (wx.find_nearest_station, (lat, lon)),   # 最近氣象站
+        "traffic": (partial(tr.get_market_profile_data, years=years, hours=hours),
+                    (lat, lon, (detail_radius_km, risk_radius_km), detail_radius_km)),
+    }
+
+def _timed(func, *args):
+    """執行函式並回傳 (結果, 耗時秒數)"""
+    t0 = time.perf_counter()
+    return func(*args), time.perf_counter() - t0
+
+def fetch_market_profile(lat, lon, risk_radius_km=1.0, detail_radius_km=0.5, timeout=None, years=None, hours=None):
+    """
+    同時送出夜市詳細頁需要的所有查詢, 回傳 dict:
+        station, risk_count, top10, accidents: 各查詢結果 (失敗時為預設值)
+        radius_counts: {半徑: 事故數} (0.5km / 1km)
+        errors: {查詢名稱: 錯誤訊息} (只列出失敗或逾時的查詢)
+        elapsed: {查詢名稱: 秒數}, 以及 total 總耗時
+    timeout: 每個查詢的逾時秒數, 可傳數字或 {查詢名稱: 秒數}
+    years / hours: 事故的年度 / 時段篩選 (見 import_traffic.build_time_filter)
+    ⚠️ 逾時的查詢無法從 Python 端中斷, 會在背景跑完後丟棄結果
+    """
+    lat, lon = float(lat), float(lon)
+    tasks = _build_tasks(lat, lon, risk_radius_km, detail_radius_km, years, hours)
+    if not isinstance(timeout, dict):
+        timeout = {name: (QUERY_TIMEOUT if timeout is None else timeout) for name in tasks}
+
+    started = time.perf_counter()
+    futures = {}
+    for name, (func, args) in tasks.items():
+        futures[name] = _executor.submit(_timed, func, *args)
+
+    profile = {"errors": {}, "elapsed": {}}
+    for name, future in futures.items():
+        # 每個查詢從「送出當下」開始計時, 已經等過的時間要扣掉
+        remaining = started + timeout.get(name, QUERY_TIMEOUT) - time.perf_counter()
+        try:
+            result, cost = future.result(timeout=max(remaining, 0))
+            profile[name] = result
+            profile["elapsed"][name] = cost
+        except FutureTimeout:
+            profile[name] = _DEFAULTS[name]()
+            profile["errors"][name] = f"逾時 (> {timeout.get(name, QUERY_TIMEOUT):.0f}s)"
+        except Exception as e:
+            profile[name] = _DEFAULTS[name]()
+            profile["errors"][name] = str(e)
+
+    # 攤平成詳細頁使用的欄位
+    traffic = profile.pop("traffic")
+    # 風險指標優先使用夜市風險表 (與 get_zone_stats 一致), 沒有才用即時查詢的結果
+    # 風險表是全部年度 / 時段的總數, 有篩選時只能用即時查詢的結果
+    filtered = years is not None or hours is not None
+    precomputed = None if filtered else tr.get_precomputed_zone_stats(lat, lon, risk_radius_km)
+    profile["risk_count"] = precomputed if precomputed is not None else traffic["radius_counts"].get(float(risk_radius_km), 0)
+    profile["top10"] = traffic["top10"]
+    profile["accidents"] = traffic["accidents"]
+    profile["radius_counts"] = traffic["radius_counts"]
+
+    profile["elapsed"]["total"] = time.perf_counter() - started
+    if profile["errors"]:
+        print(f"[警告] 夜市詳細資料部分失敗: {profile['errors']}")
+    return profile
+
+def warm_market_profile(lat, lon, risk_radius_km=1.0, detail_radius_km=0.5):
+    """
+    預熱單一夜市的詳細頁快取: 與 fetch_market_profile 送出相同的查詢 (相同參數 = 相同快取 key),
+    但在呼叫端的執行緒依序執行, 不佔用上面給使用者的共用執行緒池
+    回傳 {查詢名稱: 錯誤訊息} (只列出失敗的查詢; 失敗的結果不會被快取)
+    """
+    errors = {}
+    tasks = _build_tasks(float(lat), float(lon), risk_radius_km, detail_radius_km)
+    for name, (func, args) in tasks.items():
+        try:
+            result = func(*args)
+        except Exception as e:
+            errors[name] = str(e)
+            continue
+        if name == "station" and result[0] is None:
+            errors[name] = "找不到測站"
+        elif name == "traffic" and not result["radius_counts"]:
+            errors[name] = "事故查詢失敗"
+    return errors
+
+# ==========================================
+# 測試程式
+# ==========================================
+if __name__ == "__main__":
+    # 模擬士林夜市座標
+    shilin_lat, shilin_lon = 25.088, 121.524
+    profile = fetch_market_profile(shilin_lat, shilin_lon)
+
+    print(f"1km 事故總數: {profile['risk_count']}")
+    print(f"500m 事故明細: {len(profile['accidents'])} 筆")
+    print(f"錯誤: {profile['errors'] or '無'}")
+    for name, cost in profile["elapsed"].items():
+        print(f"  {name:10s} {cost:.2f}s")
@@ -3,11 +3,14 @@ import os
 import ast
 from shapely.geometry import Point, MultiPoint
 from db_utils import get_db_engine
+import data_version as dv      # 資料來源版本 token (快取失效用)
+from data_cache import cached   # 共用資料快取 (請求合併 + LRU)
 
 # ==========================================
 # 1. 資料讀取
 # ==========================================
 
+@cached(persist=True, version=lambda: dv.source_version("nightmarkets"))   # 夜市表有異動才重新讀取
 def load_clean_market_df(source="mysql", csv_path="night_market_data.csv"):
     """
     :param source: 'mysql' (預設) 或 'csv'
@@ -1,15 +1,183 @@
+import os
+import math
 import pandas as pd
 import folium
 from sqlalchemy import text
-from folium.plugins import MarkerCluster, HeatMap
 import import_weather_station as wx # 事故模組需要用到氣象站資料
+import market_risk                  # 預先計算好的夜市風險表 (build_market_risk.py 產生)
+import heatmap_pyramid              # 預先聚合好的多解析度熱力圖 (heatmap_pyramid.py 產生)
+import accident_store               # 本機欄式儲存 + 格網空間索引 (accident_store.py 匯出)
+import accident_cube                # 時間維度聚合 Cube (年度 / 時段篩選的熱力圖, accident_cube.py 產生)
+import accident_clusters            # 事故點位 階層式聚合索引 (accident_clusters.py 產生)
+import map_layers                   # 向量化 GeoJSON / FastMarkerCluster 點位圖層
+import data_version as dv            # 資料來源版本 token (快取失效用)
+from data_cache import cached, round_coord, round_radius, round_bounds   # 共用資料快取 (請求合併 + LRU)
 from db_utils import get_db_engine  # 引入統一的連線工具 (會自動處理 SSH Tunnel)
 
+# ==========================================
+# 0. 空間索引模式 (Spatial Mode, 選用)
+# ==========================================
+# .env 設定 ACCIDENT_SPATIAL_MODE=1 且資料表已執行 migrate_spatial_index.py 時,
+# 半徑查詢改用 SPATIAL 索引 (MBRContains) + 球面距離 (ST_Distance_Sphere) 算「真正的圓」;
+# 否則沿用原本的 BETWEEN 方框
+SPATIAL_MODE = os.getenv("ACCIDENT_SPATIAL_MODE", "0") == "1"
+SPATIAL_COLUMN = "geo_point"   # POINT SRID 4326 欄位名稱
+_spatial_available = None      # 欄位是否存在 (第一次查詢時檢查, 之後沿用)
+
+# .env 設定 ACCIDENT_LOCAL_MODE=1 且已匯出欄式儲存時, 半徑查詢改由本機格網空間索引回答 (不經過資料庫)
+# 範圍判斷與上面一致: 空間索引模式為圓形, 否則為 BETWEEN 方框
+LOCAL_MODE = os.getenv("ACCIDENT_LOCAL_MODE", "0") == "1"
+
+def accident_version():
+    """
+    事故資料的快取版本: 資料庫的版本 token (每分鐘最多查一次) + 本機預先計算檔案的版本
+    匯入新資料 / 重建欄式儲存、Cube、金字塔、風險表後自動換 key, 沒變就一直命中
+    """
+    return (dv.source_version("accidents"), accident_store.data_version(), accident_cube.data_version(),
+            accident_clusters.data_version(), heatmap_pyramid.data_version(), market_risk.data_version())
+
+def use_local_store():
+    return LOCAL_MODE and accident_store.is_available()
+
+def local_radius_mode():
+    return "circle" if SPATIAL_MODE else "box"
+
+def is_spatial_enabled(engine):
+    """是否使用空間索引模式: 必須同時開啟設定, 且 accident_main 已有 geo_point 欄位"""
+    global _spatial_available
+    if not SPATIAL_MODE:
+        return False
+    if _spatial_available is None:
+        sql = text("""
+        SELECT COUNT(*) FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA = 'test_db' AND TABLE_NAME = 'accident_main' AND COLUMN_NAME = :col
+        """)
+        try:
+            with engine.connect() as conn:
+                _spatial_available = bool(conn.execute(sql, {"col": SPATIAL_COLUMN}).scalar())
+        except Exception as e:
+            print(f"[警告] 檢查空間欄位失敗: {e}")
+            return False
+        if not _spatial_available:
+            print(f"[警告] accident_main 沒有 {SPATIAL_COLUMN} 欄位, 改用 BETWEEN 方框查詢 (請先執行 migrate_spatial_index.py)")
+    return _spatial_available
+
+def build_radius_filter(center_lat, center_lon, radius_km, spatial=False, suffix=""):
+    """
+    產生半徑查詢的 WHERE 條件與參數, 回傳 (where_sql, params)
+    - spatial=False: 正方形 BETWEEN 方框 (經緯度都用 radius_km / 111)
+    - spatial=True : 先用 MBRContains 走 SPATIAL 索引篩出外接矩形 (經度依 cos(緯度) 放寬),
+                     再用 ST_Distance_Sphere 精確判斷是否在圓內
+    suffix: 加在參數名稱後面, 同一個查詢裡有多個半徑條件時用來區分 (例如 "_d")
+    """
+    dlat = radius_km / 111.0
+    if not spatial:
+        where = (f"latitude BETWEEN :min_lat{suffix} AND :max_lat{suffix} "
+                 f"AND longitude BETWEEN :min_lon{suffix} AND :max_lon{suffix}")
+        params = {
+            f"min_lat{suffix}": center_lat - dlat, f"max_lat{suffix}": center_lat + dlat,
+            f"min_lon{suffix}": center_lon - dlat, f"max_lon{suffix}": center_lon + dlat}
+        return where, params
+
+    # 經度 1 度的長度會隨緯度縮短 (台灣約 0.91 倍), 外接矩形要跟著放寬
+    dlon = radius_km / (111.0 * math.cos(math.radians(center_lat)))
+    min_lon, max_lon = center_lon - dlon, center_lon + dlon
+    min_lat, max_lat = center_lat - dlat, center_lat + dlat
+    # WKT 一律用 (經度 緯度) 順序, 搭配 axis-order=long-lat 避免 SRID 4326 預設的 (緯度 經度) 混淆
+    bbox_wkt = (f"POLYGON(({min_lon} {min_lat}, {max_lon} {min_lat}, {max_lon} {max_lat}, "
+                f"{min_lon} {max_lat}, {min_lon} {min_lat}))")
+    where = (f"MBRContains(ST_GeomFromText(:bbox{suffix}, 4326, 'axis-order=long-lat'), {SPATIAL_COLUMN}) "
+             f"AND ST_Distance_Sphere({SPATIAL_COLUMN}, "
+             f"ST_GeomFromText(:center{suffix}, 4326, 'axis-order=long-lat')) <= :radius_m{suffix}")
+    params = {f"bbox{suffix}": bbox_wkt, f"center{suffix}": f"POINT({center_lon} {center_lat})",
+              f"radius_m{suffix}": radius_km * 1000}
+    return where, params
+
+def build_time_filter(years=None, hours=None):
+    """
+    產生年度 / 時段篩選的 WHERE 條件 (開頭已含 AND, 可直接接在其他條件後面), 回傳 (where_sql, params)
+    years / hours 為 (起, 迄) 含頭含尾; hours 起 > 迄 時代表跨越午夜 (例如 (22, 2))
+    沒有篩選時回傳 ("", {})
+    """
+    clauses, params = [], {}
+    if years is not None:
+        clauses.append("accident_year BETWEEN :year_from AND :year_to")
+        params.update(year_from=int(years[0]), year_to=int(years[1]))
+    if hours is not None:
+        op = "AND" if hours[0] <= hours[1] else "OR"
+        clauses.append(f"(accident_hour >= :hour_from {op} accident_hour <= :hour_to)")
+        params.update(hour_from=int(hours[0]), hour_to=int(hours[1]))
+    return "".join(f"\n      AND {c}" for c in clauses), params
+
+@cached(version=accident_version)
+def get_accident_year_range():
+    """事故資料的年度範圍 (最早, 最晚), 給側邊欄的年度篩選用; 查詢失敗時回傳 None"""
+    for source in (accident_cube.year_range, accident_store.year_range):
+        years = source()
+        if years: return years
+
+    engine = get_db_engine()
+    if not engine: return None
+    sql = text("SELECT MIN(accident_year), MAX(accident_year) FROM test_db.accident_main WHERE accident_year > 0")
+    try:
+        with engine.connect() as conn:
+            low, high = conn.execute(sql).one()
+        return (int(low), int(high)) if low is not None else None
+    except Exception as e:
+        print(f"[錯誤] 查詢事故年度範圍失敗: {e}")
+        return None
+
 # ==========================================
 # 1. 全台車禍圖層 
 # ==========================================
+# 個別事故的 Popup 版面 (聚合圖層共用)
+ACCIDENT_POPUP = """<div style="font-family: Arial; width: 150px;">
+    <b>時間:</b> {accident_datetime}<br>
+    <b>狀況:</b> {weather_condition}
+</div>"""
+
+def get_sample_accidents(limit=2000):
+    """
+    沒有聚合索引時的備用點位: 任意 limit 筆事故 (經緯度已清洗、只保留台灣範圍)
+    查詢失敗時回傳空的 DataFrame
+    """
+    engine = get_db_engine()
+    if not engine: return pd.DataFrame(columns=['longitude', 'latitude', 'accident_datetime', 'weather_condition'])
+    query = text(f"""
+    SELECT 
+        m.longitude, 
+        m.latitude, 
+        m.accident_datetime,  -- [修改] 改用 index 8 的完整時間格式
+        m.weather_condition,  -- [修改] 改用 index 11 (暫時替代地點)
+        m.accident_id
+    FROM test_db.accident_main m
+    WHERE m.longitude IS NOT NULL 
+      AND m.latitude IS NOT NULL
+    LIMIT {int(limit)}
+    """)
+    try:
+        # 使用 Pandas 讀取
+        with engine.connect() as conn:
+            df = pd.read_sql(query, conn)
+    except Exception as e:
+        print(f"[錯誤] 讀取事故點位失敗: {e}")
+        return pd.DataFrame(columns=['longitude', 'latitude', 'accident_datetime', 'weather_condition'])
 
-def get_traffic_layers():
+    # --- 資料清洗 (ETL) ---
+    df = df.dropna(subset=['longitude', 'latitude']) # 移除空座標
+    
+    #   確保經緯度為數值型態
+    df['longitude'] = pd.to_numeric(df['longitude'], errors='coerce')
+    df['latitude'] = pd.to_numeric(df['latitude'], errors='coerce')
+    
+    # 地理圍欄過濾 (Geofencing)：只保留台灣範圍內的資料, 排除誤植的極端值
+    df = df[
+        (df['longitude'] > 118) & (df['longitude'] < 127) & 
+        (df['latitude'] > 20) & (df['latitude'] < 27)]
+    print(f"--- [系統] 成功從 accident_main 取得 {len(df)} 筆資料 ---")
+    return df
+
+def get_traffic_layers(bounds=None, zoom=None):
     """
     - 資料來源：已遷移至 MYSQL 資料表 `test_db.accident_main`。
     - 欄位變更 (Schema Change): 
@@ -19,98 +187,56 @@ def get_traffic_layers():
     1. 車禍點位 (Cluster)
     2. 車禍熱力圖 (Heatmap)
     3. 氣象觀測站 (Stations) [新增]
+    - 聚合圖層: 有階層式聚合索引時改用伺服器端聚合 (全部事故, 只取 bounds / zoom 看得到的聚合點),
+      預設為全島範圍; 沒有索引時才查詢 LIMIT 2000 筆做瀏覽器端聚合
+    - 熱力圖層: 與主熱力圖相同的格網資料 (金字塔 / Cube / GROUP BY, 見 get_taiwan_heatmap_data), 不是任意 2000 筆
     """
     print("--- 正在呼叫 MySQL 抓取全台車禍資料 (via SSH Tunnel) ---")
     engine = get_db_engine()
     if not engine:
         return None, None, None 
-    query = """
-    SELECT 
-        m.longitude, 
-        m.latitude, 
-        m.accident_datetime,  -- [修改] 改用 index 8 的完整時間格式
-        m.weather_condition,  -- [修改] 改用 index 11 (暫時替代地點)
-        m.accident_id
-    FROM test_db.accident_main m
-    WHERE m.longitude IS NOT NULL 
-      AND m.latitude IS NOT NULL
-    LIMIT 2000
-    """
 
     # 抓取測站資料
     print("--- [系統] 讀取氣象觀測站資料 ---")
     df_stations = wx.get_all_stations(engine=engine) # 傳入已建立的 engine 以共用連線
 
     try:
-        # 使用 Pandas 讀取
-        with engine.connect() as conn:
-            df = pd.read_sql(query, conn)
-        
-        # --- 資料清洗 (ETL) ---
-        df = df.dropna(subset=['longitude', 'latitude']) # 移除空座標
-        
-        #   確保經緯度為數值型態
-        df['longitude'] = pd.to_numeric(df['longitude'], errors='coerce')
-        df['latitude'] = pd.to_numeric(df['latitude'], errors='coerce')
-        
-        # 地理圍欄過濾 (Geofencing)：只保留台灣範圍內的資料, 排除誤植的極端值
-        df = df[
-            (df['longitude'] > 118) & (df['longitude'] < 127) & 
-            (df['latitude'] > 20) & (df['latitude'] < 27)]
-        print(f"--- [系統] 成功從 accident_main 取得 {len(df)} 筆資料 ---")
-
         # --- 製作圖層 ---
+        # 點位圖層都用 map_layers 一次轉換整個 DataFrame (不逐列建立 folium 物件), Popup 版面只輸出一次
         # 1. 聚合圖層 
-        # 運用 Folium 的 MarkerCluster 功能, 可自動將密集點位聚合
         # 用途：縮小地圖時, 不會看到滿滿的圖釘, 而是看到數字 (如: 50), 點擊後散開。
-        fg_cluster = folium.FeatureGroup(name="🚗 車禍詳細點位", show=False)
-        cluster = MarkerCluster().add_to(fg_cluster)
-
-        for _, row in df.iterrows():
-            time_str = str(row['accident_datetime'])
-            info_str = str(row['weather_condition'])
-            
-            popup_html = f"""
-            <div style="font-family: Arial; width: 150px;">
-                <b>時間:</b> {time_str}<br>
-                <b>狀況:</b> {info_str}
-            </div>
-            """
-            
-            folium.Marker(
-                location=[row['latitude'], row['longitude']],
-                popup=folium.Popup(popup_html, max_width=200),
-                icon=folium.Icon(color='red', icon='exclamation-sign')
-            ).add_to(cluster)
-
-        # 2. 熱力圖層 (Heatmap)
+        df_clusters = get_accident_clusters(bounds, zoom)
+        if df_clusters is not None:
+            fg_cluster = map_layers.cluster_view_layer(
+                df_clusters, "🚗 車禍詳細點位", popup=ACCIDENT_POPUP, show=False)
+        else:
+            # 沒有聚合索引: 取 2000 筆, 運用 FastMarkerCluster 由瀏覽器端聚合
+            df = get_sample_accidents()
+            fg_cluster = map_layers.cluster_layer(
+                df, "🚗 車禍詳細點位", lat='latitude', lon='longitude', show=False, popup=ACCIDENT_POPUP,
+                icon={"icon": "exclamation-sign", "markerColor": "red"})
+
+        # 2. 熱力圖層 (Heatmap): 全部事故的格網 [[緯度, 經度, 事故數], ...]
         fg_heat = folium.FeatureGroup(name="🔥 車禍熱點分析", show=False)
-        heat_data = [[row['latitude'], row['longitude']] for _, row in df.iterrows()]
+        heat_data = get_taiwan_heatmap_data(zoom)
         
         if heat_data:
-            HeatMap(heat_data, radius=12, blur=18, 
-                    gradient={0.4: 'blue', 0.65: 'lime', 1: 'red'}).add_to(fg_heat)
+            map_layers.CompactHeatMap(heat_data, radius=12, blur=18, weight_scale=1,   # 權重是事故數 (整數)
+                                      gradient={0.4: 'blue', 0.65: 'lime', 1: 'red'}).add_to(fg_heat)
 
         # 3. 氣象觀測站圖層 [新增]
-        fg_stations = folium.FeatureGroup(name="☁️ 氣象觀測站", show=True) # 預設開啟
         if not df_stations.empty:
-            for _, row in df_stations.iterrows():
-                
-                # 建立彈出視窗內容
-                station_popup = f"""
-                <div style="width:150px; font-family:Arial;">
-                    <b>測站:</b> {row['Station_name']}<br>
-                    <b>ID:</b> {row['Station_ID']}<br>
-                    <small>({row['latitude']:.3f}, {row['longitude']:.3f})</small>
-                </div>
-                """
-               
-                folium.Marker(
-                    location=[row['latitude'], row['longitude']],
-                    popup=folium.Popup(station_popup, max_width=200),
-                    # 使用藍色雲朵圖示來區分
-                    icon=folium.Icon(color='blue', icon='cloud', prefix='fa')
-                ).add_to(fg_stations)
+            df_stations = df_stations.assign(lat3=df_stations['latitude'].round(3), lon3=df_stations['longitude'].round(3))
+        fg_stations = map_layers.point_layer(
+            df_stations, "☁️ 氣象觀測站", lat='latitude', lon='longitude', show=True, max_width=200, # 預設開啟
+            # 使用藍色雲朵圖示來區分
+            marker=folium.Marker(icon=folium.Icon(color='blue', icon='cloud', prefix='fa')),
+            popup="""<div style="width:150px; font-family:Arial;">
+                <b>測站:</b> {Station_name}<br>
+                <b>ID:</b> {Station_ID}<br>
+                <small>({lat3}, {lon3})</small>
+            </div>""")
+        if not df_stations.empty:
             print(f"--- [系統] 已繪製 {len(df_stations)} 個觀測站 ---")
 
 
@@ -123,28 +249,37 @@ def get_traffic_layers():
 # ==========================================
 # 2. 區域統計分析 (Zone Statistics)
 # ==========================================
-def get_zone_stats(center_lat, center_lon, radius_km=1.0):
+@cached(normalize={"center_lat": round_coord, "center_lon": round_coord, "radius_km": round_radius},
+        skip=lambda n: not n, persist=True, version=accident_version)   # 查詢失敗時回傳 0, 無法與「真的沒有事故」區分, 0 一律不快取
+def get_zone_stats(center_lat, center_lon, radius_km=1.0, years=None, hours=None):
     """
     【新功能】計算指定半徑範圍內的車禍總數
     改用 pd.read_sql 以確保參數傳遞的穩定性。
+    夜市座標優先讀取夜市風險表 (build_market_risk.py 預先計算), 其他座標才即時查詢。
+    years / hours: 年度 / 時段篩選 (見 build_time_filter); 有篩選時不使用夜市風險表 (風險表是全部年度)
     """
+    # 先查預先計算好的夜市風險表 (O(1)), 查不到 (非夜市座標或未計算的半徑) 才即時查詢
+    if years is None and hours is None:
+        precomputed = get_precomputed_zone_stats(center_lat, center_lon, radius_km)
+        if precomputed is not None: return precomputed
+    if use_local_store():
+        return accident_store.get_zone_stats(center_lat, center_lon, radius_km, mode=local_radius_mode(),
+                                             years=years, hours=hours)
+
     engine = get_db_engine()
     if not engine: return 0
 
-    # 1度約等於 111km
-    offset = radius_km / 111.0
+    # 半徑條件: 空間索引模式為真正的圓, 否則為 BETWEEN 方框 (1度約等於 111km)
+    where, params = build_radius_filter(center_lat, center_lon, radius_km, is_spatial_enabled(engine))
+    time_where, time_params = build_time_filter(years, hours)
+    params.update(time_params)
 
     # SQL: 只計算總數
-    sql = text("""
+    sql = text(f"""
     SELECT COUNT(*) as total_accidents
     FROM test_db.accident_main
-    WHERE latitude BETWEEN :min_lat AND :max_lat
-      AND longitude BETWEEN :min_lon AND :max_lon
+    WHERE {where}{time_where}
     """)
-    
-    params = {
-        "min_lat": center_lat - offset, "max_lat": center_lat + offset,
-        "min_lon": center_lon - offset, "max_lon": center_lon + offset}
 
     try:
         with engine.connect() as conn:
@@ -160,18 +295,34 @@ def get_zone_stats(center_lat, center_lon, radius_km=1.0):
         print(f"[錯誤] 統計區域車禍失敗: {e}")
         return 0
     
+def get_precomputed_zone_stats(center_lat, center_lon, radius_km=1.0):
+    """
+    從夜市風險表查詢事故數, 查不到回傳 None
+    計算方式需與目前的半徑模式相同; 事故資料有新的匯入 (版本不同) 時也不使用, 直到風險表重算
+    """
+    engine = get_db_engine() if SPATIAL_MODE else None
+    mode = "spatial" if engine and is_spatial_enabled(engine) else "box"
+    return market_risk.lookup_zone_count(center_lat, center_lon, radius_km, mode,
+                                         dv.current_data_version("accidents"))
+
 # ==========================================
 # 3. 周邊熱點排行 (Top 10 Breakdown)
 # ==========================================
 
+@cached(normalize={"center_lat": round_coord, "center_lon": round_coord, "radius_km": round_radius},
+        persist=True, version=accident_version)
 def get_nearby_top10(center_lat, center_lon, radius_km=1.0):
     """
     查詢範圍內的車禍分類排行
     """
+    if use_local_store():
+        return accident_store.get_nearby_top10(center_lat, center_lon, radius_km, mode=local_radius_mode())
+
     engine = get_db_engine()
     if not engine: return pd.DataFrame()
 
-    offset = radius_km / 111.0
+    # 半徑條件: 空間索引模式為真正的圓, 否則為 BETWEEN 方框 (同 get_zone_stats)
+    where, params = build_radius_filter(center_lat, center_lon, radius_km, is_spatial_enabled(engine))
 
     # [已取代]
     # 原本是 Group By 路段 (accident_location)
@@ -186,27 +337,17 @@ def get_nearby_top10(center_lat, center_lon, radius_km=1.0):
     # 2. longitude -> lon
     # 3. weather_condition (或其他欄位) -> 路段 (暫時替代，讓畫面有東西)
     
-    sql = text("""
+    sql = text(f"""
     SELECT 
         latitude as lat,
         longitude as lon,
         weather_condition as 路段,  -- 暫時用天氣當作路段顯示 (因為目前資料庫可能沒路段欄位)
         1 as 事故數                 -- 每筆算 1 次
     FROM test_db.accident_main
-    WHERE latitude BETWEEN :min_lat AND :max_lat
-      AND longitude BETWEEN :min_lon AND :max_lon
+    WHERE {where}
     LIMIT 10
     """)
 
-     # 定義查詢邊界 params是安全網，確保要查詢的「數值」能精確地填入 SQL 的「空位」中
-    # min_lat, max_lat, min_lon, max_lon 分別代表查詢矩形的四個邊界 (台灣範圍內)   
-    params = {
-        "min_lat": center_lat - offset, # 緯度往南減少
-        "max_lat": center_lat + offset, # 緯度往北增加
-        "min_lon": center_lon - offset, # 經度往西減少
-        "max_lon": center_lon + offset  # 經度往東增加
-    }
-
     try:
         with engine.connect() as conn:
             return pd.read_sql(sql, conn, params=params)
@@ -268,32 +409,49 @@ if __name__ == "__main__":
 # ==========================================
 # 5. 全台概覽優化 (Grid Aggregation)
 # ==========================================
-def get_taiwan_heatmap_data():
+@cached(persist=True, version=accident_version,   # 最重的全台 GROUP BY: 重新啟動後直接讀磁碟層
+        skip=lambda cells: not cells)               # 查詢失敗時回傳 [], 不快取 (也不寫入磁碟層)
+def get_taiwan_heatmap_data(zoom=None, years=None, hours=None):
     """
     [針對全台概覽的優化]
     不抓取 150 萬筆明細，而是讓資料庫「算好」每個格子的車禍數量。
     使用 ROUND(lat, 2) 大約是 1.1km 的方格。
+    [金字塔] 若已執行 heatmap_pyramid.py, 直接讀取預先聚合的檔案, 並依地圖 zoom 挑選格子大小;
+    檔案不存在時才即時跑 GROUP BY
+    [年度 / 時段篩選] 有篩選時改從聚合 Cube 切片 (accident_cube.py), 沒有 Cube 才在 GROUP BY 加上條件
     """
+    if years is None and hours is None:
+        cells = heatmap_pyramid.get_heatmap_cells(zoom)
+    else:
+        taiwan = heatmap_pyramid.TAIWAN_BOUNDS
+        cells = accident_cube.heatmap_cells(
+            heatmap_pyramid.level_for_zoom(zoom),
+            (taiwan["min_lat"], taiwan["min_lon"], taiwan["max_lat"], taiwan["max_lon"]),
+            years=years, hours=hours)
+    if cells is not None:
+        return cells
+
     engine = get_db_engine()
     if not engine: return []
 
     # MYSQL：移除LIMIT限制，改用 GROUP BY
     # 回傳的資料量會從 150萬筆 -> 縮減成 1~2萬個「格子」
-    sql = text("""
+    time_where, time_params = build_time_filter(years, hours)
+    sql = text(f"""
     SELECT 
         ROUND(latitude, 2) as lat, 
         ROUND(longitude, 2) as lon, 
         COUNT(*) as count 
     FROM test_db.accident_main
     WHERE latitude BETWEEN 21 AND 26 
-      AND longitude BETWEEN 119 AND 122
+      AND longitude BETWEEN 119 AND 122{time_where}
     GROUP BY ROUND(latitude, 2), ROUND(longitude, 2)
     """)
     
     try:
         print("--- [系統] 正在聚合全台 150 萬筆資料 (Grid Mode) ---")
         with engine.connect() as conn:
-            df = pd.read_sql(sql, conn)
+            df = pd.read_sql(sql, conn, params=time_params)
             
         # 轉換成 HeatMap 需要的格式 [[lat, lon, weight], ...]
         return df[['lat', 'lon', 'count']].values.tolist()
@@ -302,22 +460,68 @@ def get_taiwan_heatmap_data():
         print(f"[Error] 全台聚合失敗: {e}")
         return []
 
+@cached(version=accident_version, skip=lambda cells: not cells)   # 查詢失敗時回傳 [], 不快取
+def get_heatmap_tile(level, ty, tx, years=None, hours=None):
+    """
+    [可視範圍] 回傳單一切片內的熱力圖格子 [[lat, lon, count], ...]
+    優先讀取熱力圖金字塔 (有年度 / 時段篩選時改用聚合 Cube); 都沒有時只對該切片範圍跑 GROUP BY (走 idx_lat_lon)
+    """
+    if years is None and hours is None:
+        cells = heatmap_pyramid.get_tile_cells(level, ty, tx)
+    else:
+        cells = accident_cube.tile_cells(level, ty, tx, years=years, hours=hours)
+    if cells is not None:
+        return cells
+
+    engine = get_db_engine()
+    if not engine: return []
+
+    south, west, north, east = heatmap_pyramid.tile_bounds(level, ty, tx)
+    time_where, time_params = build_time_filter(years, hours)
+    sql = text(f"""
+    SELECT 
+        (FLOOR(latitude / {level}) + 0.5) * {level} as lat, 
+        (FLOOR(longitude / {level}) + 0.5) * {level} as lon, 
+        COUNT(*) as count 
+    FROM test_db.accident_main
+    WHERE latitude >= :south AND latitude < :north
+      AND longitude >= :west AND longitude < :east{time_where}
+    GROUP BY FLOOR(latitude / {level}), FLOOR(longitude / {level})
+    """)
+    try:
+        with engine.connect() as conn:
+            df = pd.read_sql(sql, conn, params={"south": south, "north": north, "west": west, "east": east,
+                                                **time_params})
+        return df[['lat', 'lon', 'count']].astype(float).values.tolist()
+    except Exception as e:
+        print(f"[Error] 切片聚合失敗: {e}")
+        return []
+
 # ==========================================
 # 6. 單點詳細搜尋 (Local Details)
 # ==========================================
-def get_nearby_accidents_data(center_lat, center_lon, radius_km=0.5):
+@cached(normalize={"center_lat": round_coord, "center_lon": round_coord, "radius_km": round_radius},
+        persist=True, version=accident_version)
+def get_nearby_accidents_data(center_lat, center_lon, radius_km=0.5, years=None, hours=None):
     """
     [詳細模式] 抓取指定半徑內的所有事故詳細資料
     用於畫地圖上的藍色小點點、製作右側的統計表格
+    years / hours: 年度 / 時段篩選 (見 build_time_filter)
     """
+    if use_local_store():
+        return accident_store.get_nearby_accidents_data(center_lat, center_lon, radius_km, mode=local_radius_mode(),
+                                                        years=years, hours=hours)
+
     engine = get_db_engine()
     if not engine: return pd.DataFrame()
 
-    offset = radius_km / 111.0
+    where, params = build_radius_filter(center_lat, center_lon, radius_km, is_spatial_enabled(engine))
+    time_where, time_params = build_time_filter(years, hours)
+    params.update(time_params)
     
     # 🟢 針對單點的 SQL (詳細資料)
     # 必須包含 death_count, injury_count, accident_year 等欄位，統計表才畫得出來
-    sql = text("""
+    sql = text(f"""
     SELECT 
         latitude as lat,
         longitude as lon,
@@ -327,20 +531,144 @@ def get_nearby_accidents_data(center_lat, center_lon, radius_km=0.5):
         death_count,          -- 統計表需要
         injury_count          -- 統計表需要
     FROM test_db.accident_main
-    WHERE latitude BETWEEN :min_lat AND :max_lat
-      AND longitude BETWEEN :min_lon AND :max_lon
+    WHERE {where}{time_where}
     ORDER BY accident_datetime DESC
     LIMIT 800  -- 限制數量避免瀏覽器卡死
     """)
-    
-    params = {
-        "min_lat": center_lat - offset, "max_lat": center_lat + offset,
-        "min_lon": center_lon - offset, "max_lon": center_lon + offset
-    }
 
     try:
         with engine.connect() as conn:
             return pd.read_sql(sql, conn, params=params)
     except Exception as e:
         print(f"[Error] 查詢詳細事故失敗: {e}")
-        return pd.DataFrame()
\ No newline at end of file
+        return pd.DataFrame()
+
+# ==========================================
+# 7. 夜市綜合查詢 (Market Profile, 單次來回)
+# ==========================================
+@cached(normalize={"center_lat": round_coord, "center_lon": round_coord,
+                   "radii_km": round_radius, "detail_radius_km": round_radius},
+        skip=lambda r: not r["radius_counts"], persist=True, version=accident_version)   # 查詢失敗時 radius_counts 為空, 不快取
+def get_market_profile_data(center_lat, center_lon, radii_km=(0.5, 1.0), detail_radius_km=0.5,
+                            top_n=10, detail_limit=800, years=None, hours=None):
+    """
+    [詳細模式] 一次查詢取代 get_zone_stats + get_nearby_top10 + get_nearby_accidents_data
+    - 只對最大半徑做一次索引範圍掃描 (CTE), 再從中切出:
+      (半徑條件同 get_zone_stats: 空間索引模式為真正的圓, 否則為 BETWEEN 方框)
+        1. 各半徑的事故數 (例如 0.5km / 1km)
+        2. 天氣分類排行 (Top N)
+        3. 小半徑內最新的事故明細 (LIMIT detail_limit)
+    - 三種結果用 UNION ALL 合併成一個結果集, 以 kind 欄位區分, 只需一次 SSH Tunnel 來回
+    - years / hours: 年度 / 時段篩選 (見 build_time_filter), 加在 CTE 的條件裡
+    回傳 dict: total, radius_counts {半徑: 數量}, top10 (路段/事故數), accidents (同 get_nearby_accidents_data)
+    """
+    if use_local_store():
+        return accident_store.get_market_profile_data(center_lat, center_lon, radii_km, detail_radius_km,
+                                                      top_n, detail_limit, mode=local_radius_mode(),
+                                                      years=years, hours=hours)
+
+    result = {"total": 0, "radius_counts": {}, "top10": pd.DataFrame(), "accidents": pd.DataFrame()}
+    engine = get_db_engine()
+    if not engine: return result
+
+    radii_km = sorted(set(radii_km) | {detail_radius_km})
+    outer_km = radii_km[-1]
+
+    spatial = is_spatial_enabled(engine)
+    where, params = build_radius_filter(center_lat, center_lon, outer_km, spatial)
+    detail_where, detail_params = build_radius_filter(center_lat, center_lon, detail_radius_km, spatial, "_d")
+    params.update(detail_params)
+    time_where, time_params = build_time_filter(years, hours)
+    params.update(time_params)
+
+    # 各半徑的計數: 在已經篩好的範圍內再比一次條件, 不會再掃一次索引
+    radius_parts = []
+    for i, r in enumerate(radii_km):
+        radius_where, radius_params = build_radius_filter(center_lat, center_lon, r, spatial, f"_{i}")
+        params.update(radius_params)
+        params[f"r_{i}"] = str(r)
+        radius_parts.append(f"""
+    SELECT 'radius' AS kind, :r_{i} AS category,
+           SUM({radius_where}) AS n,
+           NULL AS lat, NULL AS lon, NULL AS accident_hour, NULL AS accident_year,
+           NULL AS death_count, NULL AS injury_count
+    FROM box""")
+
+    sql = text(f"""
+    WITH box AS (
+        SELECT latitude, longitude, weather_condition, accident_hour, accident_year,
+               death_count, injury_count, accident_datetime{f", {SPATIAL_COLUMN}" if spatial else ""}
+        FROM test_db.accident_main
+        WHERE {where}{time_where}
+    )
+    {"    UNION ALL".join(radius_parts)}
+    UNION ALL
+    (SELECT 'top' AS kind, weather_condition, COUNT(*), NULL, NULL, NULL, NULL, NULL, NULL
+     FROM box
+     GROUP BY weather_condition
+     ORDER BY COUNT(*) DESC
+     LIMIT {int(top_n)})
+    UNION ALL
+    (SELECT 'detail' AS kind, weather_condition, NULL, latitude, longitude,
+            accident_hour, accident_year, death_count, injury_count
+     FROM box
+     WHERE {detail_where}
+     ORDER BY accident_datetime DESC
+     LIMIT {int(detail_limit)})
+    """)
+
+    try:
+        with engine.connect() as conn:
+            df = pd.read_sql(sql, conn, params=params)
+
+        # --- 依 kind 拆回三種結果 ---
+        df_radius = df[df['kind'] == 'radius']
+        radius_counts = {
+            float(r): int(n or 0) for r, n in zip(df_radius['category'], df_radius['n'])}
+
+        df_top = df[df['kind'] == 'top']
+        top10 = pd.DataFrame({
+            '路段': df_top['category'].values,           # 暫時用天氣當作路段顯示 (同 get_nearby_top10)
+            '事故數': df_top['n'].fillna(0).astype(int).values})
+
+        # UNION 之後欄位混有 NULL, 型態要轉回跟 get_nearby_accidents_data 一致 (統計表用年份/時段分組)
+        # 原始資料的時段 / 傷亡數可能是 NULL, 先補 0 再轉 int, 否則整筆結果都會失敗
+        int_cols = ['accident_hour', 'accident_year', 'death_count', 'injury_count']
+        df_detail = df[df['kind'] == 'detail'].rename(columns={'category': 'weather_condition'})
+        df_detail = df_detail[['lat', 'lon', 'weather_condition'] + int_cols]
+        df_detail = df_detail.fillna({col: 0 for col in int_cols}).astype(
+            {'lat': float, 'lon': float, **{col: int for col in int_cols}})
+    except Exception as e:
+        print(f"[錯誤] 夜市綜合查詢失敗: {e}")
+        return result
+
+    # 全部處理完才寫回 result: 中途失敗時 radius_counts 保持空的, 不會被快取
+    result["radius_counts"] = radius_counts
+    result["total"] = radius_counts.get(float(outer_km), 0)
+    result["top10"] = top10
+    result["accidents"] = df_detail.reset_index(drop=True)
+    return result
+
+# ==========================================
+# 8. 事故點位聚合 (Cluster Index)
+# ==========================================
+@cached(normalize={"bounds": round_bounds}, version=accident_version)
+def get_accident_clusters(bounds=None, zoom=None):
+    """
+    可視範圍內的事故聚合點 / 個別事故 (由 accident_clusters.py 預先建立的階層式索引回答, 不經過資料庫)
+    bounds 未指定時為全島範圍, zoom 未指定時為全島概覽的 8 級
+    回傳 DataFrame (欄位見 accident_clusters.get_clusters); 索引不存在或版本不符時回傳 None
+    """
+    if not accident_clusters.is_available():
+        return None
+    if bounds is None:
+        taiwan = heatmap_pyramid.TAIWAN_BOUNDS
+        bounds = (taiwan["min_lat"], taiwan["min_lon"], taiwan["max_lat"], taiwan["max_lon"])
+    zoom = 8 if zoom is None else zoom
+    try:
+        df = accident_clusters.get_clusters(bounds, zoom)
+        print(f"--- [系統] 事故聚合點 zoom {zoom}: {len(df)} 個 ({int(df['count'].sum()):,} 筆事故) ---")
+        return df
+    except Exception as e:
+        print(f"[錯誤] 事故聚合查詢失敗: {e}")
+        return None
@@ -1,9 +1,11 @@
+import math
+import pandas as pd
 import streamlit as st
 import folium
-from folium.plugins import HeatMap
 from sqlalchemy import text
 from import_traffic import get_db_engine 
 import import_traffic as tr
+import map_layers
 
 # ---------------------------------------------------------
 # Helper Function
@@ -18,13 +20,75 @@ def get_nearest_station(market_lat, market_lon, rain_info):
     # 找出距離最小的站點回傳
     return min(rain_info, key=lambda s: (s['lat']-market_lat)**2 + (s['lon']-market_lon)**2)
 
+def estimate_bounds(center_lat, center_lon, zoom, width_px=1000, height_px=850):
+    """
+    估算地圖第一次顯示時的可視範圍 (south, west, north, east)
+    Leaflet 每個 zoom 等級寬度加倍: 1 px = 360 / (256 * 2^zoom) 度經度, 緯度再乘上 cos(緯度)
+    """
+    deg_per_px = 360.0 / (256 * 2 ** zoom)
+    half_w = width_px / 2 * deg_per_px
+    half_h = height_px / 2 * deg_per_px * math.cos(math.radians(center_lat))
+    return (center_lat - half_h, center_lon - half_w, center_lat + half_h, center_lon + half_w)
+
+def parse_map_view(map_data):
+    """
+    從 st_folium 回傳值取出目前的地圖視角
+    回傳 {"bounds": (south, west, north, east), "zoom": int, "center": [lat, lon]}; 資料不完整時回傳 None
+    """
+    if not map_data or not map_data.get("bounds") or map_data.get("zoom") is None:
+        return None
+    sw, ne = map_data["bounds"].get("_southWest"), map_data["bounds"].get("_northEast")
+    if not sw or not ne or sw.get("lat") is None:
+        return None
+    center = map_data.get("center") or {}
+    return {
+        "bounds": (sw["lat"], sw["lng"], ne["lat"], ne["lng"]),
+        "zoom": int(map_data["zoom"]),
+        "center": [center.get("lat", (sw["lat"] + ne["lat"]) / 2), center.get("lng", (sw["lng"] + ne["lng"]) / 2)],
+    }
+
+def describe_time_filter(time_filter):
+    """時間篩選的顯示文字, 例如「2020~2022 年 / 22~2 時」; 沒有篩選時回傳 None"""
+    if not time_filter: return None
+    parts = []
+    if time_filter.get('years'):
+        y0, y1 = time_filter['years']
+        parts.append(f"{y0} 年" if y0 == y1 else f"{y0}~{y1} 年")
+    if time_filter.get('hours'):
+        h0, h1 = time_filter['hours']
+        parts.append(f"{h0}~{h1} 時" + (" (跨午夜)" if h0 > h1 else ""))
+    return " / ".join(parts) or None
+
 # ==========================================
 # 網站介面
 # ==========================================
 
-def render_sidebar(df_market):
+def render_time_filter(year_range=None):
+    """
+    側邊欄的時間篩選 (發生年度 / 發生時段)
+    回傳 {"years": (起, 迄) 或 None, "hours": (起, 迄) 或 None}; 選全部範圍時為 None (沿用預先計算的全期資料)
+    """
+    st.sidebar.markdown("---")
+    st.sidebar.subheader("⏱️ 時間篩選")
+
+    years = None
+    if year_range and year_range[0] < year_range[1]:
+        picked = st.sidebar.slider("發生年度", year_range[0], year_range[1], value=tuple(year_range), key='filter_years')
+        if tuple(picked) != tuple(year_range): years = tuple(picked)
+
+    h0, h1 = st.sidebar.slider("發生時段 (時)", 0, 23, value=(0, 23), key='filter_hours')
+    # 跨越午夜: 改成「右端 ~ 隔天左端」, 例如滑桿選 2~22 時 -> 22 時 ~ 隔天 2 時
+    overnight = st.sidebar.checkbox("跨越午夜 (右端 ~ 隔天左端)", key='filter_overnight')
+    hours = None
+    if overnight and h0 < h1: hours = (h1, h0)
+    elif (h0, h1) != (0, 23): hours = (h0, h1)
+
+    return {"years": years, "hours": hours}
+
+def render_sidebar(df_market, year_range=None):
     """
     負責繪製側邊欄 (Sidebar) 的所有元件
+    year_range: 事故資料的年度範圍 (最早, 最晚), 用來產生年度篩選滑桿; None 時只顯示時段篩選
     """
     st.sidebar.header("🔍 篩選導航")
     
@@ -121,9 +185,10 @@ def render_sidebar(df_market):
 
     # 定義所有的圖層開關 Key
     # 新增了 'show_stations' 來控制觀測站圖層
-    layer_keys = ['show_weather', 'show_traffic_heat', 'show_stations', 'show_night_market'] # 先移除'show_traffic_top10'
+    layer_keys = ['show_weather', 'show_traffic_heat', 'show_stations', 'show_night_market', 'show_traffic_points'] # 先移除'show_traffic_top10'
     for key in layer_keys:
-        if key not in st.session_state: st.session_state[key] = True
+        # 車禍點位 (聚合) 平移/縮放時要重新查詢, 預設關閉
+        if key not in st.session_state: st.session_state[key] = key != 'show_traffic_points'
 
     # 快速全選/取消按鈕的邏輯
     def select_all():
@@ -141,7 +206,8 @@ def render_sidebar(df_market):
         "weather": st.sidebar.checkbox("顯示降雨熱力", key='show_weather'),
         "stations": st.sidebar.checkbox("顯示氣象觀測站", key='show_stations'), # [New] 新增這行
         "traffic_heat": st.sidebar.checkbox("顯示車禍熱區 (全台)", key='show_traffic_heat'),
-        "night_market": st.sidebar.checkbox("顯示夜市位置", key='show_night_market')
+        "night_market": st.sidebar.checkbox("顯示夜市位置", key='show_night_market'),
+        "traffic_points": st.sidebar.checkbox("顯示車禍點位 (聚合)", key='show_traffic_points'),
       # "traffic_top10": st.sidebar.checkbox("顯示 TOP10 肇事點", key='show_traffic_top10') # 先移除'show_traffic_top10'
     }
     
@@ -151,17 +217,24 @@ def render_sidebar(df_market):
     if not is_overview:
         # 如果選了特定夜市，把那筆資料抓出來 (Series 物件)
         target_market = markets[markets['MarketName'] == st.session_state['nav_market']].iloc[0]
+
+    # 6. 時間篩選 (熱力圖、事故總數、周邊事故都會套用)
+    time_filter = render_time_filter(year_range)
         
-    # 回傳三個關鍵資訊給主程式：1.是否概覽模式 2.目標夜市資料 3.圖層開關狀態
-    return is_overview, target_market, layers
+    # 回傳四個關鍵資訊給主程式：1.是否概覽模式 2.目標夜市資料 3.圖層開關狀態 4.時間篩選
+    return is_overview, target_market, layers, time_filter
 
 # ---------------------------------------------------------
 # Folium 地圖建置
 # 這裡是「資料視覺化」的核心，負責把數據疊加到地圖上
 # ---------------------------------------------------------
-def build_map(is_overview, target_market, layers, weather_data, traffic_global, df_top10, df_market, df_local_accidents=None):
+def build_map(is_overview, target_market, layers, weather_data, traffic_global, df_top10, df_market, df_local_accidents=None, view=None,
+              df_clusters=None):
     # 1. 決定地圖的初始中心點和縮放比例 (Zoom Level)
-    if is_overview:
+    if is_overview and view:
+        # 概覽模式 (使用者已平移/縮放過)：沿用上次的視角, 重繪時地圖才不會跳回全島
+        m = folium.Map(location=view['center'], zoom_start=view['zoom'], tiles="CartoDB positron")
+    elif is_overview:
         # 概覽模式：中心點設在台灣中心 (南投附近)，縮放設 8 (可以看到全島)
         m = folium.Map(location=[23.7, 120.95], zoom_start=8, tiles="CartoDB positron")
     else:
@@ -181,22 +254,28 @@ def build_map(is_overview, target_market, layers, weather_data, traffic_global,
         # FeatureGroup 就像 Photoshop 的圖層，可以整組開關
         fg = folium.FeatureGroup(name="🌧️ 降雨熱力")
         if heat_data: 
-            # 繪製熱力圖，radius 是擴散半徑，blur 是模糊度
-            HeatMap(heat_data, radius=20, blur=25, min_opacity=0.3).add_to(fg)
+            # 繪製熱力圖，radius 是擴散半徑，blur 是模糊度 (資料量化打包, 由瀏覽器端解碼)
+            map_layers.CompactHeatMap(heat_data, radius=20, blur=25, min_opacity=0.3).add_to(fg)
         fg.add_to(m) # 把圖層貼到地圖底板上
 
     # 3. 堆疊圖層：全台車禍熱區
     if layers['traffic_heat']:
         # 確認 traffic_global 是有資料的列表
+        # 上萬個格子用 CompactHeatMap 打包 (整數格點 + 差分 + base64), 頁面大小約為原本 JSON 的 1/3
         if traffic_global and isinstance(traffic_global, list):
-            HeatMap(
+            map_layers.CompactHeatMap(
                 traffic_global, 
                 radius=15,       # 格子點
                 blur=10,         # 模糊度低一點，看起來比較精確
                 max_zoom=10,     # 拉近地圖後(Zoom > 10) 自動隱藏熱力圖，改看詳細藍點
+                weight_scale=1,  # 權重是事故數 (整數)
             ).add_to(m)
 
 
+    # 堆疊圖層：車禍點位 (伺服器端聚合, 只有可視範圍內該縮放層級的聚合點; 點擊聚合點會放大到分開的層級)
+    if layers.get('traffic_points') and df_clusters is not None and not df_clusters.empty:
+        map_layers.cluster_view_layer(df_clusters, "🚗 車禍詳細點位", popup=tr.ACCIDENT_POPUP).add_to(m)
+
     # 堆疊圖層：氣象觀測站
     if layers['stations']:
         # 1. 從 weather_data 解包取出 rain_info (是第 2 個元素)
@@ -204,60 +283,53 @@ def build_map(is_overview, target_market, layers, weather_data, traffic_global,
         _, rain_info, _, _ = weather_data
         
         if rain_info:
-            fg_stations = folium.FeatureGroup(name="☁️ 氣象觀測站", show=True)
-            for station in rain_info:
-                # 建立Popup 內容，顯示站名與即時雨量
-                popup_html = f"""
+            # 整個測站清單一次轉成 GeoJSON 圖層, Popup 版面共用 (顯示站名與即時雨量)
+            map_layers.point_layer(
+                pd.DataFrame(rain_info), "☁️ 氣象觀測站", show=True, max_width=200,
+                # 使用藍色雲朵圖示 (icon='cloud')
+                marker=folium.Marker(icon=folium.Icon(color='blue', icon='cloud', prefix='fa')),
+                popup="""
                 <div style="font-family: Arial; width: 150px;">
-                    <b>測站:</b> {station['name']}<br>
-                    <b>雨量:</b> {station['rain']} mm
+                    <b>測站:</b> {name}<br>
+                    <b>雨量:</b> {rain} mm
                 </div>
-                """
-                folium.Marker(
-                    location=[station['lat'], station['lon']],
-                    popup=folium.Popup(popup_html, max_width=200),
-                    # 使用藍色雲朵圖示 (icon='cloud')
-                    icon=folium.Icon(color='blue', icon='cloud', prefix='fa')
-                ).add_to(fg_stations)
-            
-            fg_stations.add_to(m)
+                """).add_to(m)
 
     # 4. 堆疊圖層：夜市位置標記
     if layers['night_market']:
-        fg_market = folium.FeatureGroup(name="🏠 夜市位置")
         if is_overview:
-            # 概覽模式：用迴圈畫出全台所有夜市的小圓點
-            for _, row in df_market.iterrows():
+            # 概覽模式：全台所有夜市的小圓點 (單一 GeoJSON 圖層, 不逐列建立 CircleMarker)
+            fg_market = map_layers.point_layer(
+                df_market, "🏠 夜市位置", max_width=300,
+                marker=folium.CircleMarker(radius=5, color='purple', fill=True, fill_opacity=0.7),
+                popup="""
+                <div style="width:250px">
+                    <h4>{MarketName}</h4>
+                    <hr>
+                    {ScheduleHTML}
+                </div>
+                """,
+                tooltip="{MarketName}")
+        else:
+            fg_market = folium.FeatureGroup(name="🏠 夜市位置")
+            if target_market is not None:
+                # 詳細模式：畫出該夜市的範圍(多邊形) + 一顆大星星
+                pts = target_market.get('poly_points', [])
+                if len(pts) > 1:
+                    folium.Polygon(pts, color="orange", weight=3, fill=True, fill_color="orange", fill_opacity=0.4).add_to(fg_market)
+            
                 status_html = f"""
                 <div style="width:250px">
-                    <h4>{row['MarketName']}</h4>
+                    <h3 style="color:purple">{target_market['MarketName']}</h3>
                     <hr>
-                    {row['ScheduleHTML']}
+                    {target_market['ScheduleHTML']}
                 </div>
                 """
-                folium.CircleMarker(
-                    location=[row['lat'], row['lon']], radius=5, color='purple', fill=True, fill_opacity=0.7,
-                    popup=folium.Popup(status_html, max_width=300), 
-                    tooltip=row['MarketName'] 
+                folium.Marker(
+                    [target_market['lat'], target_market['lon']], 
+                    popup=folium.Popup(status_html, max_width=350),
+                    icon=folium.Icon(color='purple', icon='star', prefix='fa')
                 ).add_to(fg_market)
-        elif target_market is not None:
-            # 詳細模式：畫出該夜市的範圍(多邊形) + 一顆大星星
-            pts = target_market.get('poly_points', [])
-            if len(pts) > 1:
-                folium.Polygon(pts, color="orange", weight=3, fill=True, fill_color="orange", fill_opacity=0.4).add_to(fg_market)
-            
-            status_html = f"""
-            <div style="width:250px">
-                <h3 style="color:purple">{target_market['MarketName']}</h3>
-                <hr>
-                {target_market['ScheduleHTML']}
-            </div>
-            """
-            folium.Marker(
-                [target_market['lat'], target_market['lon']], 
-                popup=folium.Popup(status_html, max_width=350),
-                icon=folium.Icon(color='purple', icon='star', prefix='fa')
-            ).add_to(fg_market)
         fg_market.add_to(m)
 
     # 5. 堆疊圖層：周邊十大易肇事路段 (只有詳細模式才顯示)
@@ -275,18 +347,10 @@ def build_map(is_overview, target_market, layers, weather_data, traffic_global,
 
         # 2. 以夜市為中心, 呈現事故(藍色點)
         if df_local_accidents is not None and not df_local_accidents.empty:
-            fg_details = folium.FeatureGroup(name="🔵 周邊事故詳情", show=True)
-            for _, row in df_local_accidents.iterrows():
-                folium.CircleMarker(
-                    location=[row['lat'], row['lon']],
-                    radius=3,           # 很小一顆
-                    color='blue',
-                    fill=True,
-                    fill_color='blue',
-                    fill_opacity=0.6,
-                    popup=f"位置: {row['weather_condition']}" 
-                ).add_to(fg_details)
-            fg_details.add_to(m)
+            map_layers.point_layer(
+                df_local_accidents, "🔵 周邊事故詳情", show=True,
+                marker=folium.CircleMarker(radius=3, color='blue', fill=True, fill_color='blue', fill_opacity=0.6), # 很小一顆
+                popup="位置: {weather_condition}").add_to(m)
     return m
 
 # ==========================================
@@ -294,12 +358,14 @@ def build_map(is_overview, target_market, layers, weather_data, traffic_global,
 # ==========================================
 
 # 增加兩個參數: station_data, risk_count
-def render_info_panel(is_overview, target_market, df_top10, weather_data, layers, station_data=None, risk_count=0, df_details=None):
+def render_info_panel(is_overview, target_market, df_top10, weather_data, layers, station_data=None, risk_count=0, df_details=None, time_filter=None):
     """負責繪製畫面右邊的資訊欄 (Info Panel)"""
     _, rain_info, _, top_station = weather_data
+    filter_text = describe_time_filter(time_filter)
     
     if is_overview:
         st.subheader("🇹🇼 全台概覽模式")
+        if filter_text: st.caption(f"⏱️ 車禍熱區篩選: {filter_text}")
         st.info("💡 點擊地圖上的夜市紫色圓點，或從左側選單選擇夜市，即可進入查看相關資訊")
         location_str = f"{top_station.get('city', '')} {top_station.get('town', '')}"
         st.metric(label="🌧️ 全台最大雨量", value=f"{top_station['rain']} mm", delta=f"{location_str} - {top_station['name']}")
@@ -312,6 +378,7 @@ def render_info_panel(is_overview, target_market, df_top10, weather_data, layers
         
         # --- 2. [新增] 進階分析儀表板 ---
         st.markdown("### 📊 風險與環境分析")
+        if filter_text: st.caption(f"⏱️ 事故統計篩選: {filter_text}")
         
         # 使用 columns 讓排版更整齊 (左右兩欄)
         col1, col2 = st.columns(2)
@@ -2,10 +2,17 @@ import pandas as pd
 import numpy as np
 from sqlalchemy import text
 from db_utils import get_db_engine
+import data_version as dv                   # 資料來源版本 token (快取失效用)
+from data_cache import cached, round_coord   # 共用資料快取 (請求合併 + LRU)
+
+def station_version():
+    """觀測站資料的快取版本 token (測站表有異動才換)"""
+    return dv.source_version("stations")
 
 # ==========================================
 # 1. 取得所有觀測站資料
 # ==========================================
+@cached(ignore=("engine",), persist=True, version=station_version)   # engine 只是共用連線, 不影響結果
 def get_all_stations(engine=None):
     if engine is None:
         engine = get_db_engine()
@@ -57,6 +64,8 @@ def haversine_distance(lat1, lon1, lat2, lon2):
     
     return R * c
 
+@cached(normalize={"target_lat": round_coord, "target_lon": round_coord},
+        skip=lambda r: r[0] is None, persist=True, version=station_version)   # 找不到測站 (查詢失敗) 時不快取
 def find_nearest_station(target_lat, target_lon):
     """
     輸入：目標地點 (夜市) 的經緯度
@@ -0,0 +1,529 @@
+import os
+import time
+import hashlib
+import argparse
+import tempfile
+import zipfile
+import queue
+import multiprocessing as mp
+from contextlib import contextmanager
+from functools import partial
+from datetime import datetime
+import pandas as pd
+from sqlalchemy import (create_engine, text, MetaData, Table, Column, Index, UniqueConstraint,
+                        Integer, BigInteger, String, DateTime)
+from db_utils import get_db_engine
+from accident_transform import MAIN_SCHEMA, DETAIL_SCHEMA, normalize_chunk, transform_data, split_tables
+import data_version
+import download_dataset
+
+# ==========================================
+# 交通事故資料 串流匯入 (取代 111year_traffic_Crawler.ipynb 的匯入流程)
+# - ZIP 直接從磁碟逐一開啟成員檔, CSV 用 chunksize 分批讀取, 記憶體只跟 chunksize 有關, 與檔案大小無關
+# - 每批: 讀取 -> 清洗 (transform_data) -> 大量寫入 (多列 upsert 或 LOAD DATA LOCAL INFILE REPLACE)
+# - 冪等: 主表依 accident_id、細節表依 (accident_id, party_sequence) upsert, 重跑不會重複
+# - 增量: ingest_manifest 記錄每個來源檔的內容雜湊, 內容沒變就整個略過 (新增年度只需匯入該年度)
+# - 斷點續傳: 每批寫完記錄進度, 中斷後重跑會從上次完成的批次之後繼續
+# - 有新資料寫入時更新 data_version (下游快取用版本當 key)
+# - 平行: --workers N 以多個子行程讀取 / 清洗不同檔案, 透過有上限的佇列交給單一寫入連線 (--max-memory-mb)
+# - 每個階段分別統計 rows/s
+# 執行: python ingest_accidents.py ../data/data_accident_partial/111年度A1交通事故資料.csv
+#       python ingest_accidents.py 111年度交通事故資料.zip --method infile
+# ==========================================
+
+ACCIDENT_DB = os.getenv("ACCIDENT_DB", "test_db")   # 事故資料所在的資料庫 (app 查詢 test_db.accident_main)
+DEFAULT_CHUNKSIZE = 50_000                          # 每批讀取的 CSV 列數
+DEFAULT_BATCH_ROWS = 5_000                          # 每次 executemany 的列數 (pymysql 會組成多列 INSERT)
+DEFAULT_MAX_MEMORY_MB = 2048                        # 平行模式的記憶體上限 (MB)
+WORKER_POLL_SECONDS = 1.0                           # 平行模式: 多久沒有新批次就檢查一次 worker 是否還活著
+STAGES = ("read", "transform", "load")
+VERSION_SOURCE = "accidents"                        # data_version 中的來源名稱
+
+# ==========================================
+# 1. 資料表
+# ==========================================
+def ensure_tables(engine, database=ACCIDENT_DB):
+    """建立 accident_main / accident_details / ingest_manifest (已存在則略過), 回傳 {表名: Table}"""
+    metadata = MetaData(schema=database)
+    main = Table(
+        "accident_main", metadata,
+        *[Column(v['name'], v['type'], primary_key=(v['name'] == 'accident_id'), autoincrement=False)
+          for v in MAIN_SCHEMA.values()],
+        Index("idx_lat_lon", "latitude", "longitude"))
+    details = Table(
+        "accident_details", metadata,
+        Column("d_id", Integer, primary_key=True, autoincrement=True),
+        *[Column(v['name'], v['type']) for v in DETAIL_SCHEMA.values()],
+        UniqueConstraint("accident_id", "party_sequence", name="uq_accident_party"))
+    manifest = Table(
+        "ingest_manifest", metadata,
+        Column("source_name", String(255), primary_key=True),  # CSV 檔名, ZIP 成員為 "壓縮檔:成員"
+        Column("content_sha256", String(64), nullable=False),
+        Column("status", String(10), nullable=False),          # running / done
+        Column("chunksize", Integer, nullable=False),
+        Column("chunks_done", Integer, nullable=False),        # 斷點: 已寫入的批次數
+        Column("rows_main", BigInteger, nullable=False),
+        Column("rows_detail", BigInteger, nullable=False),
+        Column("updated_at", DateTime, nullable=False))
+    data_version.version_table(metadata)
+    metadata.create_all(engine, checkfirst=True)
+    _ensure_detail_key(engine, database)
+    return {"accident_main": main, "accident_details": details, "ingest_manifest": manifest}
+
+def _ensure_detail_key(engine, database):
+    """舊版 notebook 建立的細節表沒有唯一鍵, 補上 (accident_id, party_sequence) 才能 upsert"""
+    with engine.connect() as conn:
+        exists = conn.execute(text("""
+        SELECT COUNT(*) FROM information_schema.statistics
+        WHERE table_schema = :db AND table_name = 'accident_details' AND index_name = 'uq_accident_party'
+        """), {"db": database}).scalar()
+    if exists: return
+    try:
+        with engine.begin() as conn:
+            conn.execute(text(f"ALTER TABLE {database}.accident_details "
+                              f"ADD UNIQUE KEY uq_accident_party (accident_id, party_sequence)"))
+        print("--- [系統] accident_details 已加上唯一鍵 (accident_id, party_sequence) ---")
+    except Exception as e:
+        print(f"[警告] accident_details 無法加上唯一鍵 (可能已有重複資料), 重跑時細節表可能重複: {e}")
+
+# ==========================================
+# 2. 大量寫入
+# ==========================================
+class BulkWriter:
+    """
+    method="insert": INSERT ... ON DUPLICATE KEY UPDATE + executemany
+                     (pymysql 會把多列組成一個 INSERT ... VALUES (...), (...) ON DUPLICATE KEY UPDATE ...)
+    method="infile": 每批先寫成暫存 CSV 再 LOAD DATA LOCAL INFILE ... REPLACE (最快, 需伺服器開啟 local_infile)
+    兩種方式都以主鍵 / 唯一鍵覆蓋舊資料, 同一批資料寫幾次結果都相同
+    只寫入 df 的欄位: geo_point (migrate_spatial_index.py) 是由經緯度算出的產生欄位, 由 MySQL 自動維護
+    """
+    def __init__(self, engine, database=ACCIDENT_DB, method="insert", batch_rows=DEFAULT_BATCH_ROWS):
+        self.database, self.method, self.batch_rows = database, method, batch_rows
+        if method == "infile":
+            # LOAD DATA LOCAL 需要在用戶端連線時開啟, 另外建一個專用的 Engine
+            engine = create_engine(engine.url, connect_args={"local_infile": True})
+        self.raw = engine.raw_connection()
+
+    def write(self, table, df):
+        """寫入一批資料 (已存在的鍵直接覆蓋), 回傳寫入的列數"""
+        if df.empty: return 0
+        columns = ", ".join(f"`{c}`" for c in df.columns)
+        cur = self.raw.cursor()
+        try:
+            if self.method == "infile":
+                self._load_infile(cur, table, columns, df)
+            else:
+                placeholders = ", ".join(["%s"] * len(df.columns))
+                updates = ", ".join(f"`{c}` = VALUES(`{c}`)" for c in df.columns)
+                sql = (f"INSERT INTO {self.database}.{table} ({columns}) VALUES ({placeholders}) "
+                       f"ON DUPLICATE KEY UPDATE {updates}")
+                # astype(object) 會把 NumPy 數值轉成 Python 型態, NaN 轉成 None (NULL)
+                records = list(df.astype(object).where(df.notna(), None).itertuples(index=False, name=None))
+                for start in range(0, len(records), self.batch_rows):
+                    cur.executemany(sql, records[start:start + self.batch_rows])
+            self.raw.commit()
+        except Exception:
+            self.raw.rollback()
+            raise
+        finally:
+            cur.close()
+        return len(df)
+
+    def _load_infile(self, cur, table, columns, df):
+        with tempfile.NamedTemporaryFile("w", suffix=".csv", delete=False, encoding="utf-8", newline="") as f:
+            df.to_csv(f, index=False, header=False, na_rep="NULL", lineterminator="\n")
+            path = f.name
+        try:
+            cur.execute(
+                f"LOAD DATA LOCAL INFILE %s REPLACE INTO TABLE {self.database}.{table} "
+                f"CHARACTER SET utf8mb4 FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '\"' ESCAPED BY '' "
+                f"LINES TERMINATED BY '\\n' ({columns})", (path,))
+        finally:
+            os.remove(path)
+
+    def close(self):
+        self.raw.close()
+
+# ==========================================
+# 3. 來源檔案 (CSV / ZIP / URL)
+# ==========================================
+def list_csv_sources(path):
+    """
+    回傳 [(來源名稱, 路徑, ZIP 成員名稱或 None), ...]
+    ZIP 檔只挑檔名包含 "A" 的 .csv 成員 (同 notebook)
+    """
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as z:
+            return [(f"{os.path.basename(path)}:{info.filename}", path, info.filename)
+                    for info in z.infolist()
+                    if info.filename.endswith('.csv') and "A" in os.path.basename(info.filename)]
+    return [(os.path.basename(path), path, None)]
+
+@contextmanager
+def open_source(path, member=None):
+    """開啟 CSV 或 ZIP 成員 (使用時才解壓縮串流讀取); 參數可序列化, 子行程也能自己開檔"""
+    if member is None:
+        with open(path, "rb") as f:
+            yield f
+    else:
+        with zipfile.ZipFile(path) as z, z.open(member) as f:
+            yield f
+
+# ==========================================
+# 4. 單一來源的讀取 / 清洗 / 寫入
+# ==========================================
+def _new_stats():
+    return {stage: {"seconds": 0.0, "rows": 0} for stage in STAGES}
+
+def _add(stats, stage, seconds, rows):
+    stats[stage]["seconds"] += seconds
+    stats[stage]["rows"] += rows
+
+def print_stats(stats, title):
+    print(f"--- [系統] {title} ---")
+    for stage in STAGES:
+        s = stats[stage]
+        rate = s["rows"] / s["seconds"] if s["seconds"] > 0 else 0
+        print(f"    {stage:10s} {s['rows']:>10,} 列 {s['seconds']:8.2f}s {rate:>12,.0f} rows/s")
+
+def iter_transformed(opener, chunksize=DEFAULT_CHUNKSIZE, skip_chunks=0):
+    """
+    分批讀取並清洗, 依序產生 (批次序號, 主表 df, 細節表 df, 原始列數, 讀取秒數, 清洗秒數)
+    skip_chunks: 斷點續傳時略過前面已寫入的批次 (只讀不清洗)
+    """
+    with opener() as f:
+        reader = pd.read_csv(f, encoding='utf-8-sig', chunksize=chunksize, low_memory=False)
+        i = 0
+        while True:
+            t0 = time.perf_counter()
+            try:
+                chunk = next(reader)
+            except StopIteration:
+                return
+            t1 = time.perf_counter()
+            if i >= skip_chunks:
+                df_m, df_d = split_tables(transform_data(normalize_chunk(chunk)))
+                yield i, df_m, df_d, len(chunk), t1 - t0, time.perf_counter() - t1
+            i += 1
+
+# ==========================================
+# 5. 匯入紀錄 (Manifest) 與資料版本
+# ==========================================
+def file_sha256(opener, chunk_bytes=1 << 20):
+    """串流計算來源檔內容的 SHA256 (ZIP 成員為解壓縮後的內容)"""
+    digest = hashlib.sha256()
+    with opener() as f:
+        for block in iter(lambda: f.read(chunk_bytes), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def plan_source(sha, entry, chunksize, force=False):
+    """
+    依上次的匯入紀錄決定這個來源要怎麼處理
+    回傳 None (內容未變更, 略過) 或 (略過的批次數, 已寫入主表列數, 已寫入細節表列數)
+    同一份內容上次中斷時, 從最後完成的批次之後繼續 (upsert 冪等, 重做一批也不會重複)
+    """
+    same = not force and entry is not None and entry["content_sha256"] == sha
+    if same and entry["status"] == "done":
+        return None
+    if same and entry["chunksize"] == chunksize:
+        return entry["chunks_done"], entry["rows_main"], entry["rows_detail"]
+    return 0, 0, 0
+
+class DbManifest:
+    """ingest_manifest 資料表的讀寫 (每個來源一列)"""
+    def __init__(self, engine, database=ACCIDENT_DB):
+        self.engine, self.database = engine, database
+        with engine.connect() as conn:
+            rows = conn.execute(text(f"SELECT * FROM {database}.ingest_manifest")).mappings().all()
+        self.entries = {row["source_name"]: dict(row) for row in rows}
+
+    def get(self, name):
+        return self.entries.get(name)
+
+    def save(self, name, sha, status, chunksize, chunks_done, rows_main, rows_detail):
+        entry = {"source_name": name, "content_sha256": sha, "status": status, "chunksize": chunksize,
+                 "chunks_done": chunks_done, "rows_main": rows_main, "rows_detail": rows_detail,
+                 "updated_at": datetime.now().replace(microsecond=0)}
+        columns = list(entry)
+        with self.engine.begin() as conn:
+            conn.execute(text(f"""
+            INSERT INTO {self.database}.ingest_manifest ({', '.join(columns)})
+            VALUES ({', '.join(':' + c for c in columns)})
+            ON DUPLICATE KEY UPDATE {', '.join(f'{c} = VALUES({c})' for c in columns[1:])}
+            """), entry)
+        self.entries[name] = entry
+
+    def version(self):
+        """所有已完成來源的內容雜湊組成的版本: 同樣的資料不論匯入幾次, 版本都相同"""
+        return data_version.content_version(
+            (n, e["content_sha256"]) for n, e in self.entries.items() if e["status"] == "done")
+
+# ==========================================
+# 6. 寫入端 (單一連線): 依序處理來源的事件
+# 循序模式與平行模式共用, 事件格式:
+#   ("skip", 名稱, sha) / ("start", 名稱, sha, plan) / ("chunk", 名稱, 序號, 主表, 細節表, 列數, 讀取秒, 清洗秒)
+#   ("end", 名稱) / ("error", 名稱, 訊息)
+# ==========================================
+class IngestSink:
+    def __init__(self, writer, chunksize, manifest=None, stats=None):
+        self.writer, self.chunksize, self.manifest = writer, chunksize, manifest
+        self.stats = stats if stats is not None else _new_stats()
+        self.sources = {}                         # 名稱 -> [sha, 主表列數, 細節表列數]
+        self.years = set()                        # 寫入過的事故年度 (匯入後重算夜市風險表用)
+        self.ingested, self.skipped, self.failed = [], [], []
+
+    def handle(self, event):
+        kind, name = event[0], event[1]
+        if kind == "skip":
+            print(f"    {name}: 內容未變更, 略過")
+            self.skipped.append(name)
+        elif kind == "start":
+            sha, (skip, base_main, base_detail) = event[2], event[3]
+            if skip:
+                print(f"    {name}: 從第 {skip + 1} 批繼續匯入")
+            self.sources[name] = [sha, base_main, base_detail]
+            self._save(name, "running", skip)
+        elif kind == "chunk":
+            i, df_m, df_d, n_rows, t_read, t_transform = event[2:]
+            t0 = time.perf_counter()
+            self.writer.write("accident_main", df_m)
+            self.writer.write("accident_details", df_d)
+            t_load = time.perf_counter() - t0
+            if "accident_year" in df_m:
+                self.years.update(int(y) for y in df_m["accident_year"].dropna().unique())
+            state = self.sources[name]
+            state[1] += len(df_m)
+            state[2] += len(df_d)
+            _add(self.stats, "read", t_read, n_rows)
+            _add(self.stats, "transform", t_transform, n_rows)
+            _add(self.stats, "load", t_load, len(df_m) + len(df_d))
+            self._save(name, "running", i + 1)   # 斷點: 這一批已寫入
+            print(f"    {name}: 第 {i + 1} 批 {n_rows:,} 列 "
+                  f"(讀取 {t_read:.2f}s / 清洗 {t_transform:.2f}s / 寫入 {t_load:.2f}s)")
+        elif kind == "end":
+            self._save(name, "done", 0)
+            self.ingested.append(name)
+            _, n_main, n_detail = self.sources[name]
+            print(f"--- [系統] {name} 完成: 主表 {n_main:,} 列, 細節表 {n_detail:,} 列 ---")
+        elif kind == "error":
+            # 匯入紀錄維持 running, 下次執行會從斷點繼續
+            print(f"[錯誤] {name} 匯入失敗: {event[2]}")
+            self.failed.append(name)
+
+    def _save(self, name, status, chunks_done):
+        if self.manifest is None: return
+        sha, n_main, n_detail = self.sources[name]
+        self.manifest.save(name, sha, status, self.chunksize, chunks_done, n_main, n_detail)
+
+def source_events(name, path, member, chunksize, entry=None, force=False):
+    """讀取 / 清洗單一來源, 依序產生寫入端要處理的事件 (循序模式在主行程執行, 平行模式在子行程執行)"""
+    opener = partial(open_source, path, member)
+    try:
+        sha = file_sha256(opener)
+        plan = plan_source(sha, entry, chunksize, force)
+        if plan is None:
+            yield ("skip", name, sha)
+            return
+        yield ("start", name, sha, plan)
+        for i, df_m, df_d, n_rows, t_read, t_transform in iter_transformed(opener, chunksize, plan[0]):
+            yield ("chunk", name, i, df_m, df_d, n_rows, t_read, t_transform)
+        yield ("end", name)
+    except Exception as e:
+        yield ("error", name, repr(e))
+
+# ==========================================
+# 7. 平行模式: 多個子行程讀取 / 清洗, 透過有上限的佇列交給單一寫入端
+# ==========================================
+# 記憶體估計 (以樣本 CSV 量測): 原始 + 清洗後的 DataFrame 每列約 2 KB, 拆成主表 / 細節表後約 0.7 KB
+WORKER_BYTES_PER_ROW = 2048
+QUEUED_BYTES_PER_ROW = 768
+PROCESS_OVERHEAD_MB = 120                # 每個 Python 行程載入 pandas 後的基本用量
+
+def plan_pipeline(workers, chunksize, max_memory_mb):
+    """
+    依記憶體上限決定實際的 worker 數與佇列長度, 回傳 (workers, queue_size)
+    總用量 ≈ workers x (行程 + 處理中的一批) + 佇列中的批次 + 寫入端 (行程 + 寫入中的一批)
+    """
+    per_worker = PROCESS_OVERHEAD_MB + chunksize * WORKER_BYTES_PER_ROW / 2**20
+    per_queued = chunksize * QUEUED_BYTES_PER_ROW / 2**20
+    writer = PROCESS_OVERHEAD_MB + 2 * per_queued
+    fit = int((max_memory_mb - writer - per_queued) // per_worker)
+    if fit < 1:
+        print(f"[警告] 記憶體上限 {max_memory_mb} MB 不足以執行 1 個 worker (chunksize={chunksize:,}), "
+              f"請調低 chunksize; 先以 1 個 worker 執行")
+    workers = max(1, min(workers, fit))
+    queue_size = int((max_memory_mb - writer - workers * per_worker) // per_queued)
+    queue_size = max(1, min(queue_size, 4 * workers))   # 佇列太長沒有好處, 只會多佔記憶體
+    return workers, queue_size
+
+def _worker_main(worker_id, task_q, result_q, chunksize, entries, force):
+    """
+    子行程: 從任務佇列取來源, 清洗後的批次放進結果佇列 (佇列滿時會等待, 記憶體不會無限成長)
+    每個事件都附上 worker_id; 取到來源時先送 ("take", 名稱), 主行程才知道 worker 異常結束時哪個來源沒做完
+    """
+    while True:
+        task = task_q.get()
+        if task is None:
+            break
+        name, path, member = task
+        result_q.put((worker_id, ("take", name)))
+        for event in source_events(name, path, member, chunksize, entries.get(name), force):
+            result_q.put((worker_id, event))
+    result_q.put((worker_id, ("exit", None)))
+
+def run_parallel(sources, sink, workers, chunksize, max_memory_mb, entries=None, force=False):
+    """sources: [(名稱, 路徑, 成員)], 事件由主行程的 sink (單一連線) 依到達順序寫入"""
+    workers, queue_size = plan_pipeline(min(workers, len(sources)), chunksize, max_memory_mb)
+    print(f"--- [系統] 平行匯入: {workers} 個 worker, 佇列上限 {queue_size} 批 "
+          f"(chunksize={chunksize:,}, 記憶體上限 {max_memory_mb:,} MB) ---")
+    ctx = mp.get_context()
+    task_q, result_q = ctx.Queue(), ctx.Queue(maxsize=queue_size)
+    for source in sources:
+        task_q.put(source)
+    for _ in range(workers):
+        task_q.put(None)
+
+    procs = [ctx.Process(target=_worker_main, args=(i, task_q, result_q, chunksize, entries or {}, force), daemon=True)
+             for i in range(workers)]
+    for p in procs:
+        p.start()
+
+    running = set(range(workers))   # 還沒送出 exit 的 worker
+    inflight = {}                   # worker_id -> 正在處理的來源名稱
+    taken = set()
+
+    def dispatch(worker_id, event):
+        kind = event[0]
+        if kind == "exit":
+            running.discard(worker_id)
+        elif kind == "take":
+            inflight[worker_id] = event[1]
+            taken.add(event[1])
+        else:
+            if kind in ("skip", "end", "error"):
+                inflight.pop(worker_id, None)
+            sink.handle(event)
+
+    try:
+        while running:
+            try:
+                dispatch(*result_q.get(timeout=WORKER_POLL_SECONDS))
+                continue
+            except queue.Empty:
+                pass
+            # 一段時間沒有新事件: 檢查有沒有 worker 已經結束卻沒送出 exit (例如被 OOM killer 強制結束)
+            dead = [i for i in running if procs[i].exitcode is not None]
+            if not dead:
+                continue
+            # 正常結束的 worker 在結束前就已送出 exit, 再讀一次佇列確認不是剛好還沒讀到
+            try:
+                dispatch(*result_q.get(timeout=WORKER_POLL_SECONDS))
+                continue
+            except queue.Empty:
+                pass
+            for i in dead:
+                running.discard(i)
+                name = inflight.pop(i, None)
+                print(f"[錯誤] worker {i} 異常結束 (exitcode {procs[i].exitcode})")
+                if name is not None:
+                    sink.handle(("error", name, f"worker 異常結束 (exitcode {procs[i].exitcode})"))
+        # 所有 worker 都異常結束時, 佇列裡還沒被取走的來源也算失敗 (下次執行會重新匯入)
+        for name, _, _ in sources:
+            if name not in taken:
+                sink.handle(("error", name, "沒有 worker 處理 (worker 全部異常結束)"))
+    finally:
+        for p in procs:
+            p.join(timeout=5)
+            if p.is_alive():
+                p.terminate()
+
+def run_sequential(sources, sink, chunksize, entries=None, force=False):
+    for name, path, member in sources:
+        for event in source_events(name, path, member, chunksize, (entries or {}).get(name), force):
+            sink.handle(event)
+
+def refresh_market_risk_years(engine, years):
+    """
+    重算夜市風險表中匯入過的年度, 讓查表結果跟上新資料
+    失敗時只印警告: 風險表記錄的資料版本與目前不同, 查表端會改用即時查詢, 不會顯示舊數字
+    """
+    import build_market_risk   # 只在匯入完成後需要 (會載入地圖相關模組, 平行匯入的子行程不用載入)
+    print(f"--- [系統] 重算夜市風險表: 年度 {years} ---")
+    try:
+        if build_market_risk.refresh_market_risk(years=years, engine=engine) is None:
+            print("[警告] 夜市風險表未更新, 查詢會改用即時資料 (可稍後執行 build_market_risk.py)")
+    except Exception as e:
+        print(f"[警告] 夜市風險表重算失敗, 查詢會改用即時資料: {e}")
+
+# ==========================================
+# 8. 匯入流程
+# ==========================================
+def ingest_paths(paths, chunksize=DEFAULT_CHUNKSIZE, method="insert", database=ACCIDENT_DB,
+                 batch_rows=DEFAULT_BATCH_ROWS, engine=None, force=False,
+                 workers=1, max_memory_mb=DEFAULT_MAX_MEMORY_MB, refresh_risk=True):
+    """
+    匯入多個來源 (本機 CSV / ZIP 路徑或下載網址)
+    內容與上次匯入相同的來源會略過 (force=True 時全部重新匯入)
+    workers > 1 時以多個子行程平行讀取 / 清洗, 寫入仍由單一連線負責
+    refresh_risk: 有寫入資料時, 重算夜市風險表中寫入過的年度 (build_market_risk.py --years)
+    回傳 {"stats": 各階段統計, "version": 資料版本, "ingested": [...], "skipped": [...], "failed": [...]}
+    """
+    engine = engine or get_db_engine()
+    if not engine:
+        print("Connection failed. Please check .env and db_utils.py")
+        return None
+
+    ensure_tables(engine, database)
+    manifest = DbManifest(engine, database)
+    writer = BulkWriter(engine, database, method, batch_rows)
+    sink = IngestSink(writer, chunksize, manifest)
+    started = time.perf_counter()
+    try:
+        sources = []
+        for path in paths:
+            if path.startswith(("http://", "https://")):
+                path = download_dataset.download(path)   # 快取在 DATA_CACHE_DIR, 伺服器檔案沒變就不重新下載
+            sources.extend(list_csv_sources(path))
+
+        if workers > 1 and len(sources) > 1:
+            run_parallel(sources, sink, workers, chunksize, max_memory_mb, manifest.entries, force)
+        else:
+            run_sequential(sources, sink, chunksize, manifest.entries, force)
+    finally:
+        writer.close()
+
+    if sink.ingested:
+        version = manifest.version()
+        with engine.begin() as conn:
+            data_version.set_data_version(conn, VERSION_SOURCE, version, database)
+    else:
+        version = data_version.get_data_version(VERSION_SOURCE, engine, database)
+
+    if refresh_risk and sink.years:
+        refresh_market_risk_years(engine, sorted(sink.years))
+
+    elapsed = time.perf_counter() - started
+    print_stats(sink.stats, f"匯入完成 ({elapsed:.1f}s, {sink.stats['read']['rows'] / elapsed:,.0f} rows/s), "
+                            f"新匯入 {len(sink.ingested)} 個 / 略過 {len(sink.skipped)} 個 / "
+                            f"失敗 {len(sink.failed)} 個, 資料版本 {version}")
+    return {"stats": sink.stats, "version": version,
+            "ingested": sink.ingested, "skipped": sink.skipped, "failed": sink.failed}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="交通事故資料 串流匯入 MySQL")
+    parser.add_argument("sources", nargs="+", help="CSV / ZIP 路徑或下載網址")
+    parser.add_argument("--chunksize", type=int, default=DEFAULT_CHUNKSIZE, help="每批讀取的 CSV 列數")
+    parser.add_argument("--method", choices=["insert", "infile"], default="insert",
+                        help="insert: 多列 INSERT ... ON DUPLICATE KEY UPDATE; infile: LOAD DATA LOCAL INFILE REPLACE")
+    parser.add_argument("--database", default=ACCIDENT_DB, help="目標資料庫")
+    parser.add_argument("--batch-rows", type=int, default=DEFAULT_BATCH_ROWS, help="每次 executemany 的列數")
+    parser.add_argument("--force", action="store_true", help="忽略匯入紀錄, 全部重新匯入")
+    parser.add_argument("--workers", type=int, default=1, help="平行讀取 / 清洗的子行程數 (1 = 循序)")
+    parser.add_argument("--max-memory-mb", type=int, default=DEFAULT_MAX_MEMORY_MB,
+                        help="整個匯入流程的記憶體上限 (決定實際 worker 數與佇列長度)")
+    parser.add_argument("--no-risk-refresh", action="store_true", help="匯入後不重算夜市風險表")
+    args = parser.parse_args()
+    ingest_paths(args.sources, args.chunksize, args.method, args.database, args.batch_rows,
+                 force=args.force, workers=args.workers, max_memory_mb=args.max_memory_mb,
+                 refresh_risk=not args.no_risk_refresh)
@@ -0,0 +1,267 @@
+import re
+import json
+import base64
+import numpy as np
+import pandas as pd
+import folium
+from folium.elements import JSCSSMixin
+from folium.map import Layer
+from folium.template import Template
+from folium.plugins import FastMarkerCluster
+from folium.utilities import JsCode
+
+# ==========================================
+# 地圖點位圖層 (向量化 GeoJSON / FastMarkerCluster)
+# 原本每一列 iterrows 建立一個 folium.Marker + 一段 Popup HTML:
+# Python 端要建立上萬個物件, 產生的 HTML 也會重複上萬次相同的版面
+# 改成:
+# - 整個 DataFrame 一次轉成單一 GeoJSON 圖層, 欄位值用向量化方式取出
+# - 樣式 (marker) 與 Popup 版面只寫一次, 由瀏覽器端依每個點的 properties 填入
+# Popup 版面用 {欄位名稱} 當佔位符, 例如 "<b>測站:</b> {Station_name}"; 只有版面用到的欄位會輸出
+# 熱力圖 (CompactHeatMap) 則把座標量化成整數格點、差分後用 base64 打包, 由瀏覽器端解碼
+# ==========================================
+
+_FIELD_PATTERN = re.compile(r"\{(\w+)\}")
+
+# 瀏覽器端: 用 properties 填入 Popup 版面 (值為 null 時顯示空字串)
+_FILL_JS = """function (template, p) {
+        return template.replace(/\\{(\\w+)\\}/g, function (m, k) { return p[k] == null ? '' : p[k]; });
+    }"""
+
+def template_fields(template):
+    """版面中用到的欄位名稱 (依出現順序, 不重複)"""
+    return list(dict.fromkeys(_FIELD_PATTERN.findall(template or "")))
+
+def _json_columns(df, fields):
+    """把欄位轉成可以直接 JSON 化的 Python 值: 時間轉字串、NaN 轉 None (整欄一次處理)"""
+    columns = {}
+    for field in fields:
+        col = df[field]
+        if pd.api.types.is_datetime64_any_dtype(col):
+            col = col.dt.strftime("%Y-%m-%d %H:%M:%S")
+        values = col.astype(object).where(col.notna(), None)
+        columns[field] = values.tolist()
+    return columns
+
+def _coordinates(df, lat, lon, precision):
+    """經緯度轉成 float 並四捨五入 (6 位小數約 0.1 m), 同時回傳有效座標的遮罩"""
+    lat_arr = pd.to_numeric(df[lat], errors="coerce").to_numpy(np.float64)
+    lon_arr = pd.to_numeric(df[lon], errors="coerce").to_numpy(np.float64)
+    valid = np.isfinite(lat_arr) & np.isfinite(lon_arr)
+    return np.round(lat_arr, precision), np.round(lon_arr, precision), valid
+
+def to_geojson(df, fields=(), lat="lat", lon="lon", precision=6):
+    """DataFrame -> GeoJSON FeatureCollection (Point), properties 只包含 fields; 座標缺漏的列會略過"""
+    lat_arr, lon_arr, valid = _coordinates(df, lat, lon, precision)
+    df = df[valid]
+    columns = _json_columns(df, fields)
+    props = [dict(zip(fields, values)) for values in zip(*columns.values())] if fields else [{}] * len(df)
+    features = [
+        {"type": "Feature", "geometry": {"type": "Point", "coordinates": [x, y]}, "properties": p}
+        for x, y, p in zip(lon_arr[valid].tolist(), lat_arr[valid].tolist(), props)]
+    return {"type": "FeatureCollection", "features": features}
+
+def _on_each_feature(popup, tooltip, max_width):
+    """所有點共用的 Popup / Tooltip 綁定函式 (版面只輸出一次)"""
+    lines = [f"var fill = {_FILL_JS};", "var p = feature.properties;"]
+    if popup:
+        lines.append(f"layer.bindPopup(fill({json.dumps(popup, ensure_ascii=False)}, p), {{maxWidth: {int(max_width)}}});")
+    if tooltip:
+        lines.append(f"layer.bindTooltip(fill({json.dumps(tooltip, ensure_ascii=False)}, p));")
+    return JsCode("function (feature, layer) {\n    " + "\n    ".join(lines) + "\n}")
+
+def point_layer(df, name, marker=None, popup=None, tooltip=None, lat="lat", lon="lon", show=True, max_width=300):
+    """
+    DataFrame -> 包含單一 GeoJSON 圖層的 FeatureGroup
+    marker: folium.CircleMarker / folium.Marker (只當作樣式範本, 不需要座標)
+    popup / tooltip: 版面字串, 用 {欄位名稱} 代入每個點的值
+    """
+    fg = folium.FeatureGroup(name=name, show=show)
+    if df is None or df.empty:
+        return fg
+    fields = template_fields(popup) + [f for f in template_fields(tooltip) if f not in template_fields(popup)]
+    folium.GeoJson(
+        to_geojson(df, fields, lat, lon),
+        marker=marker if marker is not None else folium.CircleMarker(radius=4, fill=True),
+        on_each_feature=_on_each_feature(popup, tooltip, max_width) if (popup or tooltip) else None,
+    ).add_to(fg)
+    return fg
+
+def cluster_layer(df, name, popup=None, icon=None, lat="lat", lon="lon", show=True, max_width=200):
+    """
+    DataFrame -> 包含 FastMarkerCluster 的 FeatureGroup (點位資料為陣列, 由瀏覽器端建立 marker)
+    icon: L.AwesomeMarkers.icon 的參數, 例如 {"icon": "exclamation-sign", "markerColor": "red"}
+    """
+    fg = folium.FeatureGroup(name=name, show=show)
+    if df is None or df.empty:
+        return fg
+    fields = template_fields(popup)
+    lat_arr, lon_arr, valid = _coordinates(df, lat, lon, 6)
+    columns = _json_columns(df[valid], fields)
+    data = [list(row) for row in zip(lat_arr[valid].tolist(), lon_arr[valid].tolist(), *columns.values())]
+
+    bind_popup = (f"marker.bindPopup(fill({json.dumps(popup, ensure_ascii=False)}, p), {{maxWidth: {int(max_width)}}});"
+                  if popup else "")
+    # FastMarkerCluster 會輸出成 "var callback = <運算式>;", 這裡用立即執行函式把共用版面包在 closure 裡
+    callback = f"""(function () {{
+        var fill = {_FILL_JS};
+        var fields = {json.dumps(fields)};
+        var icon = L.AwesomeMarkers.icon({json.dumps(icon or {})});
+        return function (row) {{
+            var p = {{}};
+            for (var i = 0; i < fields.length; i++) p[fields[i]] = row[i + 2];
+            var marker = L.marker(new L.LatLng(row[0], row[1]), {{icon: icon}});
+            {bind_popup}
+            return marker;
+        }};
+    }})()"""
+    FastMarkerCluster(data, callback=callback).add_to(fg)
+    return fg
+
+# 伺服器端聚合點的圖示: 數字泡泡, 大小依事故數的位數遞增 (與 Leaflet.markercluster 的外觀相近)
+_CLUSTER_ICON_JS = """function (count) {
+        var size = 30 + 8 * Math.min(String(count).length - 1, 4);
+        var label = count >= 10000 ? Math.round(count / 1000) + 'k' : count;
+        return L.divIcon({
+            html: '<div style="width:' + size + 'px;height:' + size + 'px;line-height:' + size + 'px;'
+                + 'border-radius:50%;background:rgba(230,80,60,0.75);color:white;font:bold 12px Arial;'
+                + 'text-align:center;box-shadow:0 0 0 4px rgba(230,80,60,0.3);">' + label + '</div>',
+            className: '', iconSize: [size, size]});
+    }"""
+
+def cluster_view_layer(df, name, popup=None, lat="lat", lon="lon", show=True, max_width=200):
+    """
+    伺服器端聚合結果 (accident_clusters.get_clusters) -> 單一 GeoJSON 圖層
+    count > 1 的列畫成數字泡泡, 點擊後跳到 expansion_zoom; 只有 1 筆的列畫成紅點並綁定 popup 版面
+    """
+    fg = folium.FeatureGroup(name=name, show=show)
+    if df is None or df.empty:
+        return fg
+    fields = ["count", "expansion_zoom"] + [f for f in template_fields(popup) if f not in ("count", "expansion_zoom")]
+    bind_popup = (f"layer.bindPopup(fill({json.dumps(popup, ensure_ascii=False)}, p), {{maxWidth: {int(max_width)}}});"
+                  if popup else "")
+    on_each_feature = JsCode(f"""function (feature, layer) {{
+    var fill = {_FILL_JS};
+    var clusterIcon = {_CLUSTER_ICON_JS};
+    var p = feature.properties;
+    if (p.count > 1) {{
+        layer.setIcon(clusterIcon(p.count));
+        layer.on('click', function (e) {{ e.target._map.setView(e.latlng, p.expansion_zoom); }});
+    }} else {{
+        layer.setIcon(L.divIcon({{className: '', iconSize: [10, 10],
+            html: '<div style="width:10px;height:10px;border-radius:50%;background:#d33;border:1px solid white;"></div>'}}));
+        {bind_popup}
+    }}
+}}""")
+    folium.GeoJson(to_geojson(df, fields, lat, lon), marker=folium.Marker(), on_each_feature=on_each_feature).add_to(fg)
+    return fg
+
+# ==========================================
+# 精簡熱力圖 (Compact HeatMap)
+# folium.HeatMap 把每個點輸出成完整精度的 JSON ([25.0825, 121.5225, 37.0], 約 24 bytes),
+# 全島概覽每次 rerun 都要重送上萬組; 改成:
+# 1. 經緯度除以 precision 量化成整數格點 (預設 0.0001° 約 11 m, 熱力圖看不出差異), 權重乘上 weight_scale 取整數
+# 2. 依 (緯度, 經度) 排序後差分: 緯度存與上一點的差; 同一列的經度存與上一點的差, 換列時存與最小經度的差
+# 3. 每一欄選最小的整數型態 (1 / 2 / 4 bytes, little-endian), base64 後放進頁面
+# 瀏覽器端用 TypedArray 還原成 [lat, lon, weight] 再交給 L.heatLayer
+# ==========================================
+_INT_TYPES = (("u1", np.uint8), ("u2", np.uint16), ("u4", np.uint32), ("i1", np.int8), ("i2", np.int16), ("i4", np.int32))
+
+def _pack(values):
+    """整數陣列 -> {"t": 型態代號, "b": base64}, 型態取放得下的最小者"""
+    values = np.asarray(values, dtype=np.int64)
+    lo, hi = (int(values.min()), int(values.max())) if len(values) else (0, 0)
+    for code, dtype in _INT_TYPES:
+        info = np.iinfo(dtype)
+        if info.min <= lo and hi <= info.max:
+            raw = values.astype(np.dtype(dtype).newbyteorder("<")).tobytes()
+            return {"t": code, "b": base64.b64encode(raw).decode("ascii")}
+    raise ValueError("heat data out of int32 range")
+
+def _unpack(column):
+    dtype = dict(_INT_TYPES)[column["t"]]
+    return np.frombuffer(base64.b64decode(column["b"]), dtype=np.dtype(dtype).newbyteorder("<")).astype(np.int64)
+
+def encode_heat(data, precision=1e-4, weight_scale=10):
+    """
+    [[lat, lon], ...] 或 [[lat, lon, weight], ...] -> 精簡格式 dict (可直接 JSON 化)
+    權重缺漏時每點視為 1; 量化後重複的格點不合併 (與原本逐點輸出的熱度相同)
+    """
+    arr = np.asarray(data, dtype=np.float64).reshape(-1, np.shape(data)[1] if len(data) else 2)
+    arr = arr[np.isfinite(arr).all(axis=1)]
+    qy = np.round(arr[:, 0] / precision).astype(np.int64)
+    qx = np.round(arr[:, 1] / precision).astype(np.int64)
+    order = np.lexsort((qx, qy))
+    qy, qx = qy[order], qx[order]
+    y0 = int(qy[0]) if len(qy) else 0
+    x0 = int(qx.min()) if len(qx) else 0
+
+    dy = np.diff(qy, prepend=y0)
+    row_start = np.ones(len(qy), dtype=bool)
+    row_start[1:] = dy[1:] != 0
+    dx = np.where(row_start, qx - x0, qx - np.roll(qx, 1))
+    payload = {"n": int(len(qy)), "p": precision, "y0": y0, "x0": x0, "dy": _pack(dy), "dx": _pack(dx)}
+    if arr.shape[1] > 2:
+        payload["s"] = weight_scale
+        payload["w"] = _pack(np.round(arr[order, 2] * weight_scale))
+    return payload
+
+def decode_heat(payload):
+    """encode_heat 的反函式 (與瀏覽器端解碼相同的邏輯, 測試 / 量測用) -> (n, 2 或 3) 陣列"""
+    dy, dx = _unpack(payload["dy"]), _unpack(payload["dx"])
+    qy = payload["y0"] + np.cumsum(dy)
+    row_start = np.ones(len(dy), dtype=bool)
+    row_start[1:] = dy[1:] != 0
+    # 每一列的起點是絕對位置 (相對 x0), 列內再累加差分
+    row_id = np.cumsum(row_start) - 1
+    cum = np.cumsum(dx)
+    base = (cum - dx)[row_start][row_id]
+    qx = payload["x0"] + cum - base
+    columns = [qy * payload["p"], qx * payload["p"]]
+    if "w" in payload:
+        columns.append(_unpack(payload["w"]) / payload["s"])
+    return np.column_stack(columns) if len(dy) else np.zeros((0, len(columns)))
+
+class CompactHeatMap(JSCSSMixin, Layer):
+    """
+    與 folium.plugins.HeatMap 相同的熱力圖層 (同一個 leaflet-heat.js 與參數), 但資料用 encode_heat 打包
+    data: [[lat, lon], ...] 或 [[lat, lon, weight], ...]
+    """
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+            var {{ this.get_name() }} = L.heatLayer(
+                (function (p) {
+                    var types = {u1: Uint8Array, u2: Uint16Array, u4: Uint32Array,
+                                 i1: Int8Array, i2: Int16Array, i4: Int32Array};
+                    function column(c) {
+                        var raw = atob(c.b), bytes = new Uint8Array(raw.length);
+                        for (var i = 0; i < raw.length; i++) bytes[i] = raw.charCodeAt(i);
+                        return new types[c.t](bytes.buffer);
+                    }
+                    var dy = column(p.dy), dx = column(p.dx), w = p.w ? column(p.w) : null;
+                    var out = new Array(p.n), y = p.y0, x = p.x0;
+                    for (var i = 0; i < p.n; i++) {
+                        y += dy[i];
+                        x = (i === 0 || dy[i] !== 0) ? p.x0 + dx[i] : x + dx[i];
+                        out[i] = w ? [y * p.p, x * p.p, w[i] / p.s] : [y * p.p, x * p.p];
+                    }
+                    return out;
+                })({{ this.payload|tojson }}),
+                {{ this.options|tojavascript }}
+            );
+        {% endmacro %}
+        """)
+
+    default_js = [
+        ("leaflet-heat.js",
+         "https://cdn.jsdelivr.net/gh/python-visualization/folium@main/folium/templates/leaflet_heat.min.js"),
+    ]
+
+    def __init__(self, data, name=None, min_opacity=0.5, max_zoom=18, radius=25, blur=15, gradient=None,
+                 overlay=True, control=True, show=True, precision=1e-4, weight_scale=10, **kwargs):
+        super().__init__(name=name, overlay=overlay, control=control, show=show)
+        self._name = "CompactHeatMap"
+        self.payload = encode_heat(data, precision, weight_scale)
+        self.options = {k: v for k, v in dict(
+            min_opacity=min_opacity, max_zoom=max_zoom, radius=radius, blur=blur, gradient=gradient, **kwargs
+        ).items() if v is not None}
@@ -0,0 +1,106 @@
+import os
+import json
+import threading
+
+# ==========================================
+# 夜市風險表 (預先計算結果的讀寫)
+# 由 build_market_risk.py 批次產生, get_zone_stats 以 O(1) 查表取代即時 COUNT
+# 檔案格式 (JSON):
+# {
+#   "mode": "box" | "spatial",          # 計算時使用的半徑判斷方式
+#   "radii_km": [0.3, 0.5, 1.0, 2.0],
+#   "radius_key": "m",                  # 半徑 key 的格式 (公尺整數)
+#   "built_at": "...",
+#   "source_version": "...",            # 計算時事故資料的版本 (data_version 表), 與目前版本不同時不使用
+#   "markets": {
+#       "25.08800,121.52400": {
+#           "name": "士林夜市", "lat": ..., "lon": ...,
+#           "by_year": {"2022": {"1000": [事故數, 死亡數, 受傷數], ...}, ...}
+#       }, ...
+#   }
+# }
+# ==========================================
+
+DATA_CACHE_DIR = os.getenv(
+    "DATA_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data", "cache"))
+MARKET_RISK_FILE = os.path.join(DATA_CACHE_DIR, "market_risk.json")
+RADII_KM = (0.3, 0.5, 1.0, 2.0)
+RADIUS_KEY_FORMAT = "m"     # 舊版檔案以小數 1 位的公里當 key (1.04km 會讀到 1.0km 的數字), 格式不同時整份重算
+
+_cache = {"mtime": None, "data": None}
+_lock = threading.Lock()
+
+def market_key(lat, lon):
+    """夜市座標 -> 查表用的 key (小數 5 位, 約 1 公尺)"""
+    return f"{float(lat):.5f},{float(lon):.5f}"
+
+def radius_key(radius_km):
+    """半徑 -> 查表用的 key (公尺整數), 只有完全相同的半徑才會對到"""
+    return str(round(float(radius_km) * 1000))
+
+def load_market_risk(path=MARKET_RISK_FILE):
+    """讀取風險表 (檔案有更新才重新讀取), 檔案不存在時回傳 None"""
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return None
+    if _cache["mtime"] != mtime:
+        with _lock:
+            if _cache["mtime"] != mtime:
+                try:
+                    with open(path, encoding="utf-8") as f:
+                        _cache["data"] = json.load(f)
+                    _cache["mtime"] = mtime
+                except (OSError, ValueError) as e:
+                    print(f"[警告] 夜市風險表讀取失敗: {e}")
+                    return None
+    return _cache["data"]
+
+def data_version():
+    """風險表的版本 (產生時間), 可當快取 key; 不存在時回傳 None"""
+    data = load_market_risk()
+    return data.get("built_at") if data else None
+
+def save_market_risk(data, path=MARKET_RISK_FILE):
+    """寫入風險表: 先寫暫存檔再 os.replace, 讀取端不會讀到寫一半的檔案"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+def summarize(entry, radius_km, radii_km):
+    """
+    加總各年度, 回傳 (事故數, 死亡數, 受傷數)
+    radii_km: 風險表計算過的半徑; radius_km 不在其中時回傳 None (沒有事故的夜市 by_year 是空的, 不能用它判斷)
+    """
+    rk = radius_key(radius_km)
+    if rk not in {radius_key(r) for r in radii_km}:
+        return None
+    total = [0, 0, 0]
+    for per_radius in entry["by_year"].values():
+        if rk not in per_radius:
+            return None
+        for i, v in enumerate(per_radius[rk]):
+            total[i] += v
+    return tuple(total)
+
+def is_current(data, source_version=None):
+    """風險表是否可以使用: key 格式相同, 且 (有提供目前的事故資料版本時) 計算時的版本與目前相同"""
+    if data.get("radius_key") != RADIUS_KEY_FORMAT:
+        return False
+    return source_version is None or data.get("source_version") == source_version
+
+def lookup_zone_count(lat, lon, radius_km, mode="box", source_version=None):
+    """
+    查詢預先計算好的事故數: 座標不在表中、半徑沒算過、計算方式不同、
+    或風險表比目前的事故資料舊 (source_version 不同) 時回傳 None (由呼叫端改查即時資料)
+    """
+    data = load_market_risk()
+    if not data or data.get("mode") != mode or not is_current(data, source_version):
+        return None
+    entry = data["markets"].get(market_key(lat, lon))
+    if entry is None:
+        return None
+    stats = summarize(entry, radius_km, data.get("radii_km", ()))
+    return None if stats is None else stats[0]
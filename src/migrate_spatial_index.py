@@ -0,0 +1,88 @@
+import argparse
+import time
+from sqlalchemy import text
+from db_utils import get_db_engine
+from import_traffic import SPATIAL_COLUMN
+
+# ==========================================
+# accident_main 空間索引 Migration
+# 新增 POINT SRID 4326 欄位 + SPATIAL INDEX, 讓半徑查詢可以走 R-Tree
+# 欄位是 STORED 產生欄位 (由 latitude / longitude 算出): 匯入流程 (ingest_accidents) 不用另外提供,
+# INSERT / ON DUPLICATE KEY UPDATE / LOAD DATA REPLACE 改到座標時也會自動更新
+# 執行: python migrate_spatial_index.py            (建立)
+#       python migrate_spatial_index.py --rollback (移除)
+# ==========================================
+
+DEFAULT_TABLE = "test_db.accident_main"
+INDEX_NAME = "sidx_geo_point"
+
+# 座標缺漏或超出範圍的資料給一個台灣範圍外的佔位點 (SPATIAL INDEX 欄位不能是 NULL)
+# POINT(x, y) 的 x 為經度、y 為緯度; ST_SRID 只標上 SRID, 不會交換座標軸
+_POINT_EXPR = """
+CASE
+    WHEN latitude BETWEEN -90 AND 90 AND longitude BETWEEN -180 AND 180
+    THEN ST_SRID(POINT(longitude, latitude), 4326)
+    ELSE ST_SRID(POINT(0, 0), 4326)
+END
+"""
+
+def _column_extra(conn, table):
+    """回傳欄位的 EXTRA (產生欄位為 'STORED GENERATED'); 欄位不存在時回傳 None"""
+    schema, name = table.split(".")
+    sql = text("""
+    SELECT EXTRA FROM information_schema.COLUMNS
+    WHERE TABLE_SCHEMA = :schema AND TABLE_NAME = :name AND COLUMN_NAME = :col
+    """)
+    row = conn.execute(sql, {"schema": schema, "name": name, "col": SPATIAL_COLUMN}).fetchone()
+    return None if row is None else (row[0] or "")
+
+def _column_exists(conn, table):
+    return _column_extra(conn, table) is not None
+
+def add_spatial_column(engine, table=DEFAULT_TABLE):
+    """
+    1. 新增 STORED 產生欄位 (ALTER 時一次算好全部資料列)
+       舊版 migration 建立的一般欄位 (需要匯入流程自己填, 會變成過期座標) 先移除再重建
+    2. 建立 SPATIAL INDEX
+    """
+    started = time.perf_counter()
+    with engine.begin() as conn:
+        extra = _column_extra(conn, table)
+        if extra is not None and "STORED GENERATED" in extra.upper():
+            print(f"--- [Migration] {table}.{SPATIAL_COLUMN} 已存在, 略過新增欄位 ---")
+        else:
+            if extra is not None:
+                print(f"--- [Migration] {table}.{SPATIAL_COLUMN} 為一般欄位, 改為產生欄位 ---")
+                conn.execute(text(f"ALTER TABLE {table} DROP COLUMN {SPATIAL_COLUMN}"))   # 索引會一併移除
+            print(f"--- [Migration] 新增 {table}.{SPATIAL_COLUMN} (STORED 產生欄位) ---")
+            conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {SPATIAL_COLUMN} POINT SRID 4326 "
+                              f"GENERATED ALWAYS AS ({_POINT_EXPR}) STORED NOT NULL"))
+
+        print("--- [Migration] 建立 SPATIAL INDEX ---")
+        indexes = conn.execute(text(f"SHOW INDEX FROM {table} WHERE Key_name = :name"), {"name": INDEX_NAME}).fetchall()
+        if not indexes:
+            conn.execute(text(f"CREATE SPATIAL INDEX {INDEX_NAME} ON {table} ({SPATIAL_COLUMN})"))
+    print(f"--- [Migration] 完成, 耗時 {time.perf_counter() - started:.1f}s ---")
+
+def drop_spatial_column(engine, table=DEFAULT_TABLE):
+    """Rollback: 移除 SPATIAL INDEX 與 POINT 欄位 (查詢會自動退回 BETWEEN 方框)"""
+    with engine.begin() as conn:
+        if not _column_exists(conn, table):
+            print(f"--- [Migration] {table}.{SPATIAL_COLUMN} 不存在, 不需移除 ---")
+            return
+        conn.execute(text(f"ALTER TABLE {table} DROP COLUMN {SPATIAL_COLUMN}"))  # 索引會一併移除
+    print(f"--- [Migration] 已移除 {table}.{SPATIAL_COLUMN} ---")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="accident_main 空間索引 Migration")
+    parser.add_argument("--table", default=DEFAULT_TABLE, help="資料表 (schema.table)")
+    parser.add_argument("--rollback", action="store_true", help="移除空間欄位與索引")
+    args = parser.parse_args()
+
+    engine = get_db_engine()
+    if not engine:
+        print("Connection failed. Please check .env and db_utils.py")
+    elif args.rollback:
+        drop_spatial_column(engine, args.table)
+    else:
+        add_spatial_column(engine, args.table)
@@ -0,0 +1,78 @@
+import os
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import data_cache
+import import_night_market as nm
+import import_market_profile as mp
+
+# ==========================================
+# 夜市詳細頁 快取預熱 (Cache Warmer)
+# 夜市只有 ~480 個, 但第一個點進某個夜市的使用者要負擔整組查詢 (最近測站 + 事故風險 / Top 10 / 500m 明細)
+# 這裡預先把每個夜市的詳細頁資料跑一次, 填進共用資料快取 (記憶體 + 磁碟層),
+# 之後點任何夜市都直接命中
+# - 指令列: python warm_market_cache.py --workers 4 (結果寫入磁碟層, 伺服器的 Process 直接讀取)
+# - 伺服器啟動時: .env 設定 CACHE_WARMUP_ON_START=1 (app.py 在背景執行緒執行, 不擋住第一個畫面)
+# ==========================================
+
+WARMUP_ON_START = os.getenv("CACHE_WARMUP_ON_START", "0") == "1"
+WARMUP_WORKERS = int(os.getenv("CACHE_WARMUP_WORKERS", "4"))   # 並行數, 應小於連線池大小 (留連線給使用者)
+PROGRESS_EVERY = 50
+
+def warm_market_cache(workers=WARMUP_WORKERS, limit=None, risk_radius_km=1.0, detail_radius_km=0.5):
+    """
+    依序預熱所有夜市的詳細頁快取 (最多 workers 個夜市同時查詢)
+    參數與 app.main 呼叫 fetch_market_profile 時相同, 快取 key 才會一致
+    回傳 {"markets", "failed", "queries", "elapsed"}; 讀不到夜市清單時回傳 None
+    """
+    started = time.perf_counter()
+    df_market = nm.get_all_nightmarkets()
+    if df_market.empty:
+        print("[錯誤] 讀不到夜市資料, 略過快取預熱")
+        return None
+    if limit:
+        df_market = df_market.head(limit)
+
+    markets = list(zip(df_market['MarketName'], df_market['lat'], df_market['lon']))
+    misses_before = data_cache.stats()["misses"]
+    print(f"--- [系統] 快取預熱: {len(markets)} 個夜市 (並行 {workers}) ---")
+
+    def run(market):
+        name, lat, lon = market
+        return name, mp.warm_market_profile(lat, lon, risk_radius_km, detail_radius_km)
+
+    done, failed = 0, {}
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="cache-warmer") as pool:
+        for name, errors in pool.map(run, markets):
+            done += 1
+            if errors:
+                failed[name] = errors
+            if done % PROGRESS_EVERY == 0 or done == len(markets):
+                print(f"    進度: {done}/{len(markets)} ({time.perf_counter() - started:.1f}s, 失敗 {len(failed)})")
+
+    elapsed = time.perf_counter() - started
+    queries = data_cache.stats()["misses"] - misses_before
+    for name, errors in list(failed.items())[:10]:
+        print(f"[警告] 預熱失敗: {name} {errors}")
+    print(f"--- [系統] 快取預熱完成: {len(markets) - len(failed)}/{len(markets)} 個夜市, "
+          f"實際查詢 {queries} 次, 共 {elapsed:.1f}s ---")
+    return {"markets": len(markets), "failed": failed, "queries": queries, "elapsed": elapsed}
+
+def start_background_warmup(workers=WARMUP_WORKERS):
+    """在背景執行緒預熱 (伺服器啟動時使用), 回傳該執行緒"""
+    def run():
+        try:
+            warm_market_cache(workers)
+        except Exception as e:
+            print(f"[錯誤] 快取預熱中斷: {e}")
+    thread = threading.Thread(target=run, name="cache-warmer", daemon=True)
+    thread.start()
+    return thread
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="夜市詳細頁 快取預熱")
+    parser.add_argument("--workers", type=int, default=WARMUP_WORKERS, help="同時預熱的夜市數")
+    parser.add_argument("--limit", type=int, help="只預熱前 N 個夜市 (測試用)")
+    args = parser.parse_args()
+    warm_market_cache(workers=args.workers, limit=args.limit)